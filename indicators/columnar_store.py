@@ -0,0 +1,231 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+DATA_DIR = "data"
+# Directory (relative to the data dir) that holds the typed, memory-mappable copies of the clean csv files
+STORE_DIR = "columnar"
+
+COVID_DF_NAMES = {
+    'Cumulative Cases per 100K people': "confirmed_cumulative_cases_prop_fips",
+    'Daily New Cases per 100K people': "confirmed_daily_incidence_cases_prop_fips",
+    "Cumulative Deaths per 100K people": "cumulative_deaths_prop_fips",
+    "Daily Deaths per 100K people": "daily_incidence_deaths_prop_fips",
+    "Daily % Covid-Related Doctor Visits": "perc_covid_doctor_visits_fips",
+    "% People Wearing Masks in Public in Past 5 Days": "perc_people_wearing_masks_fips",
+    "% People Tested for Covid in Past 14 Days": "perc_people_tested_fips",
+    "% Positive Covid Tests in Past 14 Days": "perc_positive_tests_fips",
+    "% People not Tested who Wanted Tests": "perc_wanted_test_fips"
+}
+
+USDA_DF_NAMES = {
+    'Poverty': "poverty_2018",
+    'Unemployment and Median HHI': "unemployment_median_hhi_2018",
+    'Population': "population_2018",
+    'Education': "education_2018"
+}
+
+# Suffix of the covid tables that only hold the latest row of each county (see indicators.preprocess_covid)
+LATEST_SUFFIX = "_latest"
+
+COVID_CSV_DIR = "covidcast/clean"
+USDA_CSV_DIR = "usda_county_datasets/clean"
+FIPS_CSV_DIR = "fips/clean"
+COUNTY_FIPS_NAME = "county_fips_2019"
+STATE_FIPS_NAME = "state_fips_2019"
+
+# String columns with few distinct values are stored as categoricals so we don't repeat them on every row
+CATEGORICAL_COLUMNS = ["State Name", "Area Name", "State Abrv", "Name"]
+FIPS_COLUMNS = ["FIPS", "State FIPS", "County FIPS"]
+DATE_COLUMNS = ["time_value", "issue"]
+# Covid values only have a few significant digits, single precision halves their footprint
+FLOAT32_COLUMNS = ["value"]
+
+
+def csv_path(data_dir, csv_dir, name):
+    return f"{data_dir}/{csv_dir}/{name}.csv"
+
+
+def store_path(data_dir, name):
+    return f"{data_dir}/{STORE_DIR}/{name}.feather"
+
+
+def resolve_revisions(df):
+    # Ingested history files can hold several issues of a (FIPS, day), appended in issue order. The latest one wins,
+    # before negative values are dropped so a revision to a negative value hides the row it revised
+    if "issue" not in df.columns or not df.duplicated(["FIPS", "time_value"]).any():
+        return df
+    df = df.sort_values("issue", kind="stable")
+    return df[~df.duplicated(["FIPS", "time_value"], keep="last")]
+
+
+def clean_covid_df(df):
+    df = resolve_revisions(df)
+    # Remove rows with values < 0.0 (not possible)
+    df = df[df['value'] >= 0.0].copy()
+    # Convert time_value column into datetime type
+    df['time_value'] = pd.to_datetime(df['time_value'])
+    return df
+
+
+def latest_name(name):
+    return f"{name}{LATEST_SUFFIX}"
+
+
+def latest_per_county(df):
+    # Most recent row of every county, in FIPS order. Rows with values < 0.0 are dropped first, like they are on load
+    df = df[df["value"] >= 0.0]
+    df = df.sort_values("time_value", kind="stable")
+    df = df[~df.duplicated("FIPS", keep="last")]
+    return df.sort_values("FIPS", kind="stable")
+
+
+def to_typed_df(df):
+    df = df.reset_index(drop=True)
+    for col in df.columns:
+        if col in FIPS_COLUMNS:
+            df[col] = df[col].astype("int32")
+        elif col in DATE_COLUMNS:
+            df[col] = pd.to_datetime(df[col])
+        elif col in CATEGORICAL_COLUMNS:
+            df[col] = df[col].astype("category")
+        elif col in FLOAT32_COLUMNS:
+            df[col] = df[col].astype("float32")
+    return df
+
+
+def write_table(df, data_dir, name):
+    os.makedirs(f"{data_dir}/{STORE_DIR}", exist_ok=True)
+    path = store_path(data_dir, name)
+    tmp_path = f"{path}.tmp"
+    # Uncompressed feather files can be memory mapped, compressed ones have to be decoded into memory
+    feather.write_feather(to_typed_df(df), tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+    return path
+
+
+def has_typed_schema(path):
+    # Stores written before the float32 columns were introduced have to be rebuilt, only the file footer is read
+    with pa.memory_map(path) as source:
+        schema = pa.ipc.open_file(source).schema
+    return all(schema.field(col).type == pa.float32() for col in FLOAT32_COLUMNS if col in schema.names)
+
+
+def is_stale(data_dir, csv_dir, name):
+    path = store_path(data_dir, name)
+    source = csv_path(data_dir, csv_dir, name)
+    if not os.path.exists(path):
+        return True
+    if os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(path):
+        return True
+    return not has_typed_schema(path)
+
+
+def read_table(data_dir, name):
+    # Memory map the file so numeric columns are backed by the page cache instead of a private copy. The mapped
+    # columns are read-only and every session and worker process that maps the same file shares the same pages.
+    # The arrow buffers keep the map alive, so the file is not closed here
+    source = pa.memory_map(store_path(data_dir, name))
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def read_csv_table(data_dir, csv_dir, name):
+    df = pd.read_csv(csv_path(data_dir, csv_dir, name), index_col=0)
+    if csv_dir == COVID_CSV_DIR:
+        df = clean_covid_df(df)
+    # County tables are stored in FIPS order so each state's rows are contiguous
+    if "FIPS" in df.columns:
+        df = df.sort_values("FIPS", kind="stable")
+    return to_typed_df(df)
+
+
+def load_table(data_dir, csv_dir, name):
+    # Fall back to parsing the csv if the store hasn't been built (or is older than the csv)
+    if is_stale(data_dir, csv_dir, name):
+        return read_csv_table(data_dir, csv_dir, name)
+    return read_table(data_dir, name)
+
+
+def load_covid_table(name, data_dir=DATA_DIR):
+    return load_table(data_dir, COVID_CSV_DIR, name)
+
+
+def table_mtime(data_dir, csv_dir, name):
+    # When a table's rows last changed: its csv, or its store if only the store was shipped. None if neither exists
+    for path in (csv_path(data_dir, csv_dir, name), store_path(data_dir, name)):
+        if os.path.exists(path):
+            return os.path.getmtime(path)
+    return None
+
+
+def is_latest_stale(data_dir, name):
+    # A latest table is out of date once its history has been written after it
+    latest_mtime = table_mtime(data_dir, COVID_CSV_DIR, latest_name(name))
+    history_mtime = table_mtime(data_dir, COVID_CSV_DIR, name)
+    return latest_mtime is None or (history_mtime is not None and history_mtime > latest_mtime)
+
+
+def load_covid_latest_table(name, data_dir=DATA_DIR):
+    # One row per county, derived from the full history if the latest table hasn't been preprocessed or is older than
+    # its history
+    if is_latest_stale(data_dir, name):
+        return latest_per_county(load_covid_table(name, data_dir))
+    return load_table(data_dir, COVID_CSV_DIR, latest_name(name))
+
+
+def load_usda_table(name, data_dir=DATA_DIR):
+    return load_table(data_dir, USDA_CSV_DIR, name)
+
+
+def load_fips_table(name, data_dir=DATA_DIR):
+    return load_table(data_dir, FIPS_CSV_DIR, name)
+
+
+def all_tables():
+    tables = [(COVID_CSV_DIR, name) for name in COVID_DF_NAMES.values()]
+    tables.extend((COVID_CSV_DIR, latest_name(name)) for name in COVID_DF_NAMES.values())
+    tables.extend((USDA_CSV_DIR, name) for name in USDA_DF_NAMES.values())
+    tables.extend([(FIPS_CSV_DIR, COUNTY_FIPS_NAME), (FIPS_CSV_DIR, STATE_FIPS_NAME)])
+    return tables
+
+
+def table_paths(csv_dir, names, data_dir=DATA_DIR):
+    # Every file a table can be loaded from, used to tell when a loaded table is out of date
+    return [path for name in names for path in (csv_path(data_dir, csv_dir, name), store_path(data_dir, name))]
+
+
+def covid_paths(data_dir=DATA_DIR):
+    names = list(COVID_DF_NAMES.values())
+    return table_paths(COVID_CSV_DIR, names + [latest_name(name) for name in names], data_dir)
+
+
+def usda_paths(data_dir=DATA_DIR):
+    return table_paths(USDA_CSV_DIR, USDA_DF_NAMES.values(), data_dir)
+
+
+def fips_paths(name, data_dir=DATA_DIR):
+    return table_paths(FIPS_CSV_DIR, [name], data_dir)
+
+
+def build_table(data_dir, csv_dir, name):
+    path = write_table(read_csv_table(data_dir, csv_dir, name), data_dir, name)
+    print(f"Wrote {path}")
+    return path
+
+
+def build_store(data_dir=DATA_DIR, force=False):
+    for csv_dir, name in all_tables():
+        if not os.path.exists(csv_path(data_dir, csv_dir, name)):
+            print(f"Skipping {name}, no csv found")
+            continue
+        if not force and not is_stale(data_dir, csv_dir, name):
+            print(f"{name} is up to date")
+            continue
+        build_table(data_dir, csv_dir, name)
+
+
+if __name__ == "__main__":
+    build_store()
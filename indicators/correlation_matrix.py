@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+
+# State FIPS used for the nationwide rows, same as the "United States" row in the USDA tables
+NATIONAL_FIPS = 0
+CORRELATION_METHODS = ["Pearson", "Spearman"]
+NON_MEASURE_COLUMNS = ["FIPS", "State Abrv", "Area Name"]
+
+
+def usda_measures(usda_data):
+    # One column per socioeconomic measure across all USDA tables, one row per county
+    measures = None
+    for usda_df in usda_data.values():
+        usda_df = usda_df[usda_df["FIPS"] % 1000 != 0]  # remove non-county rows
+        usda_df = usda_df[[col for col in usda_df.columns if col not in NON_MEASURE_COLUMNS] + ["FIPS"]]
+        usda_df = usda_df.drop_duplicates("FIPS").set_index("FIPS")
+        measures = usda_df if measures is None else measures.join(usda_df, how="outer")
+    return measures
+
+
+def covid_summaries(covid_data):
+    # Cumulative features are already one (latest) row per county, the others are averaged over their whole history
+    summaries = {covid_feature: covid_df.groupby("FIPS", observed=True)["value"].mean()
+                 for covid_feature, covid_df in covid_data.items()}
+    return pd.DataFrame(summaries)
+
+
+def pairwise_sums(u, c, state_starts):
+    # Sums needed for a pairwise complete Pearson r between every column of u and every column of c, reduced per state.
+    # Each term is a (county x measure x feature) tensor summed over the county rows of each state with reduceat
+    u_present = ~np.isnan(u)
+    c_present = ~np.isnan(c)
+    u0 = np.where(u_present, u, 0.0)
+    c0 = np.where(c_present, c, 0.0)
+
+    def per_state(left, right):
+        return np.add.reduceat(left[:, :, None] * right[:, None, :], state_starts, axis=0)
+
+    count = per_state(u_present.astype(np.float64), c_present.astype(np.float64))
+    sum_u = per_state(u0, c_present)
+    sum_c = per_state(u_present, c0)
+    sum_uu = per_state(u0 * u0, c_present)
+    sum_cc = per_state(u_present, c0 * c0)
+    sum_uc = per_state(u0, c0)
+    return count, sum_u, sum_c, sum_uu, sum_cc, sum_uc
+
+
+def pearson_from_sums(count, sum_u, sum_c, sum_uu, sum_cc, sum_uc):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = sum_uc - sum_u * sum_c / count
+        var_u = sum_uu - sum_u * sum_u / count
+        var_c = sum_cc - sum_c * sum_c / count
+        r = cov / np.sqrt(var_u * var_c)
+    r[(count < 3) | (var_u <= 0) | (var_c <= 0)] = np.nan
+    return np.clip(r, -1.0, 1.0)
+
+
+def standardize(values):
+    # Shifting and scaling each column doesn't change r but keeps the sums of squares well conditioned
+    # (population counts squared are ~1e14 otherwise)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.nanstd(values, axis=0)
+        return (values - np.nanmean(values, axis=0)) / np.where(std > 0, std, 1.0)
+
+
+def correlate(u, c, state_starts):
+    sums = pairwise_sums(u, c, state_starts)
+    national_sums = [term.sum(axis=0, keepdims=True) for term in sums]
+    return pearson_from_sums(*national_sums)[0], pearson_from_sums(*sums)
+
+
+def paired_pearson(a, b, state_starts):
+    # Pearson r between column i of a and column i of b, where both have the same missing values
+    present = ~np.isnan(a)
+    a0 = np.where(present, a, 0.0)
+    b0 = np.where(present, b, 0.0)
+
+    def per_state(values):
+        return np.add.reduceat(values, state_starts, axis=0)
+
+    return pearson_from_sums(per_state(present.astype(np.float64)), per_state(a0), per_state(b0),
+                             per_state(a0 * a0), per_state(b0 * b0), per_state(a0 * b0))
+
+
+def spearman(aligned, measure_names, feature_names, state_fips, state_starts):
+    # Spearman's rho is Pearson's r over ranks, where the ranks are taken over the counties that have both values.
+    # For each covid feature every measure column is paired up with its own masked copy of the feature, so all
+    # measures are ranked (per state and nationwide) in one groupby per feature
+    measures = aligned[measure_names]
+    national = np.empty((len(measure_names), len(feature_names)))
+    per_state = np.empty((len(state_starts), len(measure_names), len(feature_names)))
+    for j, feature in enumerate(feature_names):
+        feature_values = aligned[feature].to_numpy(dtype=np.float64)
+        both = measures.notna().to_numpy() & ~np.isnan(feature_values)[:, None]
+        measure_pairs = measures.where(both)
+        feature_pairs = pd.DataFrame(np.where(both, feature_values[:, None], np.nan), index=measures.index,
+                                     columns=measure_names)
+
+        per_state[:, :, j] = paired_pearson(measure_pairs.groupby(state_fips).rank().to_numpy(dtype=np.float64),
+                                            feature_pairs.groupby(state_fips).rank().to_numpy(dtype=np.float64),
+                                            state_starts)
+        national[:, j] = paired_pearson(measure_pairs.rank().to_numpy(dtype=np.float64),
+                                        feature_pairs.rank().to_numpy(dtype=np.float64), [0])[0]
+    return national, per_state
+
+
+def to_long_df(matrix, measures, features, state_fips, method):
+    rows = pd.DataFrame(matrix.reshape(-1, len(features)), columns=features)
+    rows["Measure"] = np.tile(measures, len(matrix))
+    rows["State FIPS"] = np.repeat(state_fips, len(measures))
+    rows = rows.melt(id_vars=["State FIPS", "Measure"], var_name="Covid Feature", value_name="r")
+    rows["Method"] = method
+    return rows
+
+
+def correlation_matrix(usda_data, covid_data):
+    # Pearson and Spearman correlations between every USDA measure and every covid feature, nationwide and for each
+    # state, in one batched pass over FIPS aligned arrays. Returns a long frame with columns
+    # [State FIPS, Measure, Covid Feature, r, Method] where State FIPS == NATIONAL_FIPS is the nationwide value
+    measures = usda_measures(usda_data)
+    summaries = covid_summaries(covid_data)
+    aligned = measures.join(summaries, how="outer").sort_index()
+    measure_names = list(measures.columns)
+    feature_names = list(summaries.columns)
+
+    state_fips = aligned.index.to_numpy() // 1000
+    states, state_starts = np.unique(state_fips, return_index=True)
+
+    u = standardize(aligned[measure_names].to_numpy(dtype=np.float64))
+    c = standardize(aligned[feature_names].to_numpy(dtype=np.float64))
+    pearson_national, pearson_states = correlate(u, c, state_starts)
+
+    spearman_national, spearman_states = spearman(aligned, measure_names, feature_names, state_fips, state_starts)
+
+    frames = []
+    for method, national, per_state in [("Pearson", pearson_national, pearson_states),
+                                        ("Spearman", spearman_national, spearman_states)]:
+        frames.append(to_long_df(national[None], measure_names, feature_names, [NATIONAL_FIPS], method))
+        frames.append(to_long_df(per_state, measure_names, feature_names, states, method))
+    return pd.concat(frames, ignore_index=True)
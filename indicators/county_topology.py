@@ -0,0 +1,180 @@
+import json
+import os
+import sys
+from urllib.request import urlopen
+
+import numpy as np
+
+DATA_DIR = "data"
+# Bundled county geometry. Streamlit serves the static dir next to the app (server.enableStaticServing in
+# .streamlit/config.toml) at STATIC_URL, so browsers fetch and cache each file instead of getting it inlined in every
+# chart spec
+STATIC_DIR = "static"
+STATIC_URL = "app/static"
+GEO_DIR = "geo"
+# Same file that vega_datasets.data.us_10m.url points to, only needed when (re)building the bundled files
+US_10M_URL = "https://cdn.jsdelivr.net/npm/vega-datasets@v1.29.0/data/us-10m.json"
+# Douglas-Peucker tolerance in quantized topojson units (the us-10m grid is 10,000 x 10,000 for the whole country)
+SIMPLIFY_TOLERANCE = 1.5
+COUNTIES_OBJECT = "counties"
+
+
+def topology_file(state_fips=None):
+    # Relative to the static dir
+    return f"{GEO_DIR}/us_counties.json" if state_fips is None else f"{GEO_DIR}/states/{int(state_fips):02d}.json"
+
+
+def national_topology_path(static_dir=STATIC_DIR):
+    return f"{static_dir}/{topology_file()}"
+
+
+def state_topology_path(state_fips, static_dir=STATIC_DIR):
+    return f"{static_dir}/{topology_file(state_fips)}"
+
+
+def read_source_topology(source):
+    if source.startswith("http://") or source.startswith("https://"):
+        with urlopen(source) as response:
+            return json.load(response)
+    with open(source, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def decode_arcs(topology):
+    # Quantized topologies store each arc as deltas from the previous point
+    arcs = [np.array(arc, dtype=np.float64).reshape(-1, 2) for arc in topology["arcs"]]
+    if "transform" in topology:
+        arcs = [np.cumsum(arc, axis=0) for arc in arcs]
+    return arcs
+
+
+def encode_arc(points, quantized):
+    if quantized:
+        points = points.astype(np.int64)
+        points = np.vstack((points[:1], np.diff(points, axis=0)))
+        return points.tolist()
+    return points.tolist()
+
+
+def douglas_peucker(points, tolerance):
+    # Iterative Douglas-Peucker that always keeps the end points, so arcs shared by two counties still meet
+    if len(points) <= 2:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(segment[0], segment[1])
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        furthest = int(np.argmax(distances))
+        if distances[furthest] > tolerance:
+            split = start + 1 + furthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return points[keep]
+
+
+def simplify_arcs(arcs, tolerance):
+    simplified = []
+    for arc in arcs:
+        simple = douglas_peucker(arc, tolerance)
+        # Closed rings made of a single arc need at least 4 points to stay a valid polygon
+        if np.array_equal(arc[0], arc[-1]) and len(simple) < 4:
+            simple = arc
+        simplified.append(simple)
+    return simplified
+
+
+def geometry_arc_ids(geometry):
+    if geometry["type"] == "Polygon":
+        return [arc for ring in geometry["arcs"] for arc in ring]
+    if geometry["type"] == "MultiPolygon":
+        return [arc for polygon in geometry["arcs"] for ring in polygon for arc in ring]
+    return []
+
+
+def remap_geometry_arcs(geometry, arc_map):
+    def remap(arc):
+        # Negative ids (~i) reference arc i in reverse
+        return arc_map[arc] if arc >= 0 else ~arc_map[~arc]
+
+    geometry = dict(geometry)
+    if geometry["type"] == "Polygon":
+        geometry["arcs"] = [[remap(arc) for arc in ring] for ring in geometry["arcs"]]
+    elif geometry["type"] == "MultiPolygon":
+        geometry["arcs"] = [[[remap(arc) for arc in ring] for ring in polygon] for polygon in geometry["arcs"]]
+    return geometry
+
+
+def subset_topology(topology, arcs, geometries):
+    # Only keep the arcs the given geometries reference, renumbered from 0
+    used_arcs = sorted({arc if arc >= 0 else ~arc for geometry in geometries for arc in geometry_arc_ids(geometry)})
+    arc_map = {old: new for new, old in enumerate(used_arcs)}
+    quantized = "transform" in topology
+    subset = {
+        "type": "Topology",
+        "objects": {
+            COUNTIES_OBJECT: {
+                "type": "GeometryCollection",
+                "geometries": [remap_geometry_arcs(geometry, arc_map) for geometry in geometries]
+            }
+        },
+        "arcs": [encode_arc(arcs[arc], quantized) for arc in used_arcs]
+    }
+    if quantized:
+        subset["transform"] = topology["transform"]
+    return subset
+
+
+def write_topology(topology, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(topology, f, separators=(",", ":"))
+
+
+def build_topologies(source=US_10M_URL, static_dir=STATIC_DIR, tolerance=SIMPLIFY_TOLERANCE):
+    topology = read_source_topology(source)
+    arcs = simplify_arcs(decode_arcs(topology), tolerance)
+    counties = [geometry for geometry in topology["objects"][COUNTIES_OBJECT]["geometries"] if "id" in geometry]
+
+    write_topology(subset_topology(topology, arcs, counties), national_topology_path(static_dir))
+    print(f"Wrote {national_topology_path(static_dir)}")
+
+    counties_by_state = {}
+    for county in counties:
+        counties_by_state.setdefault(int(county["id"]) // 1000, []).append(county)
+    for state_fips, state_counties in counties_by_state.items():
+        write_topology(subset_topology(topology, arcs, state_counties), state_topology_path(state_fips, static_dir))
+    print(f"Wrote {len(counties_by_state)} state topologies to {static_dir}/{GEO_DIR}/states")
+
+
+def topology_path(state_fips=None, static_dir=STATIC_DIR):
+    return f"{static_dir}/{topology_file(state_fips)}"
+
+
+def topology_url(state_fips=None):
+    # Relative to the page, so it resolves against whatever host and base path the app is served under
+    return f"{STATIC_URL}/{topology_file(state_fips)}"
+
+
+def load_county_topology(state_fips=None, static_dir=STATIC_DIR):
+    # Returns None if the bundled files haven't been built
+    path = topology_path(state_fips, static_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    # Optionally pass a local copy of us-10m.json so the build doesn't need network access
+    build_topologies(*sys.argv[1:2])
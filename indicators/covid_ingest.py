@@ -0,0 +1,240 @@
+import json
+import os
+import sys
+from datetime import date
+
+import pandas as pd
+import pyarrow.feather as feather
+
+from indicators import columnar_store
+from indicators.preprocess_covid import COVID_SIGNALS, drop_non_county_rows, merge_covid_and_county_fips_dfs, \
+    write_csv
+
+# Ingested covidcast rows, relative to the data dir: one directory per signal with one file per month of time_value
+PARTITION_DIR = "covidcast/partitions"
+MANIFEST_FILE = "manifest.json"
+KEY_COLUMNS = ["FIPS", "time_value"]
+PARTITION_COLUMNS = ["FIPS", "time_value", "issue", "value"]
+# Days of issues before the last one received that are requested again, covidcast can publish (part of) an issue late
+REISSUE_DAYS = 3
+
+
+def partition_dir(data_dir, name):
+    return f"{data_dir}/{PARTITION_DIR}/{name}"
+
+
+def partition_path(data_dir, name, month):
+    return f"{partition_dir(data_dir, name)}/{month}.feather"
+
+
+def manifest_path(data_dir, name):
+    return f"{partition_dir(data_dir, name)}/{MANIFEST_FILE}"
+
+
+def read_manifest(data_dir, name):
+    path = manifest_path(data_dir, name)
+    if not os.path.exists(path):
+        return {"last_issue": None, "months": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, data_dir, name):
+    path = manifest_path(data_dir, name)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def covidcast_fetcher(name, data_source, signal, first_issue, last_issue):
+    # Every row issued in [first_issue, last_issue], whatever day it is for
+    import covidcast
+    return covidcast.signal(data_source=data_source, signal=signal, geo_type="county",
+                            issues=(first_issue or date(2020, 1, 1), last_issue))
+
+
+def local_fetcher(raw_dir):
+    # Stand-in for the covidcast API that serves the rows of previously downloaded raw files (same columns as
+    # covidcast.signal) by issue, so ingestion can be run and checked offline
+    def fetch(name, data_source, signal, first_issue, last_issue):
+        raw_name = COVID_SIGNALS[name][0]
+        path = f"{raw_dir}/{raw_name}.csv"
+        if not os.path.exists(path):
+            return None
+        df = pd.read_csv(path, index_col=0)
+        issues = pd.to_datetime(df["issue"])
+        in_range = issues <= pd.Timestamp(last_issue)
+        if first_issue is not None:
+            in_range &= issues >= pd.Timestamp(first_issue)
+        return df[in_range]
+    return fetch
+
+
+def to_partition_rows(raw_df):
+    df = drop_non_county_rows(raw_df).rename(columns={"geo_value": "FIPS"})[PARTITION_COLUMNS]
+    return df.astype({"FIPS": "int32", "time_value": "datetime64[ns]", "issue": "datetime64[ns]",
+                      "value": "float64"})
+
+
+def resolve_revisions(df):
+    # Keep the most recent issue of every (FIPS, day)
+    df = df.sort_values("issue", kind="stable")
+    df = df[~df.duplicated(KEY_COLUMNS, keep="last")]
+    return df.sort_values(KEY_COLUMNS).reset_index(drop=True)
+
+
+def read_partition(data_dir, name, month):
+    path = partition_path(data_dir, name, month)
+    if not os.path.exists(path):
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in
+                             [("FIPS", "int32"), ("time_value", "datetime64[ns]"), ("issue", "datetime64[ns]"),
+                              ("value", "float64")]})
+    return feather.read_feather(path)
+
+
+def write_partition(df, data_dir, name, month):
+    path = partition_path(data_dir, name, month)
+    tmp_path = f"{path}.tmp"
+    feather.write_feather(df, tmp_path, compression="uncompressed")
+    os.replace(tmp_path, path)
+
+
+def read_history(data_dir, name, manifest):
+    months = sorted(manifest["months"])
+    if not months:
+        return read_partition(data_dir, name, None)
+    return pd.concat([read_partition(data_dir, name, month) for month in months], ignore_index=True)
+
+
+def merge_into_partitions(new_rows, data_dir, name, manifest):
+    # Only the months the new rows fall in are read and rewritten. Returns the rows that were added or revised
+    changed = []
+    months = new_rows["time_value"].dt.strftime("%Y-%m")
+    for month, month_rows in new_rows.groupby(months):
+        existing = read_partition(data_dir, name, month)
+        merged = resolve_revisions(pd.concat([existing, month_rows], ignore_index=True))
+        # Rows of the merged partition that weren't in the old one, i.e. new days or newer issues
+        before = existing.merge(merged, how="right", on=PARTITION_COLUMNS, indicator=True)
+        changed.append(before.loc[before["_merge"] == "right_only", PARTITION_COLUMNS])
+        if len(changed[-1]):
+            write_partition(merged, data_dir, name, month)
+        manifest["months"][month] = len(merged)
+    return pd.concat(changed, ignore_index=True) if changed else new_rows.iloc[:0]
+
+
+def update_latest(latest, changed, data_dir, name, manifest):
+    # Latest non-negative row of every county, updated from the changed rows only. Latest rows that were revised are
+    # dropped first, then the newest non-negative row of every county is taken from the rest and the changed rows.
+    # Every non-negative row newer than a county's old latest row is a changed row, so that is right unless the old
+    # latest row was revised to a negative value: those counties are looked up in their history instead
+    revised = pd.MultiIndex.from_frame(latest[KEY_COLUMNS]).isin(pd.MultiIndex.from_frame(changed[KEY_COLUMNS]))
+    updated = columnar_store.latest_per_county(pd.concat([latest[~revised], changed], ignore_index=True))
+    previous_days = latest[revised].set_index("FIPS")["time_value"]
+    updated_days = updated.set_index("FIPS")["time_value"].reindex(previous_days.index)
+    lost = previous_days.index[~(updated_days >= previous_days)]
+    if len(lost):
+        history = read_history(data_dir, name, manifest)
+        recomputed = columnar_store.latest_per_county(history[history["FIPS"].isin(lost)])
+        updated = pd.concat([updated[~updated["FIPS"].isin(lost)], recomputed]).sort_values("FIPS", kind="stable")
+    return updated.reset_index(drop=True)
+
+
+def read_latest(data_dir, name, manifest):
+    path = columnar_store.csv_path(data_dir, columnar_store.COVID_CSV_DIR, columnar_store.latest_name(name))
+    if manifest["last_issue"] is None or not manifest.get("exported", True) or not os.path.exists(path):
+        return columnar_store.latest_per_county(read_history(data_dir, name, manifest))
+    return pd.read_csv(path, index_col=0, parse_dates=["time_value", "issue"])[PARTITION_COLUMNS]
+
+
+def with_names(df, county_fips):
+    # Partition rows in the layout of the clean csv files indicators.preprocess_covid writes
+    df = df.rename(columns={"FIPS": "geo_value"})
+    df = merge_covid_and_county_fips_dfs(df, county_fips)
+    return df.astype({"time_value": str, "issue": str}).reset_index(drop=True)
+
+
+def history_fingerprint(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def append_history(changed, county_fips, data_dir, name, manifest, rewrite=False):
+    # The clean history csv is a log of rows: changed rows are appended, revisions after the rows they revise, and
+    # readers keep the latest issue of every (FIPS, day) (see columnar_store.read_csv_table). The whole history is
+    # written from the partitions instead on the first ingest, after a run that crashed before its export finished,
+    # and when the csv isn't the one the last ingest left (e.g. preprocess_covid rewrote it)
+    path = columnar_store.csv_path(data_dir, columnar_store.COVID_CSV_DIR, name)
+    if rewrite or not os.path.exists(path) or manifest.get("history_file") != history_fingerprint(path):
+        write_csv(with_names(read_history(data_dir, name, manifest), county_fips), path)
+    else:
+        with open(path, "a", encoding="utf-8", newline="") as f:
+            with_names(changed, county_fips).to_csv(f, header=False)
+            f.flush()
+            os.fsync(f.fileno())
+    manifest["history_file"] = history_fingerprint(path)
+
+
+def export_clean_tables(changed, latest, county_fips, data_dir, name, manifest, rewrite=False):
+    # Only the changed rows are appended to the history, the latest table (one row per county) is rewritten
+    append_history(changed, county_fips, data_dir, name, manifest, rewrite)
+    write_csv(with_names(latest, county_fips), columnar_store.csv_path(data_dir, columnar_store.COVID_CSV_DIR,
+                                                                       columnar_store.latest_name(name)))
+    # Only the tables of this signal are rebuilt, and only if the columnar store is in use
+    if os.path.exists(columnar_store.store_path(data_dir, name)):
+        for table in (name, columnar_store.latest_name(name)):
+            columnar_store.build_table(data_dir, columnar_store.COVID_CSV_DIR, table)
+
+
+def ingest_signal(name, fetch, county_fips, data_dir=columnar_store.DATA_DIR, last_issue=None):
+    _, data_source, signal = COVID_SIGNALS[name]
+    manifest = read_manifest(data_dir, name)
+    last_issue = last_issue or date.today()
+    first_issue = None
+    if manifest["last_issue"] is not None:
+        # Rows of issues that were already received only come back as changes if covidcast added to them
+        first_issue = (pd.Timestamp(manifest["last_issue"]) - pd.Timedelta(days=REISSUE_DAYS)).date()
+        if first_issue > pd.Timestamp(last_issue).date():
+            print(f"{name} is up to date (last issue {manifest['last_issue']})")
+            return 0
+
+    raw_df = fetch(name, data_source, signal, first_issue, last_issue)
+    if raw_df is None or len(raw_df) == 0:
+        print(f"No new issues for {name}")
+        return 0
+
+    new_rows = to_partition_rows(raw_df)
+    os.makedirs(partition_dir(data_dir, name), exist_ok=True)
+    latest = read_latest(data_dir, name, manifest)
+    exported = manifest.get("exported", True)
+    # Marked until the clean tables have the merged rows, the next run rewrites them if this one doesn't get there
+    manifest["exported"] = False
+    write_manifest(manifest, data_dir, name)
+    changed = merge_into_partitions(new_rows, data_dir, name, manifest)
+    if len(changed):
+        latest = update_latest(latest, changed, data_dir, name, manifest)
+    if len(changed) or not exported:
+        export_clean_tables(changed, latest, county_fips, data_dir, name, manifest, rewrite=not exported)
+    manifest["exported"] = True
+    # Only issues actually received count as ingested, so an issue published later than its date is still fetched
+    received = pd.to_datetime(raw_df["issue"]).max()
+    if manifest["last_issue"] is not None:
+        received = max(received, pd.Timestamp(manifest["last_issue"]))
+    manifest["last_issue"] = str(received.date())
+    write_manifest(manifest, data_dir, name)
+    print(f"{name}: {len(changed)} new or revised rows in {new_rows['time_value'].dt.strftime('%Y-%m').nunique()} "
+          f"month(s), ingested through issue {manifest['last_issue']}")
+    return len(changed)
+
+
+def ingest(data_dir=columnar_store.DATA_DIR, fetch=covidcast_fetcher, last_issue=None):
+    county_fips = pd.read_csv(columnar_store.csv_path(data_dir, columnar_store.FIPS_CSV_DIR,
+                                                      columnar_store.COUNTY_FIPS_NAME), index_col=0)
+    return {name: ingest_signal(name, fetch, county_fips, data_dir, last_issue)
+            for name in columnar_store.COVID_DF_NAMES.values()}
+
+
+if __name__ == "__main__":
+    # Optionally pass the data dir and a directory of raw covidcast csv files to ingest from instead of the API
+    args = sys.argv[1:3]
+    ingest(*args[:1], fetch=local_fetcher(args[1]) if len(args) > 1 else covidcast_fetcher)
@@ -0,0 +1,42 @@
+import time
+
+from indicators.file_cache import CACHE
+
+# Datasets shared by every session and rerun of the app. Module globals live as long as the server process, so each
+# dataset is loaded the first time any session asks for it instead of when the app script is imported. Datasets are
+# kept in the shared file cache, so they are reloaded when one of their source files changes
+LOADERS = {}
+SOURCES = {}
+LOAD_SECONDS = {}
+
+
+def register(name, loader, sources=()):
+    # Registering a name again (e.g. on every rerun of the app script) only replaces the loader, a dataset that is
+    # already loaded is kept
+    LOADERS[name] = loader
+    SOURCES[name] = list(sources)
+
+
+def timed_loader(name):
+    def load():
+        start = time.perf_counter()
+        dataset = LOADERS[name]()
+        LOAD_SECONDS[name] = time.perf_counter() - start
+        return dataset
+    return load
+
+
+def get(name):
+    return CACHE.get(("dataset", name), SOURCES[name], timed_loader(name))
+
+
+def loaded():
+    # {name: seconds it took to load} for every dataset loaded so far
+    return dict(LOAD_SECONDS)
+
+
+def clear(name=None):
+    names = list(LOADERS) if name is None else [name]
+    for dataset_name in names:
+        CACHE.clear(("dataset", dataset_name))
+        LOAD_SECONDS.pop(dataset_name, None)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+ROLLING_WINDOWS = [7, 14]
+GROWTH_WINDOW = 7
+# Growth and doubling time only make sense for counts of new events, not for percentages (e.g. of doctor visits)
+GROWTH_FEATURES = ["Daily New Cases per 100K people", "Daily Deaths per 100K people"]
+
+
+def county_day_matrix(covid_df):
+    # Dense (county x day) matrix of a covid table with NaN for missing days, same layout as CovidRangeIndex
+    covid_df = covid_df.sort_values(["FIPS", "time_value"])
+    fips, rows = np.unique(covid_df["FIPS"].to_numpy(), return_inverse=True)
+    start_date = covid_df["time_value"].min()
+    cols = (covid_df["time_value"] - start_date).dt.days.to_numpy()
+    values = np.full((len(fips), int(cols.max()) + 1 if len(cols) else 0), np.nan)
+    values[rows, cols] = covid_df["value"].to_numpy()
+    counties = covid_df.drop_duplicates("FIPS")[["FIPS", "State Name", "Area Name"]].reset_index(drop=True)
+    days = pd.date_range(start_date, periods=values.shape[1], freq="D")
+    return counties, days, values
+
+
+def rolling_sum(values, window):
+    # Sum over the window ending on every day, NaN unless all days of the window have data (like pandas' rolling)
+    present = ~np.isnan(values)
+    sums = np.zeros((values.shape[0], values.shape[1] + 1))
+    np.cumsum(np.where(present, values, 0.0), axis=1, out=sums[:, 1:])
+    counts = np.zeros((values.shape[0], values.shape[1] + 1), dtype=np.int32)
+    np.cumsum(present, axis=1, dtype=np.int32, out=counts[:, 1:])
+
+    result = np.full(values.shape, np.nan)
+    if values.shape[1] >= window:
+        full = counts[:, window:] - counts[:, :-window] == window
+        result[:, window - 1:] = np.where(full, sums[:, window:] - sums[:, :-window], np.nan)
+    return result
+
+
+def rolling_mean(values, window):
+    return rolling_sum(values, window) / window
+
+
+def lagged_ratio(values, window):
+    # Sum of the last window days over the sum of the window before it
+    sums = rolling_sum(values, window)
+    ratio = np.full(values.shape, np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio[:, window:] = sums[:, window:] / sums[:, :-window]
+    ratio[~np.isfinite(ratio)] = np.nan
+    return ratio
+
+
+def week_over_week_growth(values):
+    # Percent change of the weekly total from the previous week
+    return (lagged_ratio(values, GROWTH_WINDOW) - 1) * 100
+
+
+def doubling_time(values):
+    # Days for the weekly total to double at the current week over week growth, NaN when it isn't growing
+    ratio = lagged_ratio(values, GROWTH_WINDOW)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(ratio > 1, GROWTH_WINDOW * np.log(2) / np.log(ratio), np.nan)
+
+
+def to_covid_df(counties, days, values):
+    # Back to the long layout of the covid tables (one row per county and day with a value)
+    rows, cols = np.nonzero(~np.isnan(values))
+    df = counties.iloc[rows].reset_index(drop=True)
+    df.insert(1, "time_value", days[cols])
+    df.insert(2, "value", values[rows, cols].astype(np.float32))
+    return df
+
+
+def derived_metrics(covid_feature, covid_df):
+    # {label: covid table} of every metric derived from a daily covid feature, all computed from one matrix
+    counties, days, values = county_day_matrix(covid_df)
+    metrics = {f"{covid_feature} ({window}-day average)": rolling_mean(values, window) for window in ROLLING_WINDOWS}
+    if covid_feature in GROWTH_FEATURES:
+        metrics[f"{covid_feature} (week over week growth %)"] = week_over_week_growth(values)
+        metrics[f"{covid_feature} (doubling time in days)"] = doubling_time(values)
+    return {label: to_covid_df(counties, days, metric) for label, metric in metrics.items()}
@@ -0,0 +1,46 @@
+import numpy as np
+
+# Total number of points the time series chart is allowed per pixel of its width, shared by all of its lines (the lines
+# of a state's counties overlap, so they don't each need a point per pixel)
+POINTS_PER_PIXEL = 8
+MIN_BUCKETS = 8
+
+
+def bucket_count(width, num_series):
+    # Every bucket keeps up to two points (its min and max)
+    return max(MIN_BUCKETS, width * POINTS_PER_PIXEL // (2 * max(num_series, 1)))
+
+
+def min_max_rows(keys, times, values, num_buckets):
+    # Positions of the rows to keep when every series (rows sharing a key) is split into num_buckets equal time buckets
+    # and only the min and max of each bucket are kept, plus the first and last row of the series. All series are
+    # bucketed in one pass, without a loop over them
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    order = np.lexsort((times, keys))
+    keys, times, values = keys[order], times[order], values[order]
+    _, starts, series = np.unique(keys, return_index=True, return_inverse=True)
+    ends = np.append(starts[1:], len(keys)) - 1
+    offsets = (times - times[starts][series]).astype(np.float64)
+    spans = (times[ends] - times[starts]).astype(np.float64)[series]
+    buckets = np.minimum((offsets / np.where(spans > 0, spans, 1) * num_buckets).astype(np.int64), num_buckets - 1)
+
+    groups = series.astype(np.int64) * num_buckets + buckets
+    by_value = np.lexsort((values, groups))
+    boundaries = np.flatnonzero(np.diff(groups[by_value])) + 1
+    extremes = by_value[np.concatenate([[0], boundaries, boundaries - 1, [len(by_value) - 1]])]
+    kept = np.unique(np.concatenate([extremes, starts, ends]))
+    return order[kept]
+
+
+def downsample_series(df, key, time, value, width, full_resolution=()):
+    # Min/max downsampling of every series in df to fit a chart width pixels wide. Series whose key is in
+    # full_resolution are returned with all of their rows
+    num_buckets = bucket_count(width, df[key].nunique())
+    full = df[key].isin(list(full_resolution)).to_numpy()
+    sampled = df[~full]
+    rows = min_max_rows(sampled[key].to_numpy(), sampled[time].to_numpy().astype(np.int64),
+                        sampled[value].to_numpy(), num_buckets)
+    keep = full.copy()
+    keep[np.flatnonzero(~full)[rows]] = True
+    return df[keep]
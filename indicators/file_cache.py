@@ -0,0 +1,178 @@
+import functools
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Upper bound on the estimated size of everything the cache holds, least recently used entries are evicted past it
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+HASH_CHUNK_BYTES = 1024 ** 2
+# Large lists are sized from a sample of their elements instead of walking all of them
+SIZE_SAMPLE = 100
+
+
+def content_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=4096)
+def cached_content_hash(path, mtime_ns, size):
+    # Only rehash a file when its mtime or size changed
+    return content_hash(path)
+
+
+def file_fingerprint(path, hash_contents=False):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return path, None, None, None
+    digest = cached_content_hash(path, stat.st_mtime_ns, stat.st_size) if hash_contents else None
+    return path, stat.st_mtime_ns, stat.st_size, digest
+
+
+def fingerprint(paths, hash_contents=False):
+    return tuple(file_fingerprint(path, hash_contents) for path in paths)
+
+
+def estimate_bytes(value):
+    # Rough size of a cached value. Shared buffers (e.g. a frame and a slice of it) are counted more than once, which
+    # only makes the cache evict a bit early
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep=True).sum() if isinstance(value, pd.DataFrame) else
+                   value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (str, bytes)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_bytes(k) + estimate_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        if not value:
+            return sys.getsizeof(value)
+        sample = list(value)[:SIZE_SAMPLE] if len(value) > SIZE_SAMPLE else value
+        return sys.getsizeof(value) + sum(estimate_bytes(element) for element in sample) * len(value) // len(sample)
+    if hasattr(value, "__dict__"):
+        return sys.getsizeof(value) + estimate_bytes(vars(value))
+    return sys.getsizeof(value)
+
+
+class FileCache:
+    # Byte bounded LRU cache whose entries are invalidated when the files they were loaded from change. Lookups only
+    # stat the source files, so entries live until their sources change or they are evicted instead of for a fixed TTL
+
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (fingerprint, value, bytes)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        # One lock per key so a slow load only blocks the sessions waiting for that same key. Each lock counts the
+        # sessions holding or waiting for it and is only dropped once it has none and the key has no entry, so there
+        # are never more locks than entries plus loads in flight
+        self.key_locks = {}  # key -> [lock, sessions using it]
+
+    def lookup(self, key, key_fingerprint):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != key_fingerprint:
+                return False, None
+            self.entries.move_to_end(key)
+            return True, entry[1]
+
+    def get(self, key, sources, loader, hash_contents=False):
+        key_fingerprint = fingerprint(sources, hash_contents)
+        found, value = self.lookup(key, key_fingerprint)
+        if found:
+            return value
+
+        key_lock = self.acquire_key_lock(key)
+        try:
+            with key_lock:
+                # Another session may have loaded it while we were waiting
+                found, value = self.lookup(key, key_fingerprint)
+                if not found:
+                    value = loader()
+                    self.put(key, key_fingerprint, value)
+        finally:
+            self.release_key_lock(key)
+        return value
+
+    def acquire_key_lock(self, key):
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, [threading.RLock(), 0])
+            key_lock[1] += 1
+            return key_lock[0]
+
+    def release_key_lock(self, key):
+        with self.lock:
+            key_lock = self.key_locks[key]
+            key_lock[1] -= 1
+            # A failed load (or an entry evicted while the lock was in use) leaves no entry, the lock goes with its
+            # last user
+            if key_lock[1] == 0 and key not in self.entries:
+                del self.key_locks[key]
+
+    def put(self, key, key_fingerprint, value):
+        size = estimate_bytes(value)
+        with self.lock:
+            self.remove(key)
+            # An entry bigger than the whole budget is still kept, on its own
+            while self.entries and self.total_bytes + size > self.max_bytes:
+                self.evict(next(iter(self.entries)))
+            self.entries[key] = (key_fingerprint, value, size)
+            self.total_bytes += size
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def evict(self, key):
+        # The lock of a key that is being loaded is kept, so sessions that look it up meanwhile still wait for that
+        # load instead of starting their own
+        self.remove(key)
+        if key in self.key_locks and self.key_locks[key][1] == 0:
+            del self.key_locks[key]
+
+    def clear(self, key=None):
+        with self.lock:
+            for entry_key in (list(self.entries) if key is None else [key]):
+                self.evict(entry_key)
+
+    def report(self):
+        # [(key, estimated bytes)] from least to most recently used
+        with self.lock:
+            return [(key, entry[2]) for key, entry in self.entries.items()]
+
+
+# Shared by every session of the app
+CACHE = FileCache()
+
+
+def freeze(value):
+    # Lists and sets (e.g. stopwords) can't be dict keys. Sets are sorted so equal sets always give the same key
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def cached(sources, hash_contents=False, cache=CACHE):
+    # Decorator for loaders whose result only depends on their (cheap) arguments and the files sources(*args) returns.
+    # The key is the function name plus its arguments, never the contents of the data
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__module__, func.__qualname__) + tuple(freeze(arg) for arg in args) + \
+                  tuple((name, freeze(arg)) for name, arg in sorted(kwargs.items()))
+            return cache.get(key, sources(*args, **kwargs), lambda: func(*args, **kwargs), hash_contents)
+        return wrapper
+    return decorator
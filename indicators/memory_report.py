@@ -0,0 +1,74 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from indicators import columnar_store
+from indicators.range_index import CovidRangeIndex
+
+
+def is_mapped(arr):
+    # Arrays read from the memory mapped store are views of arrow buffers rather than numpy owned memory
+    while isinstance(arr, np.ndarray):
+        if arr.base is None:
+            return False
+        arr = arr.base
+    return arr is not None
+
+
+def column_footprint(series):
+    # (total bytes, bytes shared through the memory map) of one column
+    total = int(series.memory_usage(deep=True, index=False))
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        arr = series.cat.codes.to_numpy()
+    else:
+        arr = series.to_numpy()
+    return total, arr.nbytes if is_mapped(arr) else 0
+
+
+def table_footprint(df):
+    total = int(df.index.memory_usage(deep=True))
+    mapped = 0
+    for col in df.columns:
+        column_total, column_mapped = column_footprint(df[col])
+        total += column_total
+        mapped += column_mapped
+    return total, mapped
+
+
+def range_index_footprint(range_index):
+    return sum(arr.nbytes for arr in vars(range_index).values() if isinstance(arr, np.ndarray))
+
+
+def memory_report(data_dir=columnar_store.DATA_DIR):
+    # One row per table: how big it is once loaded, how much of that is shared read-only through the memory map and
+    # how much is private to the process (csv fallbacks, categorical codes and categories, derived indexes)
+    rows = []
+    for csv_dir, name in columnar_store.all_tables():
+        from_csv = columnar_store.is_stale(data_dir, csv_dir, name)
+        if from_csv and not os.path.exists(columnar_store.csv_path(data_dir, csv_dir, name)):
+            continue
+        df = columnar_store.load_table(data_dir, csv_dir, name)
+        total, mapped = table_footprint(df)
+        rows.append({"Table": name, "Rows": len(df), "Source": "csv" if from_csv else "store", "Bytes": total,
+                     "Shared Bytes": mapped, "Private Bytes": total - mapped})
+        if csv_dir == columnar_store.COVID_CSV_DIR and not name.endswith(columnar_store.LATEST_SUFFIX):
+            index_bytes = range_index_footprint(CovidRangeIndex(df))
+            rows.append({"Table": f"{name} (range index)", "Rows": len(df), "Source": "derived", "Bytes": index_bytes,
+                         "Shared Bytes": 0, "Private Bytes": index_bytes})
+    return pd.DataFrame(rows)
+
+
+def main(data_dir=columnar_store.DATA_DIR):
+    report = memory_report(data_dir)
+    totals = report[["Bytes", "Shared Bytes", "Private Bytes"]].sum()
+    for col in ["Bytes", "Shared Bytes", "Private Bytes"]:
+        report[col] = (report[col] / 1024 ** 2).map("{:,.2f} MB".format)
+    print(report.to_string(index=False))
+    print(f"Total: {totals['Bytes'] / 1024 ** 2:,.2f} MB, shared: {totals['Shared Bytes'] / 1024 ** 2:,.2f} MB, "
+          f"private: {totals['Private Bytes'] / 1024 ** 2:,.2f} MB")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
@@ -0,0 +1,90 @@
+import os
+import sys
+
+import pandas as pd
+
+from indicators import columnar_store
+
+# Raw covidcast downloads, relative to the data dir
+RAW_DIR = "covidcast/raw"
+# Clean table name -> (raw file name, covidcast data source, covidcast signal)
+COVID_SIGNALS = {
+    "confirmed_cumulative_cases_prop_fips": ("confirmed_cumulative_cases_prop", "usa-facts", "confirmed_cumulative_prop"),
+    "confirmed_daily_incidence_cases_prop_fips": ("confirmed_daily_incidence_cases_prop", "usa-facts",
+                                                  "confirmed_incidence_prop"),
+    "cumulative_deaths_prop_fips": ("cumulative_deaths_prop", "usa-facts", "deaths_cumulative_prop"),
+    "daily_incidence_deaths_prop_fips": ("daily_incidence_deaths_prop", "usa-facts", "deaths_incidence_prop"),
+    "perc_covid_doctor_visits_fips": ("perc_covid_doctor_visits", "doctor-visits", "smoothed_adj_cli"),
+    "perc_people_wearing_masks_fips": ("perc_people_wearing_masks", "fb-survey", "smoothed_wearing_mask"),
+    "perc_people_tested_fips": ("perc_people_tested", "fb-survey", "smoothed_tested_14d"),
+    "perc_positive_tests_fips": ("perc_positive_tests", "fb-survey", "smoothed_tested_positive_14d"),
+    "perc_wanted_test_fips": ("perc_wanted_test", "fb-survey", "smoothed_wanted_test_14d")
+}
+
+
+def raw_path(data_dir, raw_name):
+    return f"{data_dir}/{RAW_DIR}/{raw_name}.csv"
+
+
+def fetch_signal(data_source, signal):
+    # Only needed when refetching, so the covidcast client isn't imported otherwise
+    import covidcast
+    return covidcast.signal(data_source=data_source, signal=signal, geo_type="county")
+
+
+def drop_non_county_rows(covid_df):
+    return covid_df[covid_df['geo_value'] % 1000 != 0]
+
+
+def merge_covid_and_county_fips_dfs(covid_df, county_fips_df):
+    covid_df = drop_non_county_rows(covid_df)
+    df = covid_df.merge(county_fips_df, how='left', left_on='geo_value', right_on='FIPS')
+    df = df[["geo_value", "time_value", "issue", "value", "State Name", "Area Name"]]
+    df = df.rename(columns={"geo_value": "FIPS"})
+    return df
+
+
+def read_raw_signal(data_dir, name, fetch=False):
+    raw_name, data_source, signal = COVID_SIGNALS[name]
+    path = raw_path(data_dir, raw_name)
+    if fetch:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fetch_signal(data_source, signal).to_csv(path)
+    if not os.path.exists(path):
+        return None
+    return pd.read_csv(path, index_col=0)
+
+
+def write_csv(df, path):
+    tmp_path = f"{path}.tmp"
+    df.to_csv(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def preprocess_covid(data_dir=columnar_store.DATA_DIR, fetch=False):
+    # For every covid feature writes the full history (one row per county and day) and, separately, the latest row of
+    # each county, so views that only need the latest values never read the history
+    county_fips = pd.read_csv(columnar_store.csv_path(data_dir, columnar_store.FIPS_CSV_DIR,
+                                                      columnar_store.COUNTY_FIPS_NAME), index_col=0)
+    for name in columnar_store.COVID_DF_NAMES.values():
+        history_path = columnar_store.csv_path(data_dir, columnar_store.COVID_CSV_DIR, name)
+        raw_df = read_raw_signal(data_dir, name, fetch)
+        if raw_df is not None:
+            history = merge_covid_and_county_fips_dfs(raw_df, county_fips).reset_index(drop=True)
+            write_csv(history, history_path)
+            print(f"Wrote {history_path}")
+        elif os.path.exists(history_path):
+            # No raw download, the latest table can still be derived from the clean history
+            history = pd.read_csv(history_path, index_col=0)
+        else:
+            print(f"Skipping {name}, no raw or clean csv found")
+            continue
+
+        latest_path = columnar_store.csv_path(data_dir, columnar_store.COVID_CSV_DIR, columnar_store.latest_name(name))
+        write_csv(columnar_store.latest_per_county(history).reset_index(drop=True), latest_path)
+        print(f"Wrote {latest_path}")
+
+
+if __name__ == "__main__":
+    # Pass --fetch to download every signal from covidcast again before cleaning it
+    preprocess_covid(fetch="--fetch" in sys.argv[1:])
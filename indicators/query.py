@@ -0,0 +1,226 @@
+from datetime import timedelta
+
+import pandas as pd
+
+from indicators import columnar_store, county_topology, dataset_registry, file_cache
+from indicators.correlation_matrix import NATIONAL_FIPS, NON_MEASURE_COLUMNS, correlation_matrix
+from indicators.derived_metrics import derived_metrics
+from indicators.range_index import CovidRangeIndex, RANGE_STATISTICS
+from indicators.spatial_autocorrelation import adjacency_path, load_adjacency, spatial_autocorrelation
+from indicators.state_partition import StatePartition
+
+# The data tier of the app: every frame the county views draw, for one set of control panel choices, without any
+# Streamlit calls. The app renders its results and indicators.query_server serves them over HTTP
+DATA_DIR = columnar_store.DATA_DIR
+DEFAULT_STATISTIC = "Max"
+# Days before a covid feature's last update the date range starts at when none is given
+DEFAULT_RANGE_DAYS = 7
+# Query results are kept apart from the datasets, so many small answers can't evict a dataset they are sliced from
+QUERY_CACHE_BYTES = 512 * 1024 ** 2
+QUERY_CACHE = file_cache.FileCache(max_bytes=QUERY_CACHE_BYTES)
+
+
+def load_state_fips():
+    state_fips = columnar_store.load_fips_table(columnar_store.STATE_FIPS_NAME, DATA_DIR)
+    state_fips = state_fips[state_fips["State FIPS"] > 0]  # exclude regions, divisions, and non-state rows
+    state_fips = state_fips.astype({"Name": str})
+    return state_fips[["State FIPS", "Name"]].sort_values("Name").set_index("Name").to_dict()["State FIPS"]
+
+
+def load_county_fips():
+    county_fips = columnar_store.load_fips_table(columnar_store.COUNTY_FIPS_NAME, DATA_DIR)
+    return county_fips[["State FIPS", "FIPS", "Area Name"]]
+
+
+def load_usda_data():
+    usda_data = {}
+    for usda_category, usda_df_name in columnar_store.USDA_DF_NAMES.items():
+        usda_data[usda_category] = columnar_store.load_usda_table(usda_df_name, DATA_DIR)
+    return usda_data
+
+
+def read_and_filter_df(df_name, cumulative=False):
+    # Read in data from the columnar store (falls back to the local csv file if the store hasn't been built).
+    # Rows with values < 0.0 are already removed and time_value is already a datetime column
+    if cumulative:
+        # Only the most recent cumulative data is shown, which is preprocessed into its own (one row per county) table
+        return columnar_store.load_covid_latest_table(df_name, DATA_DIR)
+    return columnar_store.load_covid_table(df_name, DATA_DIR)
+
+
+def load_covid_data():
+    covid_data = {}
+    for covid_feature_name, covid_df_name in columnar_store.COVID_DF_NAMES.items():
+        cumulative = is_cumulative(covid_feature_name)
+        covid_data[covid_feature_name] = read_and_filter_df(covid_df_name, cumulative)
+        if not cumulative:
+            # Rolling averages and growth rates are offered as features of their own, computed once per data refresh
+            covid_data.update(derived_metrics(covid_feature_name, covid_data[covid_feature_name]))
+    return covid_data
+
+
+def get_covid_date_ranges(covid_data):
+    covid_date_ranges = {}
+    for covid_feature, df in covid_data.items():
+        covid_date_ranges[covid_feature] = df["time_value"].min(), df["time_value"].max()
+    return covid_date_ranges
+
+
+def get_county_fips_partition():
+    # Index every table by state once so state views slice rows instead of masking the national tables
+    return StatePartition(dataset_registry.get("county_fips"))
+
+
+def get_usda_partitions():
+    return {usda_category: StatePartition(usda_df[usda_df["FIPS"] % 1000 != 0])  # remove non-county rows
+            for usda_category, usda_df in dataset_registry.get("usda").items()}
+
+
+def get_covid_partitions():
+    return {covid_feature: StatePartition(covid_df)
+            for covid_feature, covid_df in dataset_registry.get("covid").items()}
+
+
+# Every dataset is loaded on first use and then shared by all sessions, so nothing is read before the page is drawn,
+# and reloaded when one of its files changes
+STATE_FIPS_PATHS = columnar_store.fips_paths(columnar_store.STATE_FIPS_NAME, DATA_DIR)
+COUNTY_FIPS_PATHS = columnar_store.fips_paths(columnar_store.COUNTY_FIPS_NAME, DATA_DIR)
+USDA_PATHS = columnar_store.usda_paths(DATA_DIR)
+COVID_PATHS = columnar_store.covid_paths(DATA_DIR)
+# The adjacency is built from the bundled national topology, and rebuilt whenever the topology is newer
+ADJACENCY_PATHS = [county_topology.national_topology_path(), adjacency_path(DATA_DIR)]
+dataset_registry.register("state_fips", load_state_fips, STATE_FIPS_PATHS)
+dataset_registry.register("county_fips", load_county_fips, COUNTY_FIPS_PATHS)  # {State FIPS, FIPS, Area Name}
+dataset_registry.register("usda", load_usda_data, USDA_PATHS)
+dataset_registry.register("covid", load_covid_data, COVID_PATHS)
+dataset_registry.register("covid_date_ranges", lambda: get_covid_date_ranges(dataset_registry.get("covid")),
+                          COVID_PATHS)
+dataset_registry.register("county_fips_partition", get_county_fips_partition, COUNTY_FIPS_PATHS)
+dataset_registry.register("usda_partitions", get_usda_partitions, USDA_PATHS)
+dataset_registry.register("covid_partitions", get_covid_partitions, COVID_PATHS)
+dataset_registry.register("county_adjacency", lambda: load_adjacency(DATA_DIR), ADJACENCY_PATHS)
+
+
+@file_cache.cached(lambda covid_feature: COVID_PATHS)
+def get_covid_range_index(covid_feature):
+    # Built once per feature so date range statistics don't regroup the whole frame on every widget change
+    return CovidRangeIndex(dataset_registry.get("covid").get(covid_feature))
+
+
+@file_cache.cached(lambda: USDA_PATHS + COVID_PATHS)
+def get_correlation_matrix():
+    # Every USDA measure against every covid feature, nationwide and per state, computed once. The derived metrics
+    # are left out, they would only repeat the correlations of the features they are computed from
+    covid_data = dataset_registry.get("covid")
+    return correlation_matrix(dataset_registry.get("usda"),
+                              {feature: covid_data[feature] for feature in columnar_store.COVID_DF_NAMES
+                               if feature in covid_data})
+
+
+def is_cumulative(covid_feature):
+    return "cumulative" in covid_feature.lower()
+
+
+def states():
+    # {state name: state FIPS} in name order
+    return dataset_registry.get("state_fips")
+
+
+def usda_categories():
+    return list(dataset_registry.get("usda").keys())
+
+
+def usda_measures(usda_category):
+    usda_df = dataset_registry.get("usda_partitions")[usda_category].df
+    return [col for col in usda_df.columns if col not in NON_MEASURE_COLUMNS]
+
+
+def covid_features():
+    return list(dataset_registry.get("covid").keys())
+
+
+def covid_date_range(covid_feature):
+    # (first day, last update) of a covid feature
+    return dataset_registry.get("covid_date_ranges")[covid_feature]
+
+
+def default_date_range(covid_feature):
+    min_date, max_date = covid_date_range(covid_feature)
+    return max(min_date, max_date - timedelta(days=DEFAULT_RANGE_DAYS)), max_date
+
+
+def merge_covid_and_usda(covid_df, usda_df, selected_usda_feature):
+    # Select the columns the correlation chart uses before merging so we don't carry _x/_y duplicates around
+    return covid_df[["FIPS", "value", "Area Name"]].merge(usda_df[["FIPS", selected_usda_feature]], on="FIPS")
+
+
+def check_query(covid_feature, usda_category, usda_measure, statistic):
+    if usda_category not in dataset_registry.get("usda"):
+        raise ValueError(f"Unknown socioeconomic indicator {usda_category}, expected one of {usda_categories()}")
+    if usda_measure not in usda_measures(usda_category):
+        raise ValueError(f"Unknown measure {usda_measure} for {usda_category}, "
+                         f"expected one of {usda_measures(usda_category)}")
+    if covid_feature not in dataset_registry.get("covid"):
+        raise ValueError(f"Unknown covid feature {covid_feature}, expected one of {covid_features()}")
+    if not is_cumulative(covid_feature) and statistic not in RANGE_STATISTICS:
+        raise ValueError(f"Unknown statistic {statistic}, expected one of {RANGE_STATISTICS}")
+
+
+@file_cache.cached(lambda *args, **kwargs: USDA_PATHS + COVID_PATHS, cache=QUERY_CACHE)
+def query(covid_feature, usda_category, usda_measure, state_fips=None, date_range=None, statistic=DEFAULT_STATISTIC):
+    # Frames of the county views for the whole country (state_fips=None) or the counties of one state:
+    #   usda_df      -> the county rows of the socioeconomic indicator's table
+    #   covid_df     -> the covid rows, for a daily feature of a state only those within the date range
+    #   covid_df_agg -> {FIPS, Area Name, statistic} over the date range, None for cumulative features
+    #   full_df      -> covid value and measure of every county for the correlation chart, cumulative features only
+    # date_range is an inclusive (from, to) pair of dates and defaults to the last week of data. From after to is
+    # answered with empty aggregates, like the app did
+    # The frames are read-only: the same frames (slices of the shared datasets, store columns memory mapped read-only)
+    # are handed to every caller of the same query, so a caller that needs to change one copies it where it does so
+    check_query(covid_feature, usda_category, usda_measure, statistic)
+    usda_partition = dataset_registry.get("usda_partitions")[usda_category]
+    covid_partition = dataset_registry.get("covid_partitions")[covid_feature]
+    usda_df = usda_partition.df if state_fips is None else usda_partition.state(state_fips)
+    covid_df = covid_partition.df if state_fips is None else covid_partition.state(state_fips)
+
+    result = {"usda_df": usda_df, "covid_df": covid_df, "covid_df_agg": None, "full_df": None}
+    if is_cumulative(covid_feature):
+        result["full_df"] = merge_covid_and_usda(covid_df, usda_df, usda_measure)
+        return result
+
+    from_date, to_date = date_range if date_range is not None else default_date_range(covid_feature)
+    # Only the state time series chart needs the raw rows
+    if state_fips is not None:
+        result["covid_df"] = covid_df[(covid_df["time_value"] >= pd.Timestamp(from_date)) &
+                                      (covid_df["time_value"] <= pd.Timestamp(to_date))]
+    result["covid_df_agg"] = get_covid_range_index(covid_feature).query(from_date, to_date, statistic, state_fips)
+    return result
+
+
+def cluster_value_column(frame, usda_measure, statistic):
+    # Column of each query frame the spatial statistics are computed on
+    return {"usda_df": usda_measure, "covid_df_agg": statistic, "covid_df": "value"}[frame]
+
+
+@file_cache.cached(lambda *args, **kwargs: USDA_PATHS + COVID_PATHS + ADJACENCY_PATHS, cache=QUERY_CACHE)
+def query_spatial_clusters(covid_feature, usda_category, usda_measure, state_fips=None, date_range=None,
+                           statistic=DEFAULT_STATISTIC, frame="usda_df"):
+    # Moran's I, its p-value and the local clusters (see spatial_autocorrelation) of one frame of query() for the same
+    # arguments, computed once per set of arguments since the permutation tests are the slowest part of a view. None
+    # without the bundled county geometry
+    adjacency = dataset_registry.get("county_adjacency")
+    if adjacency is None:
+        return None
+    frames = query(covid_feature, usda_category, usda_measure, state_fips=state_fips, date_range=date_range,
+                   statistic=statistic)
+    if frames[frame] is None:
+        raise ValueError(f"No {frame} for {covid_feature}")
+    return spatial_autocorrelation(frames[frame], cluster_value_column(frame, usda_measure, statistic), adjacency)
+
+
+def query_correlations(method, state_fips=None):
+    # {Measure, Covid Feature, r} of every measure and covid feature pair, nationwide or within one state
+    correlations = get_correlation_matrix()
+    state_fips = NATIONAL_FIPS if state_fips is None else state_fips
+    correlations = correlations[(correlations["State FIPS"] == state_fips) & (correlations["Method"] == method)]
+    return correlations[["Measure", "Covid Feature", "r"]]
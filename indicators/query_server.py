@@ -0,0 +1,116 @@
+import json
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+from indicators import query
+from indicators.correlation_matrix import CORRELATION_METHODS
+from indicators.range_index import RANGE_STATISTICS
+
+# Serves indicators.query as json so the data tier can be benchmarked and load tested without the Streamlit app:
+#   GET /options                      -> states, socioeconomic indicators and measures, covid features and date ranges
+#   GET /query?covid_feature=&usda_category=&usda_measure=[&state=][&from=&to=][&statistic=]
+#                                     -> {usda_df, covid_df, covid_df_agg, full_df} as lists of records
+#   GET /correlations?[method=][&state=]
+# state is a state FIPS code or name, from and to are YYYY-MM-DD dates
+HOST = "127.0.0.1"
+PORT = 8502
+
+
+def frame_json(df):
+    return "null" if df is None else df.to_json(orient="records", date_format="iso")
+
+
+def parse_state(params):
+    state = params.get("state")
+    if state is None:
+        return None
+    if state.isdigit():
+        return int(state)
+    if state not in query.states():
+        raise ValueError(f"Unknown state {state}")
+    return query.states()[state]
+
+
+def parse_date_range(params):
+    if "from" not in params and "to" not in params:
+        return None
+    # The defaults depend on the feature, so it is checked before they are looked up
+    if params["covid_feature"] not in query.covid_features():
+        raise ValueError(f"Unknown covid feature {params['covid_feature']}, expected one of {query.covid_features()}")
+    default_from, default_to = query.default_date_range(params["covid_feature"])
+    return (pd.Timestamp(params.get("from", default_from)).date(), pd.Timestamp(params.get("to", default_to)).date())
+
+
+def options():
+    return json.dumps({
+        "states": {state: int(state_fips) for state, state_fips in query.states().items()},
+        "usda": {usda_category: query.usda_measures(usda_category) for usda_category in query.usda_categories()},
+        "covid": {covid_feature: [day.strftime("%Y-%m-%d") for day in query.covid_date_range(covid_feature)]
+                  for covid_feature in query.covid_features()},
+        "statistics": RANGE_STATISTICS,
+        "correlation_methods": CORRELATION_METHODS,
+    })
+
+
+def frames(params):
+    for name in ["covid_feature", "usda_category", "usda_measure"]:
+        if name not in params:
+            raise ValueError(f"Missing parameter {name}")
+    result = query.query(params["covid_feature"], params["usda_category"], params["usda_measure"],
+                         state_fips=parse_state(params), date_range=parse_date_range(params),
+                         statistic=params.get("statistic", query.DEFAULT_STATISTIC))
+    # The frames are already serialised by pandas, so they are spliced in instead of being parsed and dumped again
+    return "{%s}" % ", ".join(f"{json.dumps(name)}: {frame_json(df)}" for name, df in result.items())
+
+
+def correlations(params):
+    method = params.get("method", CORRELATION_METHODS[0])
+    if method not in CORRELATION_METHODS:
+        raise ValueError(f"Unknown correlation method {method}, expected one of {CORRELATION_METHODS}")
+    return frame_json(query.query_correlations(method, parse_state(params)))
+
+
+ROUTES = {"/options": lambda params: options(), "/query": frames, "/correlations": correlations}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        route = ROUTES.get(url.path)
+        if route is None:
+            return self.respond(404, json.dumps({"error": f"Unknown path {url.path}, expected one of {list(ROUTES)}"}))
+        # Repeated parameters keep their last value
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            body = route(params)
+        except ValueError as e:
+            return self.respond(400, json.dumps({"error": str(e)}))
+        self.respond(200, body)
+
+    def respond(self, status, body):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port=PORT, host=HOST):
+    # Sessions share the datasets and query cache through the module globals, like the sessions of the Streamlit app
+    server = ThreadingHTTPServer((host, int(port)), QueryHandler)
+    print(f"Serving county queries on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve(*sys.argv[1:2])
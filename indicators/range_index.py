@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+RANGE_STATISTICS = ["Max", "Min", "Average", "Median"]
+
+
+class CovidRangeIndex:
+    # Answers "statistic over [from, to] for every county" without regrouping the covid frame on every widget change.
+    # Values are laid out as a dense (county x day) matrix with NaN for missing days:
+    #   Average  -> prefix sums of values and of non-missing counts, O(1) per query
+    #   Min/Max  -> one segment tree per county (stored as a single 2D array), O(log days) per query
+    #   Median   -> each county's days sorted by value, with the rank of every day in a wavelet matrix (one prefix
+    #               count of zero bits per rank bit), so the k-th smallest value of any window is O(log days) per query
+
+    def __init__(self, covid_df):
+        covid_df = covid_df.sort_values(["FIPS", "time_value"])
+        self.fips, rows = np.unique(covid_df["FIPS"].to_numpy(), return_inverse=True)
+        self.area_names = covid_df.drop_duplicates("FIPS")["Area Name"].to_numpy()
+        self.start_date = covid_df["time_value"].min()
+        self.end_date = covid_df["time_value"].max()
+        cols = (covid_df["time_value"] - self.start_date).dt.days.to_numpy()
+
+        num_days = int(cols.max()) + 1 if len(cols) else 0
+        # Values (and the min/max trees built from them) are kept in single precision like the covid tables, sums are
+        # accumulated in double precision
+        self.values = np.full((len(self.fips), num_days), np.nan, dtype=np.float32)
+        self.values[rows, cols] = covid_df["value"].to_numpy()
+
+        present = ~np.isnan(self.values)
+        self.prefix_sum = np.zeros((len(self.fips), num_days + 1))
+        np.cumsum(np.where(present, self.values, 0.0), axis=1, dtype=np.float64, out=self.prefix_sum[:, 1:])
+        self.prefix_count = np.zeros((len(self.fips), num_days + 1), dtype=np.int32)
+        np.cumsum(present, axis=1, dtype=np.int32, out=self.prefix_count[:, 1:])
+
+        self.tree_size = 1
+        while self.tree_size < max(num_days, 1):
+            self.tree_size *= 2
+        self.min_tree = self.build_tree(np.fmin)
+        self.max_tree = self.build_tree(np.fmax)
+        self.sorted_values, self.wavelet_zeros = self.build_wavelet_matrix()
+
+    def build_tree(self, combine):
+        tree = np.full((len(self.fips), 2 * self.tree_size), np.nan, dtype=np.float32)
+        tree[:, self.tree_size:self.tree_size + self.values.shape[1]] = self.values
+        # Fill the tree one level at a time, the children of nodes [half, level) are [level, 2 * level)
+        level = self.tree_size
+        while level > 1:
+            half = level // 2
+            tree[:, half:level] = combine(tree[:, level:2 * level:2], tree[:, level + 1:2 * level:2])
+            level = half
+        return tree
+
+    def build_wavelet_matrix(self):
+        # Missing days sort last, so the k-th smallest of a window is one of its days with data while k is below the
+        # window's count. Ties keep day order so every day has its own rank
+        order = np.argsort(self.values, axis=1, kind="stable")
+        sorted_values = np.take_along_axis(self.values, order, axis=1)
+        ranks = np.empty_like(order)
+        np.put_along_axis(ranks, order, np.arange(self.values.shape[1])[None, :], axis=1)
+
+        num_days = self.values.shape[1]
+        dtype = np.uint16 if num_days < np.iinfo(np.uint16).max else np.uint32
+        zeros = []
+        # Each level counts the days whose rank bit is 0 and then moves them (in day order) ahead of the ones
+        for bit in range(max(num_days - 1, 1).bit_length() - 1, -1, -1):
+            bits = (ranks >> bit) & 1
+            level = np.zeros((len(self.fips), num_days + 1), dtype=dtype)
+            np.cumsum(bits == 0, axis=1, out=level[:, 1:])
+            zeros.append(level)
+            ranks = np.take_along_axis(ranks, np.argsort(bits, axis=1, kind="stable"), axis=1)
+        return sorted_values, zeros
+
+    def day_bounds(self, from_date, to_date):
+        # Convert dates to an inclusive [lo, hi] column range clipped to the data we have
+        num_days = self.values.shape[1]
+        lo = max((pd.Timestamp(from_date) - self.start_date).days, 0)
+        hi = min((pd.Timestamp(to_date) - self.start_date).days, num_days - 1)
+        return lo, hi
+
+    def state_rows(self, state_fips):
+        # FIPS are sorted, so a state's counties are a contiguous block of rows
+        if state_fips is None:
+            return slice(None)
+        start, end = np.searchsorted(self.fips, [state_fips * 1000, (state_fips + 1) * 1000])
+        return slice(int(start), int(end))
+
+    def query_tree(self, tree, combine, rows, lo, hi):
+        result = np.full(tree[rows].shape[0], np.nan)  # double precision like the other statistics
+        lo += self.tree_size
+        hi += self.tree_size + 1
+        while lo < hi:
+            if lo & 1:
+                result = combine(result, tree[rows, lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                result = combine(result, tree[rows, hi])
+            lo >>= 1
+            hi >>= 1
+        return result
+
+    def kth_smallest(self, rows, lo, hi, k):
+        # k-th smallest (0 based) value of every county's days [lo, hi], descending the wavelet matrix one rank bit at a
+        # time while narrowing [start, end) to the window's days within the current rank range
+        index = np.arange(len(self.fips))[rows]
+        start = np.full(len(index), lo, dtype=np.int64)
+        end = np.full(len(index), hi + 1, dtype=np.int64)
+        rank = np.zeros(len(index), dtype=np.int64)
+        for zeros in self.wavelet_zeros:
+            zeros_start = zeros[index, start].astype(np.int64)
+            zeros_end = zeros[index, end].astype(np.int64)
+            num_zeros = zeros[index, -1].astype(np.int64)
+            one = k >= zeros_end - zeros_start
+            k = np.where(one, k - (zeros_end - zeros_start), k)
+            rank = 2 * rank + one
+            start = np.where(one, num_zeros + start - zeros_start, zeros_start)
+            end = np.where(one, num_zeros + end - zeros_end, zeros_end)
+        return self.sorted_values[index, rank].astype(np.float64)
+
+    def median(self, rows, lo, hi, counts):
+        # Mean of the two middle values (the same one for odd counts), NaN for counties without data in the window
+        lower = self.kth_smallest(rows, lo, hi, np.maximum(counts - 1, 0) // 2)
+        upper = self.kth_smallest(rows, lo, hi, counts // 2)
+        return np.where(counts > 0, (lower + upper) / 2, np.nan)
+
+    def query(self, from_date, to_date, statistic, state_fips=None):
+        rows = self.state_rows(state_fips)
+        lo, hi = self.day_bounds(from_date, to_date)
+        if lo > hi:
+            return pd.DataFrame({"FIPS": [], "Area Name": [], statistic: []})
+
+        counts = self.prefix_count[rows, hi + 1] - self.prefix_count[rows, lo]
+        if statistic == "Average":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                values = (self.prefix_sum[rows, hi + 1] - self.prefix_sum[rows, lo]) / counts
+        elif statistic == "Min":
+            values = self.query_tree(self.min_tree, np.fmin, rows, lo, hi)
+        elif statistic == "Max":
+            values = self.query_tree(self.max_tree, np.fmax, rows, lo, hi)
+        elif statistic == "Median":
+            values = self.median(rows, lo, hi, counts.astype(np.int64))
+        else:
+            raise ValueError(f"Unknown statistic {statistic}, expected one of {RANGE_STATISTICS}")
+
+        # Counties without any data in the range are left out, just like a groupby would
+        has_data = counts > 0
+        return pd.DataFrame({"FIPS": self.fips[rows][has_data],
+                             "Area Name": self.area_names[rows][has_data],
+                             statistic: values[has_data]})
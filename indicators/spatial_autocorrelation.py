@@ -0,0 +1,167 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from indicators import county_topology
+
+NUM_PERMUTATIONS = 999
+# Local statistics draw one set of neighbour values per edge and permutation, so they get fewer permutations
+NUM_LOCAL_PERMUTATIONS = 199
+SIGNIFICANCE = 0.05
+SEED = 0
+CLUSTER_LABELS = {(True, True): "High-High", (False, False): "Low-Low", (True, False): "High-Low",
+                  (False, True): "Low-High"}
+NOT_SIGNIFICANT = "Not significant"
+
+
+def adjacency_path(data_dir=county_topology.DATA_DIR):
+    return f"{data_dir}/{county_topology.GEO_DIR}/county_adjacency.npz"
+
+
+class CountyAdjacency:
+    # Binary contiguity of counties as a sparse (county x county) matrix whose rows and columns are in FIPS order.
+    # Two counties are neighbours if their borders share an arc of the topology
+
+    def __init__(self, fips, matrix):
+        self.fips = fips
+        self.matrix = matrix.tocsr()
+
+    @classmethod
+    def from_topology(cls, topology):
+        counties = topology["objects"][county_topology.COUNTIES_OBJECT]["geometries"]
+        fips = np.array(sorted({int(county["id"]) for county in counties}), dtype=np.int32)
+        rows, arcs = [], []
+        for county in counties:
+            arc_ids = {arc if arc >= 0 else ~arc for arc in county_topology.geometry_arc_ids(county)}
+            rows.extend([np.searchsorted(fips, int(county["id"]))] * len(arc_ids))
+            arcs.extend(arc_ids)
+        # (county x arc) incidence, counties sharing an arc are neighbours
+        incidence = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, arcs)),
+                                      shape=(len(fips), len(topology["arcs"])))
+        matrix = (incidence @ incidence.T).tolil()
+        matrix.setdiag(0)
+        matrix = matrix.tocsr()
+        matrix.eliminate_zeros()
+        matrix.data[:] = 1
+        return cls(fips, matrix.astype(np.float64))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, fips=self.fips, indptr=self.matrix.indptr, indices=self.matrix.indices)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            indices = arrays["indices"]
+            matrix = sparse.csr_matrix((np.ones(len(indices)), indices, arrays["indptr"]),
+                                       shape=(len(arrays["fips"]), len(arrays["fips"])))
+            return cls(arrays["fips"], matrix)
+
+    def weights(self, fips):
+        # Row standardised weights between the given counties (in the given order), counties the topology doesn't
+        # have get no neighbours
+        fips = np.asarray(fips)
+        positions = np.searchsorted(self.fips, fips).clip(0, max(len(self.fips) - 1, 0))
+        known = self.fips[positions] == fips if len(self.fips) else np.zeros(len(fips), dtype=bool)
+        selector = sparse.csr_matrix((np.ones(known.sum()), (np.flatnonzero(known), positions[known])),
+                                     shape=(len(fips), len(self.fips)))
+        w = (selector @ self.matrix @ selector.T).tocsr()
+        neighbours = np.asarray(w.sum(axis=1)).ravel()
+        with np.errstate(divide="ignore"):
+            w = sparse.diags(np.where(neighbours > 0, 1 / neighbours, 0.0)) @ w
+        return w.tocsr(), neighbours
+
+
+def build_adjacency(data_dir=county_topology.DATA_DIR, static_dir=county_topology.STATIC_DIR):
+    topology = county_topology.load_county_topology(static_dir=static_dir)
+    if topology is None:
+        print("No bundled topology found, run python -m indicators.county_topology first")
+        return None
+    adjacency = CountyAdjacency.from_topology(topology)
+    adjacency.save(adjacency_path(data_dir))
+    print(f"Wrote adjacency of {len(adjacency.fips)} counties ({adjacency.matrix.nnz // 2} borders) to "
+          f"{adjacency_path(data_dir)}")
+    return adjacency
+
+
+def load_adjacency(data_dir=county_topology.DATA_DIR, static_dir=county_topology.STATIC_DIR):
+    # Built from the bundled national topology the first time (or when the topology is newer), None without it
+    path = adjacency_path(data_dir)
+    topology_path = county_topology.national_topology_path(static_dir)
+    if not os.path.exists(topology_path):
+        return None
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(topology_path):
+        return CountyAdjacency.load(path)
+    return build_adjacency(data_dir, static_dir)
+
+
+def pseudo_p_value(statistic, permuted, axis):
+    # Share of permutations at least as extreme as the statistic, on whichever side of the permutations it falls
+    larger = (permuted >= statistic).sum(axis=axis)
+    larger = np.minimum(larger, permuted.shape[axis] - larger)
+    return (larger + 1) / (permuted.shape[axis] + 1)
+
+
+def global_morans_i(z, w, rng):
+    # Moran's I of the centred values z with row standardised weights (so S0 is the number of counties with
+    # neighbours), and its pseudo p-value from permuting the values across counties, all permutations in one
+    # sparse product
+    s0 = w.sum()
+    denominator = (z * z).sum()
+    if s0 == 0 or denominator == 0:
+        return np.nan, np.nan
+    scale = len(z) / s0 / denominator
+    statistic = scale * z @ (w @ z)
+    permuted = z[np.argsort(rng.random((NUM_PERMUTATIONS, len(z))), axis=1)].T
+    permuted_statistics = scale * (permuted * (w @ permuted)).sum(axis=0)
+    return float(statistic), float(pseudo_p_value(statistic, permuted_statistics, axis=0))
+
+
+def local_morans_i(z, w, neighbours, rng):
+    # LISA statistic of every county and its pseudo p-value from conditional permutations: each county keeps its
+    # value while its neighbours' values are drawn (with replacement) from the other counties
+    m2 = (z * z).sum() / max(len(z) - 1, 1)
+    lag = w @ z
+    statistics = z * lag / m2 if m2 > 0 else np.full(len(z), np.nan)
+
+    counts = neighbours.astype(np.int64)
+    has_neighbours = counts > 0
+    owners = np.repeat(np.arange(len(z)), counts)
+    draws = rng.integers(0, max(len(z) - 1, 1), size=(NUM_LOCAL_PERMUTATIONS, len(owners)))
+    draws += draws >= owners  # skip the county itself
+    p_values = np.full(len(z), np.nan)
+    if len(owners) and m2 > 0:
+        # Every county's neighbour draws are contiguous, so their sums are one reduceat per permutation
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[has_neighbours]
+        permuted_lags = np.add.reduceat(z[draws], starts, axis=1) / counts[has_neighbours]
+        permuted_statistics = z[has_neighbours] * permuted_lags / m2
+        p_values[has_neighbours] = pseudo_p_value(statistics[has_neighbours], permuted_statistics, axis=0)
+    return statistics, lag, p_values
+
+
+def spatial_autocorrelation(df, value_column, adjacency, seed=SEED):
+    # Global Moran's I of a county feature (nationally or for the counties of one state, whichever df has) and a
+    # frame with the local Moran's I, p-value and cluster of every county
+    df = df[["FIPS", value_column]].dropna().drop_duplicates("FIPS")
+    w, neighbours = adjacency.weights(df["FIPS"].to_numpy())
+    values = df[value_column].to_numpy(dtype=np.float64)
+    z = values - values.mean() if len(values) else values
+    rng = np.random.default_rng(seed)
+
+    statistic, p_value = global_morans_i(z, w, rng)
+    local, lag, local_p = local_morans_i(z, w, neighbours, rng)
+    significant = local_p <= SIGNIFICANCE
+    clusters = [CLUSTER_LABELS[(bool(high), bool(high_lag))] if is_significant else NOT_SIGNIFICANT
+                for high, high_lag, is_significant in zip(z > 0, lag > 0, significant)]
+    local_df = pd.DataFrame({"FIPS": df["FIPS"].to_numpy(), "Local Moran's I": local, "p-value": local_p,
+                             "Cluster": clusters})
+    return {"Moran's I": statistic, "p-value": p_value, "local": local_df}
+
+
+if __name__ == "__main__":
+    build_adjacency(*sys.argv[1:2])
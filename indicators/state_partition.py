@@ -0,0 +1,23 @@
+import numpy as np
+
+
+class StatePartition:
+    # Keeps a FIPS sorted frame together with the [start, end) row range of every state, so a state's counties are a
+    # contiguous slice of the national frame instead of a full-table FIPS // 1000 mask
+
+    def __init__(self, df):
+        if not df["FIPS"].is_monotonic_increasing:
+            df = df.sort_values("FIPS", kind="stable").reset_index(drop=True)
+        self.df = df
+
+        state_fips = df["FIPS"].to_numpy() // 1000
+        states, starts = np.unique(state_fips, return_index=True)
+        ends = np.append(starts[1:], len(state_fips))
+        self.offsets = {int(state): (int(start), int(end)) for state, start, end in zip(states, starts, ends)}
+
+    def state(self, state_fips):
+        start, end = self.offsets.get(int(state_fips), (0, 0))
+        return self.df.iloc[start:end]
+
+    def states(self):
+        return list(self.offsets.keys())
@@ -0,0 +1,80 @@
+import numpy as np
+from scipy import stats as scipy_stats
+
+NUM_BOOTSTRAP = 1000
+CONFIDENCE = 0.95
+# Bootstrap resamples are drawn in chunks so large frames don't allocate a (NUM_BOOTSTRAP x n) matrix at once
+BOOTSTRAP_CHUNK = 200
+
+
+def moments(x, y, axis=-1):
+    x_centered = x - x.mean(axis=axis, keepdims=True)
+    y_centered = y - y.mean(axis=axis, keepdims=True)
+    sxx = (x_centered * x_centered).sum(axis=axis)
+    syy = (y_centered * y_centered).sum(axis=axis)
+    sxy = (x_centered * y_centered).sum(axis=axis)
+    return sxx, syy, sxy
+
+
+def bootstrap_slope_and_r(x, y, num_bootstrap, seed):
+    rng = np.random.default_rng(seed)
+    slopes = np.empty(num_bootstrap)
+    rs = np.empty(num_bootstrap)
+    for start in range(0, num_bootstrap, BOOTSTRAP_CHUNK):
+        end = min(start + BOOTSTRAP_CHUNK, num_bootstrap)
+        samples = rng.integers(0, len(x), size=(end - start, len(x)))
+        sxx, syy, sxy = moments(x[samples], y[samples])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slopes[start:end] = sxy / sxx
+            rs[start:end] = sxy / np.sqrt(sxx * syy)
+    return slopes, rs
+
+
+def percentile_interval(samples, confidence):
+    tail = (1 - confidence) / 2 * 100
+    samples = samples[~np.isnan(samples)]
+    if len(samples) == 0:
+        return np.nan, np.nan
+    low, high = np.percentile(samples, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def linear_regression(x, y, num_bootstrap=NUM_BOOTSTRAP, confidence=CONFIDENCE, seed=0):
+    # Least squares fit of y on x plus Pearson's r, its two sided p-value and bootstrap confidence intervals.
+    # Rows where either value is missing are ignored
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[valid], y[valid]
+    n = len(x)
+
+    result = {"n": n, "slope": np.nan, "intercept": np.nan, "r": np.nan, "r_squared": np.nan, "p_value": np.nan,
+              "slope_ci": (np.nan, np.nan), "r_ci": (np.nan, np.nan), "confidence": confidence}
+    if n < 3:
+        return result
+
+    sxx, syy, sxy = moments(x, y)
+    if sxx == 0 or syy == 0:
+        return result
+
+    slope = sxy / sxx
+    r = float(np.clip(sxy / np.sqrt(sxx * syy), -1.0, 1.0))
+    # t statistic for r with n - 2 degrees of freedom
+    if abs(r) == 1:
+        p_value = 0.0
+    else:
+        t = r * np.sqrt((n - 2) / (1 - r * r))
+        p_value = float(2 * scipy_stats.t.sf(abs(t), n - 2))
+
+    result.update(slope=float(slope), intercept=float(y.mean() - slope * x.mean()), r=r, r_squared=r * r,
+                  p_value=p_value)
+    if num_bootstrap > 0:
+        slopes, rs = bootstrap_slope_and_r(x, y, num_bootstrap, seed)
+        result.update(slope_ci=percentile_interval(slopes, confidence), r_ci=percentile_interval(rs, confidence))
+    return result
+
+
+def fitted_line(fit, x_min, x_max):
+    # The two end points of the regression line, enough to draw it without shipping the data again
+    xs = np.array([x_min, x_max], dtype=np.float64)
+    return xs, fit["intercept"] + fit["slope"] * xs
@@ -0,0 +1,61 @@
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# Fail the benchmark if a cold start takes longer than this (seconds), so startup regressions are caught
+MAX_IMPORT_SECONDS = 5
+MAX_FIRST_PAINT_SECONDS = 6
+NUM_RUNS = 3
+
+
+def measure():
+    # Runs in a fresh interpreter: imports the app (module level work), then runs main() in streamlit's bare mode.
+    # First paint is when the page title is drawn
+    start = time.perf_counter()
+    import streamlit as st
+
+    timings = {}
+    draw_title = st.title
+
+    def timed_title(*args, **kwargs):
+        timings.setdefault("first_paint", time.perf_counter() - start)
+        return draw_title(*args, **kwargs)
+
+    st.title = timed_title
+    import streamlit_app
+    from indicators import dataset_registry
+
+    timings["import"] = time.perf_counter() - start
+    streamlit_app.main()
+    timings["full_run"] = time.perf_counter() - start
+    timings["datasets"] = dataset_registry.loaded()
+    print(json.dumps(timings))
+
+
+def run_once():
+    output = subprocess.run([sys.executable, __file__, "--measure"], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    runs = [run_once() for _ in range(NUM_RUNS)]
+    import_seconds = statistics.median(run["import"] for run in runs)
+    first_paint_seconds = statistics.median(run["first_paint"] for run in runs)
+    full_run_seconds = statistics.median(run["full_run"] for run in runs)
+    print(f"import: {import_seconds:.2f}s, first paint: {first_paint_seconds:.2f}s, full run: {full_run_seconds:.2f}s "
+          f"(median of {NUM_RUNS} cold starts)")
+    for name, seconds in runs[-1]["datasets"].items():
+        print(f"  loaded {name} in {seconds:.2f}s")
+
+    if import_seconds > MAX_IMPORT_SECONDS or first_paint_seconds > MAX_FIRST_PAINT_SECONDS:
+        print(f"Startup is slower than the budget ({MAX_IMPORT_SECONDS}s import, {MAX_FIRST_PAINT_SECONDS}s first paint)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        measure()
+    else:
+        main()
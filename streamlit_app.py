@@ -1,109 +1,29 @@
 import os
-from datetime import timedelta
+from functools import lru_cache
 from math import ceil, floor
 
 import altair as alt
-import matplotlib.pyplot as plt
-import nltk
-import numpy as np
 import pandas as pd
 import streamlit as st
 from PIL import Image
-from vega_datasets import data
 
 import twitter.tweet_fetcher
 import twitter.word_cloud
+import twitter.word_counts
+from indicators import county_topology, dataset_registry, file_cache, query
+from indicators.correlation_matrix import CORRELATION_METHODS
+from indicators.downsample import downsample_series
+from indicators.range_index import RANGE_STATISTICS
+from indicators.spatial_autocorrelation import CLUSTER_LABELS, NOT_SIGNIFICANT
+from indicators.stats import fitted_line, linear_regression
+from twitter.nltk_resources import get_stopwords
 from twitter.state_data_aggregator import STATE_TO_CODE_MAP
 from twitter.tweet_fetcher import get_saved_tweet_oembeds
 
 DATA_DIR = "data"
-# 10 min
-CACHE_TTL = 600
+TIME_SERIES_WIDTH = 800
 alt.data_transformers.disable_max_rows()
 
-
-@st.cache(allow_output_mutation=True, ttl=CACHE_TTL)  # add caching so we load the data only once
-def load_state_fips():
-    state_fips = pd.read_csv("data/fips/clean/state_fips_2019.csv", index_col=0)
-    state_fips = state_fips[state_fips["State FIPS"] > 0]  # exclude regions, divisions, and non-state rows
-    return state_fips[["State FIPS", "Name"]].sort_values("Name").set_index("Name").to_dict()["State FIPS"]
-
-
-@st.cache(allow_output_mutation=True, ttl=CACHE_TTL)
-def load_county_fips():
-    county_fips = pd.read_csv("data/fips/clean/county_fips_2019.csv", index_col=0)
-    return county_fips[["State FIPS", "FIPS", "Area Name"]]
-
-
-@st.cache(allow_output_mutation=True, ttl=CACHE_TTL)
-def load_usda_data():
-    poverty = pd.read_csv("data/usda_county_datasets/clean/poverty_2018.csv", index_col=0)
-    unemployment_median_hhi = pd.read_csv("data/usda_county_datasets/clean/unemployment_median_hhi_2018.csv",
-                                          index_col=0)
-    population = pd.read_csv("data/usda_county_datasets/clean/population_2018.csv", index_col=0)
-    education = pd.read_csv("data/usda_county_datasets/clean/education_2018.csv", index_col=0)
-    usda_data = {
-        'Poverty': poverty,
-        'Unemployment and Median HHI': unemployment_median_hhi,
-        'Population': population,
-        'Education': education
-    }
-    return usda_data
-
-
-def read_and_filter_df(df_name, cumulative=False):
-    # Read in data from local csv file
-    df = pd.read_csv(f"data/covidcast/clean/{df_name}.csv", index_col=0)
-
-    # Remove rows with values < 0.0 (not possible)
-    df = df[df['value'] >= 0.0]
-
-    # Convert time_value column into datetime type
-    df['time_value'] = pd.to_datetime(df['time_value'])
-
-    # Only fetch most recent cumulative data
-    if cumulative:
-        df = df.sort_values('time_value')
-        df = df[~df.duplicated('FIPS', keep='last')]
-
-    return df
-
-
-@st.cache(allow_output_mutation=True, ttl=CACHE_TTL)
-def load_covid_data():
-    covid_data = {}
-    covid_df_names = {
-        'Cumulative Cases per 100K people': "confirmed_cumulative_cases_prop_fips",
-        'Daily New Cases per 100K people': "confirmed_daily_incidence_cases_prop_fips",
-        "Cumulative Deaths per 100K people": "cumulative_deaths_prop_fips",
-        "Daily Deaths per 100K people": "daily_incidence_deaths_prop_fips",
-        "Daily % Covid-Related Doctor Visits": "perc_covid_doctor_visits_fips",
-        "% People Wearing Masks in Public in Past 5 Days": "perc_people_wearing_masks_fips",
-        "% People Tested for Covid in Past 14 Days": "perc_people_tested_fips",
-        "% Positive Covid Tests in Past 14 Days": "perc_positive_tests_fips",
-        "% People not Tested who Wanted Tests": "perc_wanted_test_fips"
-    }
-    for covid_feature_name, covid_df_name in covid_df_names.items():
-        cumulative = "cumulative" in covid_feature_name.lower()
-        covid_data[covid_feature_name] = read_and_filter_df(covid_df_name, cumulative)
-    return covid_data
-
-
-@st.cache(allow_output_mutation=True, ttl=CACHE_TTL)
-def get_covid_date_ranges(covid_data):
-    covid_date_ranges = {}
-    for covid_feature, df in covid_data.items():
-        covid_date_ranges[covid_feature] = df["time_value"].min(), df["time_value"].max()
-    return covid_date_ranges
-
-
-STATE_FIPS_DICT = load_state_fips()
-COUNTY_FIPS_DF = load_county_fips()  # {State FIPS, FIPS, Area Name}
-STATES = list(STATE_FIPS_DICT.keys())
-USDA_DATA = load_usda_data()
-COVID_DATA = load_covid_data()
-COVID_DATE_RANGES = get_covid_date_ranges(COVID_DATA)
-
 INTERACTIVE_CONTROL = st.sidebar.radio("Guided Exploration: ",
                                        ("Manual", "Narrative Population", "Narrative Education", "Narrative Median HHI",
                                         "Narrative Tweets"))
@@ -117,31 +37,20 @@ COVID_END_DATE = None
 COVID_AGG_FUNCTION = "Max"
 
 
-@st.cache(allow_output_mutation=True, ttl=CACHE_TTL)
+@file_cache.cached(lambda state=None, stopwords=None: [twitter.word_counts.tweets_path(DATA_DIR, state)])
 def get_cleaned_tweet_words(state=None, stopwords=None):
     return twitter.word_cloud.get_cleaned_tweet_words(DATA_DIR, state, stopwords)
 
 
-@st.cache(allow_output_mutation=True, ttl=CACHE_TTL)
-def get_wordcloud(tweets, state=None):
-    wc = twitter.word_cloud.get_wordcloud(tweets, DATA_DIR, state)
-    fig, ax = plt.subplots()
-    ax.imshow(wc, interpolation='bilinear')
-    ax.axis("off")
-    return fig
-
-
-@st.cache(allow_output_mutation=True, ttl=CACHE_TTL)
+@file_cache.cached(lambda state=None: [twitter.word_cloud.word_cloud_path(DATA_DIR, state)])
 def get_wordcloud_from_file(state=None):
-    file_name = state if state else "World"
-    file_path = f"data/word_clouds/{file_name}.jpg"
+    file_path = twitter.word_cloud.word_cloud_path(DATA_DIR, state)
     if os.path.exists(file_path):
         return Image.open(file_path)
     else:
         return None
 
 
-@st.cache(allow_output_mutation=True, ttl=CACHE_TTL)
 def get_word_df(words):
     df = pd.DataFrame({"word": words})
     df = df.groupby("word").size().to_frame()
@@ -151,6 +60,21 @@ def get_word_df(words):
     return df
 
 
+@file_cache.cached(lambda: [twitter.word_counts.vocabulary_path(DATA_DIR)])
+def get_word_vocabulary():
+    return twitter.word_counts.load_vocabulary(DATA_DIR)
+
+
+@file_cache.cached(lambda state=None, stopwords=None, n=50: twitter.word_counts.index_paths(state, DATA_DIR))
+def get_top_words(state=None, stopwords=None, n=50):
+    # Read the top words from the prebuilt word count index, only tokenize the tweets if it hasn't been built
+    vocabulary = get_word_vocabulary()
+    word_counts = twitter.word_counts.load_word_counts(state, DATA_DIR)
+    if vocabulary is None or word_counts is None:
+        return get_word_df(get_cleaned_tweet_words(state, stopwords)).head(n)
+    return twitter.word_counts.top_words(vocabulary, word_counts, n, stopwords)
+
+
 def draw_tweet_data(stopwords, representation, container, state=None):
 
     container.subheader("Most Frequent Words")
@@ -161,14 +85,12 @@ def draw_tweet_data(stopwords, representation, container, state=None):
         if cached_pic:
             container.image(cached_pic, width=600)
         else:
-            cleaned_tweets = get_cleaned_tweet_words(state, stopwords)
-            wordcloud = get_wordcloud(cleaned_tweets, state)
-            container.pyplot(wordcloud)
+            # Word clouds are rendered offline, see twitter.word_cloud_builder
+            container.warning("This word cloud hasn't been rendered yet, use the bar chart view instead")
     else:
-        cleaned_tweets = get_cleaned_tweet_words(state, stopwords)
         title = f"{state} Tweets" if state else "Global Tweets"
         bar_chart_size = 50
-        df = get_word_df(cleaned_tweets).head(bar_chart_size)
+        df = get_top_words(state, stopwords, bar_chart_size)
         chart = alt.Chart(df).mark_bar().encode(
             x=alt.X("word:N", sort="-y"),
             y=alt.Y("count:Q"),
@@ -177,6 +99,24 @@ def draw_tweet_data(stopwords, representation, container, state=None):
         container.write(chart)
 
 
+def get_counties_data(selected_state_fips=None):
+    # The bundled, pre-simplified county geometry (just the selected state's counties for state views), fetched by the
+    # browser from the app's static files so it is cached there instead of being sent with every chart
+    if os.path.exists(county_topology.topology_path(selected_state_fips)):
+        url = county_topology.topology_url(selected_state_fips)
+    else:
+        warn_missing_geometry()
+        url = county_topology.US_10M_URL
+    return alt.UrlData(url=url, format=alt.DataFormat(type='topojson', feature='counties'))
+
+
+@lru_cache(maxsize=None)
+def warn_missing_geometry():
+    # Once per process, the maps then draw from the vega datasets CDN like they did before the geometry was bundled
+    print(f"No county geometry in {county_topology.STATIC_DIR}/{county_topology.GEO_DIR}, the maps fetch "
+          f"{county_topology.US_10M_URL} instead. Build it with python -m indicators.county_topology")
+
+
 def get_state_map_base(counties, selected_state_fips):
     base = alt.Chart(data=counties)\
         .mark_geoshape(stroke='black', strokeWidth=1)\
@@ -198,81 +138,137 @@ def add_selection(map, highlighter, multiselector):
                                           alt.StrokeWidthValue(1.0)))
 
 
+def build_payload(df, fields):
+    # Only send the columns an encoding or tooltip references (each row once) instead of serialising the whole frame.
+    # Identical payloads are consolidated into a single named dataset by altair, so layers can share them
+    fields = [field for field in dict.fromkeys(fields) if field in df.columns]
+    return df[fields].drop_duplicates().reset_index(drop=True)
+
+
 def get_specific_state_map(state_map_base, selected_feature, selected_feature_label, lookup_df, lookup_fields):
+    lookup_fields = [selected_feature] + lookup_fields
     return state_map_base.encode(color="%s:Q" % selected_feature,
                                  tooltip=[alt.Tooltip('id:N', title='FIPS'),
                                           alt.Tooltip('Area Name:N', title='Location'),
                                           alt.Tooltip('%s:Q' % selected_feature, title=selected_feature_label)]) \
-        .transform_lookup(lookup='id', from_=alt.LookupData(lookup_df, 'FIPS', [selected_feature] + lookup_fields))
+        .transform_lookup(lookup='id', from_=alt.LookupData(build_payload(lookup_df, ['FIPS'] + lookup_fields),
+                                                            'FIPS', lookup_fields))
+
+
+CLUSTER_COLORS = ["#d7191c", "#2c7bb6", "#fdae61", "#abd9e9"]
+
+
+def get_spatial_cluster_layers(control_panel, map_base, frame, title):
+    # Outlines of the counties in a significant local Moran's I cluster, to layer over a choropleth drawn from the same
+    # base, and the map title with the global Moran's I of the feature. frame is the query frame the choropleth shows
+    if not control_panel.get('show_spatial_clusters'):
+        return [], title
+    clusters = query.query_spatial_clusters(*control_panel.get('query_args'), frame=frame)
+    if clusters is None:
+        return [], title
+    significant = clusters["local"][clusters["local"]["Cluster"] != NOT_SIGNIFICANT]
+    outlines = map_base.mark_geoshape(filled=False, strokeWidth=2.5) \
+        .encode(stroke=alt.Stroke("Cluster:N", scale=alt.Scale(domain=list(CLUSTER_LABELS.values()), range=CLUSTER_COLORS),
+                                  legend=alt.Legend(title="Local Moran's I cluster"))) \
+        .transform_lookup(lookup='id', from_=alt.LookupData(build_payload(significant, ['FIPS', 'Cluster']),
+                                                            'FIPS', ['Cluster'])) \
+        .transform_filter("isValid(datum.Cluster)")
+    subtitle = "Moran's I = %.3f (p = %.3f)" % (clusters["Moran's I"], clusters["p-value"])
+    return [outlines], alt.TitleParams(text=title, subtitle=subtitle)
 
 
 def round_to_nearest(number, nearest, roundup=True):
     return int(ceil(number / nearest) * nearest) if roundup else int(floor(number / nearest) * nearest)
 
 
-def get_covid_corr_chart(full_df, selected_usda_feature, selected_covid_feature):
-    correlation = np.corrcoef(full_df["value"], full_df[selected_usda_feature])
+def get_covid_corr_chart(full_df, selected_usda_feature, selected_covid_feature, county_selection=None):
+    full_df = build_payload(full_df, ["FIPS", "value", selected_usda_feature, "Area Name"])
+    fit = linear_regression(full_df["value"], full_df[selected_usda_feature])
 
     x_min = round_to_nearest(full_df['value'].min(), 10, roundup=False)
     x_max = round_to_nearest(full_df['value'].max(), 10, roundup=True)
     y_min = round_to_nearest(full_df[selected_usda_feature].min(), 10, roundup=False)
     y_max = round_to_nearest(full_df[selected_usda_feature].max(), 10, roundup=True)
+    x_scale = alt.Scale(domain=[x_min, x_max])
+    y_scale = alt.Scale(domain=[y_min, y_max])
 
-    covid_details_chart = alt.Chart(full_df).mark_point() \
+    covid_points_chart = alt.Chart(full_df).mark_point() \
         .encode(x=alt.X("value:Q",
                         axis=alt.Axis(title=selected_covid_feature),
-                        scale=alt.Scale(domain=[x_min, x_max])),
+                        scale=x_scale),
                 y=alt.Y(selected_usda_feature + ":Q",
-                        scale=alt.Scale(domain=[y_min, y_max])),
-                tooltip=[alt.Tooltip("Area Name_x:N", title="County")]) \
-        .properties(title="Correlation between %s and %s: %.4f" % (
-        selected_covid_feature, selected_usda_feature, correlation[0, 1]))
-
-    covid_details_chart = covid_details_chart + \
-                          covid_details_chart\
-                              .transform_regression('value', selected_usda_feature, method='linear') \
-                              .mark_line(color="#000000")
-    return covid_details_chart
+                        scale=y_scale),
+                tooltip=[alt.Tooltip("Area Name:N", title="County")])
+    if county_selection is not None:
+        covid_points_chart = covid_points_chart \
+            .add_selection(county_selection) \
+            .transform_filter(county_selection)
+
+    # The regression is fitted on the server, so the line only needs its two end points
+    line_x, line_y = fitted_line(fit, full_df['value'].min(), full_df['value'].max())
+    regression_line = alt.Chart(pd.DataFrame({"value": line_x, selected_usda_feature: line_y})) \
+        .mark_line(color="#000000", clip=True) \
+        .encode(x=alt.X("value:Q", scale=x_scale), y=alt.Y(selected_usda_feature + ":Q", scale=y_scale))
+
+    title = alt.TitleParams(
+        "Correlation between %s and %s: %.4f" % (selected_covid_feature, selected_usda_feature, fit["r"]),
+        subtitle="r² = %.4f, p = %.3g, %d%% CI for r: [%.4f, %.4f], slope = %.4f (%d%% CI: [%.4f, %.4f])" % (
+            fit["r_squared"], fit["p_value"], fit["confidence"] * 100, fit["r_ci"][0], fit["r_ci"][1],
+            fit["slope"], fit["confidence"] * 100, fit["slope_ci"][0], fit["slope_ci"][1]))
+    return alt.layer(covid_points_chart, regression_line).properties(title=title)
 
 
 def widget_key(widget_name, selected_state_fips=None):
     return widget_name if selected_state_fips is None else f"{widget_name}_state"
 
 
+def query_frames(covid_feature, usda_category, usda_measure, state_fips, date_range, statistic):
+    return query.query(covid_feature, usda_category, usda_measure, state_fips=state_fips, date_range=date_range,
+                       statistic=statistic)
+
+
+@file_cache.cached(lambda *args: query.USDA_PATHS + query.COVID_PATHS, cache=query.QUERY_CACHE)
+def get_time_series_data(covid_feature, usda_category, usda_measure, state_fips, date_range, statistic,
+                         full_resolution):
+    # Each county's line is downsampled to what the chart width can show, the counties named in full_resolution keep
+    # every day
+    covid_df = query_frames(covid_feature, usda_category, usda_measure, state_fips, date_range, statistic)['covid_df']
+    county_names = covid_df.drop_duplicates('FIPS').set_index('Area Name')['FIPS']
+    time_series = downsample_series(covid_df, 'FIPS', 'time_value', 'value', TIME_SERIES_WIDTH,
+                                    full_resolution=county_names.loc[list(full_resolution)])
+    return build_payload(time_series, ['FIPS', 'time_value', 'value', 'Area Name'])
+
+
 def draw_control_panel(col1, col2, container, selected_state_fips=None):
+    # Widgets only, the frames for the selected options come from query.query
 
     # Select USDA socioeconomic indicator
-    selected_usda_category = col1.selectbox('Socioeconomic Indicator', options=list(USDA_DATA.keys()),
-                                            index=0 if not NARRATIVE or SOCIOECONOMIC_INDICATOR is None else list(USDA_DATA.keys()).index(SOCIOECONOMIC_INDICATOR),
+    usda_categories = query.usda_categories()
+    selected_usda_category = col1.selectbox('Socioeconomic Indicator', options=usda_categories,
+                                            index=0 if not NARRATIVE or SOCIOECONOMIC_INDICATOR is None else usda_categories.index(SOCIOECONOMIC_INDICATOR),
                                             key=widget_key("usda_category", selected_state_fips))
-    usda_df = USDA_DATA.get(selected_usda_category)
-    usda_df = usda_df[usda_df["FIPS"] % 1000 != 0]  # remove non-county rows
 
     # Select USDA feature to color choropleth map
-    usda_features = [col for col in usda_df.columns if col not in ['FIPS', 'State Abrv', 'Area Name']]
+    usda_features = query.usda_measures(selected_usda_category)
     selected_usda_feature = col1.selectbox('Measure', options=usda_features,
                                            index=0 if not NARRATIVE or SOCIOECONOMIC_FEATURE not in usda_features else usda_features.index(SOCIOECONOMIC_FEATURE),
                                            key=widget_key("usda_feature", selected_state_fips))
 
     # Select Covid-19 feature to color choropleth map
-    selected_covid_feature = col2.selectbox('Covid-19 Feature', options=list(COVID_DATA.keys()),
-                                            index=0 if not NARRATIVE or COVID_FEATURE is None else list(COVID_DATA.keys()).index(COVID_FEATURE),
+    covid_features = query.covid_features()
+    selected_covid_feature = col2.selectbox('Covid-19 Feature', options=covid_features,
+                                            index=0 if not NARRATIVE or COVID_FEATURE is None else covid_features.index(COVID_FEATURE),
                                             key=widget_key("covid_feature", selected_state_fips))
-    covid_df = COVID_DATA.get(selected_covid_feature)
 
     selected_covid_agg_function = None
-    covid_df_agg = None
+    date_range = None
 
-    # Filter for counties in the selected state
-    if selected_state_fips is not None:
-        usda_df = usda_df[usda_df["FIPS"] // 1000 == selected_state_fips]
-        covid_df = covid_df[covid_df["FIPS"] // 1000 == selected_state_fips]
-
-    if 'Cumulative' not in selected_covid_feature:
+    if not query.is_cumulative(selected_covid_feature):
 
         # Select date range
-        min_date, max_date = COVID_DATE_RANGES.get(selected_covid_feature)
-        selected_min_date = col2.date_input("From Date", value=max_date - timedelta(days=7),
+        min_date, max_date = query.covid_date_range(selected_covid_feature)
+        default_min_date, _ = query.default_date_range(selected_covid_feature)
+        selected_min_date = col2.date_input("From Date", value=default_min_date,
                                             min_value=min_date, max_value=max_date,
                                             key=widget_key("min_date", selected_state_fips))
         selected_max_date = col2.date_input("To Date", value=max_date,
@@ -280,43 +276,71 @@ def draw_control_panel(col1, col2, container, selected_state_fips=None):
                                             key=widget_key("max_date", selected_state_fips))
         if selected_min_date > selected_max_date:
             container.error("ERROR: 'From Date' must be earlier or equal to 'To Date'")
+        date_range = (selected_min_date, selected_max_date)
 
         # Select function for values in date range
-        covid_date_range_functions = ["Max", "Min", "Average", "Median"]
+        covid_date_range_functions = RANGE_STATISTICS
         selected_covid_agg_function = col2.selectbox("Statistic for date range", options=covid_date_range_functions,
-                                                     index=covid_date_range_functions.index("Max"),
+                                                     index=covid_date_range_functions.index(query.DEFAULT_STATISTIC),
                                                      key=widget_key("covid_agg_function", selected_state_fips))
 
-        # Select rows within date range
-        covid_df = covid_df[(covid_df["time_value"] >= pd.Timestamp(selected_min_date)) &
-                            (covid_df["time_value"] <= pd.Timestamp(selected_max_date))]
-
-        # Aggregate data based on selected agg function
-        covid_df_agg = covid_df.groupby(['FIPS', 'Area Name'])['value']\
-            .agg(Min='min', Max='max', Average='mean', Median='median') \
-            .reset_index()
-
     else:
-        col2.selectbox('Cumulative as of', options=[COVID_DATE_RANGES.get(selected_covid_feature)[1].strftime("%B %d, %Y")],
+        col2.selectbox('Cumulative as of', options=[query.covid_date_range(selected_covid_feature)[1].strftime("%B %d, %Y")],
                        key=widget_key("cumulative_last_update", selected_state_fips))
 
+    show_spatial_clusters = col1.checkbox("Outline spatial clusters (local Moran's I)", value=False,
+                                          key=widget_key("spatial_clusters", selected_state_fips))
+    if show_spatial_clusters and dataset_registry.get("county_adjacency") is None:
+        container.info('Spatial clusters need the bundled county geometry, see `python -m indicators.county_topology`.')
+
+    query_args = (selected_covid_feature, selected_usda_category, selected_usda_feature, selected_state_fips,
+                  date_range, selected_covid_agg_function or query.DEFAULT_STATISTIC)
+    frames = query_frames(*query_args)
+
     control_panel = {
-        'usda_df': usda_df,
-        'covid_df': covid_df,
-        'covid_df_agg': covid_df_agg,
+        'usda_df': frames['usda_df'],
+        'covid_df': frames['covid_df'],
+        'covid_df_agg': frames['covid_df_agg'],
+        'full_df': frames['full_df'],
         'selected_usda_category': selected_usda_category,
         'selected_usda_feature': selected_usda_feature,
         'selected_covid_feature': selected_covid_feature,
-        'selected_covid_agg_function': selected_covid_agg_function
+        'selected_covid_agg_function': selected_covid_agg_function,
+        'show_spatial_clusters': show_spatial_clusters,
+        'query_args': query_args
     }
 
     return control_panel
 
 
+@file_cache.cached(lambda *args: query.USDA_PATHS + query.COVID_PATHS, cache=query.QUERY_CACHE)
+def get_correlation_data(method, selected_state_fips=None):
+    return build_payload(query.query_correlations(method, selected_state_fips), ["Measure", "Covid Feature", "r"])
+
+
+def get_correlation_heatmap(correlations, method):
+    base = alt.Chart(correlations) \
+        .encode(x=alt.X("Covid Feature:N", axis=alt.Axis(title=None, labelAngle=-45, labelLimit=250)),
+                y=alt.Y("Measure:N", axis=alt.Axis(title=None, labelLimit=300)))
+    heatmap = base.mark_rect() \
+        .encode(color=alt.Color("r:Q", scale=alt.Scale(scheme="redblue", domain=[-1, 1])),
+                tooltip=[alt.Tooltip("Measure:N"), alt.Tooltip("Covid Feature:N"),
+                         alt.Tooltip("r:Q", title="%s r" % method, format=".4f")])
+    labels = base.mark_text(fontSize=10).encode(text=alt.Text("r:Q", format=".2f"))
+    return alt.layer(heatmap, labels).properties(title="%s correlation between every indicator and Covid-19 feature" % method)
+
+
+def draw_correlation_matrix(container, selected_state_fips=None):
+    method = container.radio("Correlation", options=CORRELATION_METHODS,
+                             key=widget_key("correlation_method", selected_state_fips))
+    heatmap = get_correlation_heatmap(get_correlation_data(method, selected_state_fips), method)
+    container.write(heatmap.properties(width=800, height=400))
+
+
 def draw_us_counties(container):
 
-    counties = alt.topo_feature(data.us_10m.url, 'counties')
-    col1, col2 = container.beta_columns(2)
+    counties = get_counties_data()
+    col1, col2 = container.columns(2)
     control_panel = draw_control_panel(col1, col2, container, selected_state_fips=None)
 
     # TODO Commented lines are for being able to select counties on the map, didn't finish it yet
@@ -341,49 +365,56 @@ def draw_us_counties(container):
                                           selected_feature_label='Value',
                                           lookup_df=control_panel.get('usda_df'),
                                           lookup_fields=['Area Name'])
-    usda_usa_map = usda_usa_map\
-        .properties(title="%s: %s" % (control_panel.get('selected_usda_category'), control_panel.get('selected_usda_feature')))
+    usda_cluster_layers, usda_title = get_spatial_cluster_layers(
+        control_panel, country_base, 'usda_df',
+        "%s: %s" % (control_panel.get('selected_usda_category'), control_panel.get('selected_usda_feature')))
 
-    container.write(alt.layer(usa_map_background, usda_usa_map).configure_legend(orient='bottom'))
+    container.write(alt.layer(usa_map_background, usda_usa_map, *usda_cluster_layers).properties(title=usda_title)
+                    .configure_legend(orient='bottom'))
 
-    if 'Cumulative' not in control_panel.get('selected_covid_feature'):
+    if not query.is_cumulative(control_panel.get('selected_covid_feature')):
 
         covid_usa_map = get_specific_state_map(country_base,
                                                selected_feature=control_panel.get('selected_covid_agg_function'),
                                                selected_feature_label=control_panel.get('selected_covid_agg_function'),
                                                lookup_df=control_panel.get('covid_df_agg'),
-                                               lookup_fields=['time_value', 'issue', 'Area Name'])
+                                               lookup_fields=['Area Name'])
 
-        covid_usa_map = covid_usa_map.properties(title=control_panel.get('selected_covid_feature'))
-        container.write(alt.layer(usa_map_background, covid_usa_map).configure_legend(orient='bottom'))
+        covid_cluster_layers, covid_title = get_spatial_cluster_layers(
+            control_panel, country_base, 'covid_df_agg', control_panel.get('selected_covid_feature'))
+        container.write(alt.layer(usa_map_background, covid_usa_map, *covid_cluster_layers)
+                        .properties(title=covid_title).configure_legend(orient='bottom'))
 
     else:
         covid_usa_map = get_specific_state_map(country_base,
                                                selected_feature='value',
                                                selected_feature_label='Value',
                                                lookup_df=control_panel.get('covid_df'),
-                                               lookup_fields=['time_value', 'issue', 'Area Name'])
-        covid_usa_map = covid_usa_map.properties(title=control_panel.get('selected_covid_feature'))
+                                               lookup_fields=['Area Name'])
+        covid_cluster_layers, covid_title = get_spatial_cluster_layers(
+            control_panel, country_base, 'covid_df', control_panel.get('selected_covid_feature'))
 
-        full_df_usa = control_panel.get('covid_df').merge(control_panel.get('usda_df'), on="FIPS")
-        usa_cor_plot = get_covid_corr_chart(full_df_usa, control_panel.get('selected_usda_feature'),
+        usa_cor_plot = get_covid_corr_chart(control_panel.get('full_df'), control_panel.get('selected_usda_feature'),
                                             control_panel.get('selected_covid_feature'))
         usa_cor_plot = usa_cor_plot.properties(width=800, height=500)
 
-        container.write(alt.layer(usa_map_background, covid_usa_map).configure_legend(orient='bottom'))
+        container.write(alt.layer(usa_map_background, covid_usa_map, *covid_cluster_layers)
+                        .properties(title=covid_title).configure_legend(orient='bottom'))
         container.write(usa_cor_plot)
 
+    draw_correlation_matrix(container, selected_state_fips=None)
+
 
 def draw_state_counties(selected_state, container):
 
-    counties = alt.topo_feature(data.us_10m.url, 'counties')
-    selected_state_fips = STATE_FIPS_DICT.get(selected_state)
-    col1, col2 = container.beta_columns(2)
+    selected_state_fips = query.states().get(selected_state)
+    counties = get_counties_data(selected_state_fips)
+    col1, col2 = container.columns(2)
 
     control_panel = draw_control_panel(col1, col2, container, selected_state_fips)
     container.info('Hold Shift + click counties to only see their data on the chart below. Double-click map to reset selection.')
 
-    select_all_counties_default = not ('Cumulative' not in control_panel.get('selected_covid_feature'))
+    select_all_counties_default = query.is_cumulative(control_panel.get('selected_covid_feature'))
     select_all_counties = "all" if container.checkbox('Select all counties by default to display on plot', value=select_all_counties_default) else "none"
     county_highlight = alt.selection_single(on='mouseover', empty=select_all_counties, fields=["FIPS"])
     county_multiselect = alt.selection_multi(empty=select_all_counties, fields=["FIPS"])
@@ -397,23 +428,32 @@ def draw_state_counties(selected_state, container):
                                             selected_feature_label='Value',
                                             lookup_df=control_panel.get('usda_df'), lookup_fields=['Area Name'])
 
-    usda_state_map = add_selection(usda_state_map, county_highlight, county_multiselect) \
-        .properties(title="%s: %s" % (control_panel.get('selected_usda_category'), control_panel.get('selected_usda_feature')))
+    usda_cluster_layers, usda_title = get_spatial_cluster_layers(
+        control_panel, state_map_base, 'usda_df',
+        "%s: %s" % (control_panel.get('selected_usda_category'), control_panel.get('selected_usda_feature')))
+    usda_state_map = alt.layer(add_selection(usda_state_map, county_highlight, county_multiselect),
+                               *usda_cluster_layers).properties(title=usda_title)
 
-    if 'Cumulative' not in control_panel.get('selected_covid_feature'):
+    if not query.is_cumulative(control_panel.get('selected_covid_feature')):
         covid_state_map = get_specific_state_map(state_map_base,
                                                  selected_feature=control_panel.get('selected_covid_agg_function'),
                                                  selected_feature_label=control_panel.get('selected_covid_agg_function'),
                                                  lookup_df=control_panel.get('covid_df_agg'),
-                                                 lookup_fields=['time_value', 'issue', 'Area Name'])
-        covid_state_map = covid_state_map.properties(title=control_panel.get('selected_covid_feature'))
+                                                 lookup_fields=['Area Name'])
+        covid_cluster_layers, covid_title = get_spatial_cluster_layers(
+            control_panel, state_map_base, 'covid_df_agg', control_panel.get('selected_covid_feature'))
 
         x_min = control_panel.get('covid_df')['time_value'].min()
         x_max = control_panel.get('covid_df')['time_value'].max()
         y_min = round_to_nearest(control_panel.get('covid_df')['value'].min(), 10, roundup=False)
         y_max = round_to_nearest(control_panel.get('covid_df')['value'].max(), 10, roundup=True)
 
-        covid_details_chart = alt.Chart(control_panel.get('covid_df')).mark_line() \
+        # Counties picked here are plotted at full resolution, the others are downsampled
+        county_names = control_panel.get('covid_df')['Area Name'].unique()
+        full_resolution = container.multiselect('Counties to plot at full resolution', options=sorted(county_names),
+                                                key=widget_key("full_resolution_counties", selected_state_fips))
+        covid_time_series = get_time_series_data(*control_panel.get('query_args'), tuple(sorted(full_resolution)))
+        covid_details_chart = alt.Chart(covid_time_series).mark_line() \
             .encode(x=alt.X('time_value:T', axis=alt.Axis(title="Day", format=("%b %d, %Y"), labelAngle=-45),
                             scale=alt.Scale(domain=[x_min, x_max])),
                     y=alt.Y('value:Q', axis=alt.Axis(title="%s" % control_panel.get('selected_covid_feature')),
@@ -428,19 +468,18 @@ def draw_state_counties(selected_state, container):
                                                  selected_feature='value',
                                                  selected_feature_label='Value',
                                                  lookup_df=control_panel.get('covid_df'),
-                                                 lookup_fields=['time_value', 'issue', 'Area Name'])
-        covid_state_map = covid_state_map.properties(title=control_panel.get('selected_covid_feature'))
+                                                 lookup_fields=['Area Name'])
+        covid_cluster_layers, covid_title = get_spatial_cluster_layers(
+            control_panel, state_map_base, 'covid_df', control_panel.get('selected_covid_feature'))
 
         # Find correlation between the feature and the COVID stats
-        full_df = control_panel.get('covid_df').merge(control_panel.get('usda_df'), on="FIPS")
-        covid_details_chart = get_covid_corr_chart(full_df,
+        covid_details_chart = get_covid_corr_chart(control_panel.get('full_df'),
                                                    control_panel.get('selected_usda_feature'),
-                                                   control_panel.get('selected_covid_feature'))
-        covid_details_chart = covid_details_chart \
-            .add_selection(county_multiselect) \
-            .transform_filter(county_multiselect)
+                                                   control_panel.get('selected_covid_feature'),
+                                                   county_selection=county_multiselect)
 
     # Draw maps side-by-side
+    county_names = build_payload(dataset_registry.get("county_fips_partition").state(selected_state_fips), ['FIPS', 'Area Name'])
     map_background = alt.Chart(data=counties)\
         .mark_geoshape(stroke='black', strokeWidth=1, fill='lightgray')\
         .transform_calculate(state_id="(datum.id/1000)|0", FIPS="datum.id")\
@@ -448,24 +487,32 @@ def draw_state_counties(selected_state, container):
         .properties(width=400, height=400)\
         .encode(tooltip=[alt.Tooltip('id:N', title='FIPS'),
                          alt.Tooltip('Area Name:N', title='Location')])\
-        .transform_lookup(lookup='id', from_=alt.LookupData(COUNTY_FIPS_DF, 'FIPS', ['Area Name']))
+        .transform_lookup(lookup='id', from_=alt.LookupData(county_names, 'FIPS', ['Area Name']))
 
-    covid_state_map = add_selection(alt.layer(map_background, covid_state_map), county_highlight, county_multiselect)
+    covid_state_map = alt.layer(add_selection(alt.layer(map_background, covid_state_map), county_highlight, county_multiselect),
+                                *covid_cluster_layers).properties(title=covid_title)
     state_maps = alt.hconcat(usda_state_map, covid_state_map).resolve_scale(color='independent')
 
     # Draw covid details chart below maps
-    covid_details_chart = covid_details_chart.properties(width=800, height=400)
+    covid_details_chart = covid_details_chart.properties(width=TIME_SERIES_WIDTH, height=400)
     container.write(alt.vconcat(state_maps, covid_details_chart).configure_legend(orient='bottom'))
 
+    draw_correlation_matrix(container, selected_state_fips)
+
+
+@file_cache.cached(lambda state: twitter.tweet_fetcher.oembed_sources(DATA_DIR, state))
+def get_tweet_oembeds(state):
+    return get_saved_tweet_oembeds(DATA_DIR, state)
+
 
 def draw_embedded_tweets(state, container):
-    tweet_oembeds = get_saved_tweet_oembeds(DATA_DIR, state)
+    tweet_oembeds = get_tweet_oembeds(state)
     num_tweets = len(tweet_oembeds)
     half_num = int(num_tweets / 2)
     # Two rows are good for now with 6 tweets
     container.subheader("Example Tweets")
-    row1 = container.beta_columns(half_num) if half_num > 0 else []
-    row2 = container.beta_columns(num_tweets - half_num) if num_tweets - half_num > 0 else []
+    row1 = container.columns(half_num) if half_num > 0 else []
+    row2 = container.columns(num_tweets - half_num) if num_tweets - half_num > 0 else []
     for i in range(num_tweets):
         if i < half_num:
             row1[i].markdown(tweet_oembeds[i], unsafe_allow_html=True)
@@ -543,6 +590,25 @@ def write_narrative_1(container):
 
 
 
+def draw_tweet_section(stopwords, representation, state_code, container):
+    draw_tweet_data(stopwords, representation, container, state_code)
+    draw_embedded_tweets(state_code, container=container)
+
+
+def draw_sections(sections):
+    # Streamlit can't tell us whether an expander is open, so each section gets a sidebar toggle that starts out the
+    # same as its expander. A section that is toggled off never calls its draw function (no queries, cache lookups or
+    # charts sent to the browser). The toggle key includes the guided exploration mode so switching modes resets the
+    # toggles to that mode's defaults. Sections that are on draw from data memoised on their inputs (the get_* helpers)
+    st.sidebar.markdown("**Load Sections**")
+    for section_key, title, expanded, draw, inputs in sections:
+        container = st.expander(title, expanded=expanded)
+        if st.sidebar.checkbox(title, value=expanded, key=f"section_{section_key}_{INTERACTIVE_CONTROL}"):
+            draw(*inputs, container)
+        else:
+            container.info(f"Turn on **{title}** under Load Sections in the sidebar to see this section")
+
+
 def main():
 
     # Source for adjusting container width in streamlit app
@@ -562,45 +628,38 @@ def main():
         unsafe_allow_html=True,
     )
 
-    # Import package data
-    nltk.download("stopwords")
-    nltk.download("punkt")
-    stopwords = nltk.corpus.stopwords.words("english")
-
     # Page Title
     st.title("US Socioeconomic Indicators vs Covid-19")
 
+    # Import package data (read from the local bundle, only downloaded the first time it is missing)
+    stopwords = get_stopwords()
+
     # Write narrative
-    narrative_1_container = st.beta_expander("Narrative: Socioeconomic Analysis", expanded=INTERACTIVE_CONTROL not in ['Manual', 'Narrative Tweets'])
+    narrative_1_container = st.expander("Narrative: Socioeconomic Analysis", expanded=INTERACTIVE_CONTROL not in ['Manual', 'Narrative Tweets'])
     write_narrative_1(narrative_1_container)
 
-    narrative_2_container = st.beta_expander("Narrative: Exploring Tweets", expanded=INTERACTIVE_CONTROL == 'Narrative Tweets')
+    narrative_2_container = st.expander("Narrative: Exploring Tweets", expanded=INTERACTIVE_CONTROL == 'Narrative Tweets')
     write_narrative_2(narrative_2_container)
 
     # Sidebar
     word_rep = st.sidebar.radio("Display tweets as: ", ("Word Cloud", "Bar Chart"),
                                 index=1 if INTERACTIVE_CONTROL == 'Narrative Tweets' else 0)
-    selected_state = st.sidebar.selectbox('US State', options=STATES, index=STATES.index(STATE_TO_VIEW))
+    states = list(query.states().keys())
+    selected_state = st.sidebar.selectbox('US State', options=states, index=states.index(STATE_TO_VIEW))
 
-    # Container objects
-    state_tweets_container = st.beta_expander(f"{selected_state} Tweets", expanded=INTERACTIVE_CONTROL in ['Manual', 'Narrative Tweets'])
-    state_indicators_container = st.beta_expander(f"{selected_state} Indicators", expanded=INTERACTIVE_CONTROL != 'Narrative Tweets')
-    global_tweets_container = st.beta_expander("Global Tweets", expanded=INTERACTIVE_CONTROL == 'Narrative Tweets')
-    country_indicators_container = st.beta_expander("United States Indicators", expanded=INTERACTIVE_CONTROL not in ['Manual', 'Narrative Tweets'])
-
-    # State Tweets
+    # Sections below the narrative, in page order. Each one is only drawn if it is turned on in the sidebar
     state_code = STATE_TO_CODE_MAP[selected_state.strip()]
-    draw_tweet_data(stopwords, word_rep, state_tweets_container, state_code)
-    draw_embedded_tweets(STATE_TO_CODE_MAP[selected_state.strip()], container=state_tweets_container)
-
-    # State Indicators
-    draw_state_counties(selected_state, state_indicators_container)
-
-    # Global Tweets
-    draw_tweet_data(stopwords, word_rep, global_tweets_container, None)
-
-    # United States Indicators
-    draw_us_counties(country_indicators_container)
+    sections = [
+        ("state_tweets", f"{selected_state} Tweets", INTERACTIVE_CONTROL in ['Manual', 'Narrative Tweets'],
+         draw_tweet_section, (stopwords, word_rep, state_code)),
+        ("state_indicators", f"{selected_state} Indicators", INTERACTIVE_CONTROL != 'Narrative Tweets',
+         draw_state_counties, (selected_state,)),
+        ("global_tweets", "Global Tweets", INTERACTIVE_CONTROL == 'Narrative Tweets',
+         draw_tweet_data, (stopwords, word_rep)),
+        ("country_indicators", "United States Indicators", INTERACTIVE_CONTROL not in ['Manual', 'Narrative Tweets'],
+         draw_us_counties, ()),
+    ]
+    draw_sections(sections)
 
 
 if __name__ == "__main__":
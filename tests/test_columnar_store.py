@@ -0,0 +1,108 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+
+from indicators import columnar_store
+from indicators.columnar_store import COVID_CSV_DIR
+
+NAME = "confirmed_daily_incidence_cases_prop_fips"
+
+
+def covid_csv():
+    # Clean history rows out of FIPS order, with a revision, a revision to a negative value and a negative row
+    return pd.DataFrame({
+        "FIPS": [42003, 1001, 1001, 1003, 1001, 1003, 42003],
+        "time_value": ["2020-06-01", "2020-06-01", "2020-06-02", "2020-06-01", "2020-06-01", "2020-06-02",
+                       "2020-06-02"],
+        "issue": ["2020-06-02", "2020-06-02", "2020-06-03", "2020-06-02", "2020-06-04", "2020-06-03", "2020-06-03"],
+        "value": [1.5, 2.0, 3.0, -1.0, 2.5, 4.0, 5.0],
+        "State Name": ["Pennsylvania", "Alabama", "Alabama", "Alabama", "Alabama", "Alabama", "Pennsylvania"],
+        "Area Name": ["Allegheny County", "Autauga County", "Autauga County", "Baldwin County", "Autauga County",
+                      "Baldwin County", "Allegheny County"],
+    })
+
+
+def write_csv(df, data_dir, name):
+    path = columnar_store.csv_path(data_dir, COVID_CSV_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_csv(path)
+    return path
+
+
+def touch_later(path, reference):
+    # File systems with coarse timestamps can give two quick writes the same mtime
+    mtime = os.path.getmtime(reference) + 10
+    os.utime(path, (mtime, mtime))
+
+
+def test_resolve_revisions_keeps_the_latest_issue():
+    resolved = columnar_store.clean_covid_df(covid_csv())
+    rows = resolved.set_index(["FIPS", resolved["time_value"].dt.strftime("%Y-%m-%d")])["value"].sort_index()
+    assert rows.to_dict() == {(1001, "2020-06-01"): 2.5, (1001, "2020-06-02"): 3.0, (1003, "2020-06-02"): 4.0,
+                              (42003, "2020-06-01"): 1.5, (42003, "2020-06-02"): 5.0}
+
+
+def test_round_trip(tmp_path):
+    data_dir = str(tmp_path)
+    write_csv(covid_csv(), data_dir, NAME)
+    from_csv = columnar_store.load_covid_table(NAME, data_dir)
+
+    columnar_store.build_table(data_dir, COVID_CSV_DIR, NAME)
+    from_store = columnar_store.load_covid_table(NAME, data_dir)
+    pd.testing.assert_frame_equal(from_store, from_csv)
+    assert from_store["FIPS"].is_monotonic_increasing
+    assert from_store["FIPS"].dtype == np.int32
+    assert from_store["value"].dtype == np.float32
+    assert isinstance(from_store["Area Name"].dtype, pd.CategoricalDtype)
+    assert pd.api.types.is_datetime64_any_dtype(from_store["time_value"])
+
+
+def test_store_is_stale_until_built_and_after_the_csv_changes(tmp_path):
+    data_dir = str(tmp_path)
+    path = write_csv(covid_csv(), data_dir, NAME)
+    assert columnar_store.is_stale(data_dir, COVID_CSV_DIR, NAME)
+
+    store = columnar_store.build_table(data_dir, COVID_CSV_DIR, NAME)
+    assert not columnar_store.is_stale(data_dir, COVID_CSV_DIR, NAME)
+
+    df = covid_csv()
+    df.loc[0, "value"] = 9.0
+    df.to_csv(path)
+    touch_later(path, store)
+    assert columnar_store.is_stale(data_dir, COVID_CSV_DIR, NAME)
+    # The newer csv is read instead of the outdated store
+    assert 9.0 in columnar_store.load_covid_table(NAME, data_dir)["value"].tolist()
+
+
+def test_store_with_float64_values_is_stale(tmp_path):
+    data_dir = str(tmp_path)
+    path = columnar_store.store_path(data_dir, NAME)
+    os.makedirs(os.path.dirname(path))
+    pd.DataFrame({"FIPS": [1001], "value": [1.0]}).to_feather(path)
+    assert columnar_store.is_stale(data_dir, COVID_CSV_DIR, NAME)
+
+
+def test_latest_table_is_derived_while_stale(tmp_path):
+    data_dir = str(tmp_path)
+    history_path = write_csv(covid_csv(), data_dir, NAME)
+    assert columnar_store.is_latest_stale(data_dir, NAME)
+    expected = columnar_store.latest_per_county(columnar_store.load_covid_table(NAME, data_dir))
+    assert expected["FIPS"].tolist() == [1001, 1003, 42003]
+    assert expected["value"].tolist() == [3.0, 4.0, 5.0]
+    pd.testing.assert_frame_equal(columnar_store.load_covid_latest_table(NAME, data_dir), expected)
+
+    # A preprocessed latest table written after its history is read as it is
+    preprocessed = covid_csv().iloc[:1]
+    latest_path = write_csv(preprocessed, data_dir, columnar_store.latest_name(NAME))
+    touch_later(latest_path, history_path)
+    assert not columnar_store.is_latest_stale(data_dir, NAME)
+    assert columnar_store.load_covid_latest_table(NAME, data_dir)["FIPS"].tolist() == [42003]
+
+    # and derived again once the history is written after it
+    touch_later(history_path, latest_path)
+    assert columnar_store.is_latest_stale(data_dir, NAME)
+    pd.testing.assert_frame_equal(columnar_store.load_covid_latest_table(NAME, data_dir), expected)
@@ -0,0 +1,61 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("scipy")
+
+from indicators.correlation_matrix import NATIONAL_FIPS, correlation_matrix
+
+STATES = [1, 6, 42]
+
+
+@pytest.fixture(scope="module")
+def data():
+    # Two USDA tables (with a state row and missing values) and two covid features, one with several rows per county
+    rng = np.random.default_rng(0)
+    fips = np.array([state * 1000 + county for state in STATES for county in range(1, 40, 2)])
+    poverty = pd.DataFrame({"FIPS": fips, "State Abrv": "XX", "Area Name": "County",
+                            "Poverty Rate": rng.normal(15, 5, len(fips)),
+                            "Median Income": rng.lognormal(10, 0.3, len(fips))})
+    poverty.loc[rng.random(len(fips)) < 0.1, "Poverty Rate"] = np.nan
+    poverty = pd.concat([pd.DataFrame({"FIPS": [1000], "State Abrv": ["AL"], "Area Name": ["Alabama"],
+                                       "Poverty Rate": [99.0], "Median Income": [1.0]}), poverty])
+    population = pd.DataFrame({"FIPS": fips[::-1], "State Abrv": "XX", "Area Name": "County",
+                               "Population": rng.integers(1000, 10 ** 7, len(fips)).astype(np.float64)})
+
+    daily = pd.DataFrame({"FIPS": np.repeat(fips[5:], 4), "value": rng.gamma(2, 3, 4 * len(fips[5:]))})
+    cumulative = pd.DataFrame({"FIPS": fips, "value": poverty["Poverty Rate"].to_numpy()[1:] * 3 +
+                               rng.normal(size=len(fips))})
+    cumulative = cumulative.dropna()
+    usda_data = {"Poverty": poverty, "Population": population}
+    covid_data = {"Daily New Cases per 100K people": daily, "Cumulative Cases per 100K people": cumulative}
+    return usda_data, covid_data
+
+
+def reference(usda_data, covid_data, method):
+    # Pairwise complete pandas correlations over one row per county
+    measures = pd.concat([df[df["FIPS"] % 1000 != 0].drop(columns=["State Abrv", "Area Name"]).set_index("FIPS")
+                          for df in usda_data.values()], axis=1)
+    features = pd.DataFrame({feature: df.groupby("FIPS")["value"].mean() for feature, df in covid_data.items()})
+    aligned = measures.join(features, how="outer")
+    rows = []
+    for state_fips, group in [(NATIONAL_FIPS, aligned)] + list(aligned.groupby(aligned.index // 1000)):
+        for measure in measures.columns:
+            for feature in features.columns:
+                r = group[measure].corr(group[feature], method=method.lower(), min_periods=3)
+                rows.append((state_fips, measure, feature, r))
+    return pd.DataFrame(rows, columns=["State FIPS", "Measure", "Covid Feature", "expected"])
+
+
+@pytest.mark.parametrize("method", ["Pearson", "Spearman"])
+def test_matches_pandas(data, method):
+    usda_data, covid_data = data
+    result = correlation_matrix(usda_data, covid_data)
+    result = result[result["Method"] == method]
+    merged = reference(usda_data, covid_data, method).merge(result, on=["State FIPS", "Measure", "Covid Feature"],
+                                                           how="left", validate="one_to_one")
+    assert len(merged) == len(result) == (len(STATES) + 1) * 3 * 2
+    np.testing.assert_allclose(merged["r"].to_numpy(dtype=np.float64), merged["expected"].to_numpy(dtype=np.float64),
+                               atol=1e-9)
+    # The daily feature misses every county of the first state except its last 15, the others have all of them
+    assert merged["r"].notna().all()
@@ -0,0 +1,125 @@
+import os
+from datetime import date
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+
+from indicators import columnar_store, covid_ingest
+from indicators.preprocess_covid import COVID_SIGNALS
+
+NAME = "confirmed_daily_incidence_cases_prop_fips"
+COUNTY_FIPS = pd.DataFrame({"FIPS": [1001, 1003, 42003], "State Name": ["Alabama", "Alabama", "Pennsylvania"],
+                            "Area Name": ["Autauga County", "Baldwin County", "Allegheny County"]})
+
+
+def raw_rows():
+    # covidcast rows of three issues: the first days, late additions and revisions (crossing a month boundary), then a
+    # revision of a county's latest day to a negative value. State rows (FIPS % 1000 == 0) are dropped on ingest
+    rows = []
+    for fips in [1000, 1001, 1003, 42003]:
+        for day in pd.date_range("2020-05-28", "2020-06-02"):
+            rows.append((fips, day, "2020-06-03", float(fips % 7 + day.day)))
+    rows += [(1001, pd.Timestamp("2020-05-30"), "2020-06-08", 100.0),
+             (1003, pd.Timestamp("2020-06-03"), "2020-06-08", 7.0),
+             (1003, pd.Timestamp("2020-06-04"), "2020-06-08", -1.0),
+             (42003, pd.Timestamp("2020-06-02"), "2020-06-08", 50.0),
+             (1001, pd.Timestamp("2020-06-02"), "2020-06-12", -5.0),
+             (42003, pd.Timestamp("2020-06-03"), "2020-06-12", 3.0)]
+    return pd.DataFrame([(fips, day.strftime("%Y-%m-%d"), issue, value) for fips, day, issue, value in rows],
+                        columns=["geo_value", "time_value", "issue", "value"])
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    data_dir = str(tmp_path)
+    raw_dir = f"{data_dir}/raw"
+    os.makedirs(raw_dir)
+    os.makedirs(f"{data_dir}/{columnar_store.COVID_CSV_DIR}")
+    raw_rows().to_csv(f"{raw_dir}/{COVID_SIGNALS[NAME][0]}.csv")
+    return data_dir
+
+
+def ingest(data_dir, last_issue):
+    fetch = covid_ingest.local_fetcher(f"{data_dir}/raw")
+    return covid_ingest.ingest_signal(NAME, fetch, COUNTY_FIPS, data_dir, last_issue)
+
+
+def expected_history(last_issue):
+    # Latest issue of every county day issued so far, negative values dropped
+    df = raw_rows()
+    df = df[(df["geo_value"] % 1000 != 0) & (pd.to_datetime(df["issue"]) <= pd.Timestamp(last_issue))]
+    df = df.sort_values("issue", kind="stable").drop_duplicates(["geo_value", "time_value"], keep="last")
+    df = df[df["value"] >= 0].rename(columns={"geo_value": "FIPS"})
+    return df.sort_values(["FIPS", "time_value"])[["FIPS", "time_value", "value"]].reset_index(drop=True)
+
+
+def assert_tables_match(data_dir, last_issue):
+    expected = expected_history(last_issue)
+    history = columnar_store.load_covid_table(NAME, data_dir)
+    history = history.sort_values(["FIPS", "time_value"]).reset_index(drop=True)
+    assert history["FIPS"].tolist() == expected["FIPS"].tolist()
+    assert history["time_value"].dt.strftime("%Y-%m-%d").tolist() == expected["time_value"].tolist()
+    np.testing.assert_allclose(history["value"], expected["value"])
+    assert history["Area Name"].astype(str).tolist() == \
+        COUNTY_FIPS.set_index("FIPS").loc[expected["FIPS"], "Area Name"].tolist()
+
+    assert not columnar_store.is_latest_stale(data_dir, NAME)
+    latest = columnar_store.load_covid_latest_table(NAME, data_dir)
+    expected_latest = expected.drop_duplicates("FIPS", keep="last")
+    assert latest["FIPS"].tolist() == expected_latest["FIPS"].tolist()
+    assert latest["time_value"].dt.strftime("%Y-%m-%d").tolist() == expected_latest["time_value"].tolist()
+    np.testing.assert_allclose(latest["value"], expected_latest["value"])
+
+
+def test_ingests_issue_by_issue(data_dir):
+    assert ingest(data_dir, date(2020, 6, 5)) == 18
+    assert_tables_match(data_dir, date(2020, 6, 5))
+    assert sorted(covid_ingest.read_manifest(data_dir, NAME)["months"]) == ["2020-05", "2020-06"]
+
+    # Two revisions, a new day and a new (negative) day
+    assert ingest(data_dir, date(2020, 6, 10)) == 4
+    assert_tables_match(data_dir, date(2020, 6, 10))
+
+    # The latest day of 1001 is revised to a negative value, so its latest row comes from its history again
+    assert ingest(data_dir, date(2020, 6, 15)) == 2
+    assert_tables_match(data_dir, date(2020, 6, 15))
+    latest = columnar_store.load_covid_latest_table(NAME, data_dir).set_index("FIPS")
+    assert latest.loc[1001, "time_value"] == pd.Timestamp("2020-06-01")
+
+    assert ingest(data_dir, date(2020, 6, 20)) == 0
+    assert covid_ingest.read_manifest(data_dir, NAME)["last_issue"] == "2020-06-12"
+
+
+def test_only_changed_months_are_rewritten(data_dir):
+    ingest(data_dir, date(2020, 6, 15))
+    may = covid_ingest.partition_path(data_dir, NAME, "2020-05")
+    june = covid_ingest.partition_path(data_dir, NAME, "2020-06")
+    for path in (may, june):
+        os.utime(path, (1000, 1000))
+
+    # A day of June, May is neither read for it nor written
+    raw = raw_rows()
+    raw.loc[len(raw)] = [1003, "2020-06-05", "2020-06-16", 4.0]
+    raw.to_csv(f"{data_dir}/raw/{COVID_SIGNALS[NAME][0]}.csv")
+    assert ingest(data_dir, date(2020, 6, 20)) == 1
+    assert os.path.getmtime(may) == 1000
+    assert os.path.getmtime(june) != 1000
+
+    # Rows that were already ingested don't rewrite their month when covidcast sends them again
+    os.utime(june, (1000, 1000))
+    assert ingest(data_dir, date(2020, 6, 20)) == 0
+    assert os.path.getmtime(june) == 1000
+
+
+def test_rewrites_the_history_after_an_interrupted_export(data_dir):
+    ingest(data_dir, date(2020, 6, 5))
+    manifest = covid_ingest.read_manifest(data_dir, NAME)
+    manifest["exported"] = False
+    covid_ingest.write_manifest(manifest, data_dir, NAME)
+    os.remove(columnar_store.csv_path(data_dir, columnar_store.COVID_CSV_DIR, NAME))
+
+    ingest(data_dir, date(2020, 6, 10))
+    assert_tables_match(data_dir, date(2020, 6, 10))
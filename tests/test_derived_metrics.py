@@ -0,0 +1,55 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+from indicators.derived_metrics import GROWTH_WINDOW, ROLLING_WINDOWS, derived_metrics
+
+FEATURE = "Daily New Cases per 100K people"
+DAYS = pd.date_range("2020-03-01", periods=60)
+
+
+@pytest.fixture(scope="module")
+def covid_df():
+    # Counties with missing days, a run of zeros and a county that starts late
+    rng = np.random.default_rng(0)
+    rows = []
+    for fips in [1001, 1003, 42001]:
+        days = DAYS[rng.random(len(DAYS)) < 0.9] if fips != 42001 else DAYS[20:]
+        values = rng.gamma(2, 5, len(days))
+        if fips == 1003:
+            values[10:25] = 0
+        rows.append(pd.DataFrame({"FIPS": fips, "State Name": "State", "Area Name": f"County {fips}",
+                                  "time_value": days, "value": values}))
+    df = pd.concat(rows, ignore_index=True)
+    df["value"] = df["value"].astype(np.float32)
+    return df
+
+
+def reference(covid_df):
+    # pandas rolling windows over every county's series, with missing days as NaN
+    series = covid_df.pivot(index="time_value", columns="FIPS", values="value").reindex(DAYS).astype(np.float64)
+    weekly = series.rolling(GROWTH_WINDOW).sum()
+    ratio = (weekly / weekly.shift(GROWTH_WINDOW)).replace([np.inf, -np.inf], np.nan)
+    metrics = {f"{FEATURE} ({window}-day average)": series.rolling(window).mean() for window in ROLLING_WINDOWS}
+    metrics[f"{FEATURE} (week over week growth %)"] = (ratio - 1) * 100
+    metrics[f"{FEATURE} (doubling time in days)"] = (GROWTH_WINDOW * np.log(2) / np.log(ratio)).where(ratio > 1)
+    return {label: metric.rename_axis("time_value").stack().dropna().rename("expected").reset_index()
+            for label, metric in metrics.items()}
+
+
+def test_matches_pandas_rolling(covid_df):
+    result = derived_metrics(FEATURE, covid_df)
+    expected = reference(covid_df)
+    assert set(result) == set(expected)
+    for label, df in result.items():
+        assert list(df.columns) == ["FIPS", "time_value", "value", "State Name", "Area Name"]
+        merged = df.merge(expected[label], on=["FIPS", "time_value"], how="outer", indicator=True)
+        assert (merged["_merge"] == "both").all(), label
+        np.testing.assert_allclose(merged["value"], merged["expected"], rtol=1e-5, err_msg=label)
+
+
+def test_growth_only_for_counts(covid_df):
+    labels = derived_metrics("Daily % Covid-Related Doctor Visits", covid_df)
+    assert sorted(labels) == sorted(f"Daily % Covid-Related Doctor Visits ({window}-day average)"
+                                    for window in ROLLING_WINDOWS)
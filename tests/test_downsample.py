@@ -0,0 +1,57 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+from indicators.downsample import bucket_count, downsample_series
+
+WIDTH = 100
+
+
+@pytest.fixture(scope="module")
+def df():
+    # Daily series of different lengths and start days, shuffled
+    rng = np.random.default_rng(0)
+    frames = []
+    for fips, (start, days) in {1001: (0, 400), 1003: (30, 250), 1005: (100, 3), 1007: (50, 1)}.items():
+        frames.append(pd.DataFrame({"FIPS": fips,
+                                    "time_value": pd.date_range("2020-03-01", periods=days) + pd.Timedelta(days=start),
+                                    "value": rng.normal(size=days).round(1)}))
+    return pd.concat(frames, ignore_index=True).sample(frac=1, random_state=0)
+
+
+def buckets(series, num_buckets):
+    offsets = (series["time_value"] - series["time_value"].min()).dt.days
+    span = max(offsets.max(), 1)
+    return np.minimum(offsets * num_buckets // span, num_buckets - 1)
+
+
+def test_keeps_the_extremes_of_every_bucket(df):
+    result = downsample_series(df, "FIPS", "time_value", "value", WIDTH)
+    num_buckets = bucket_count(WIDTH, df["FIPS"].nunique())
+    assert result.index.isin(df.index).all() and result.index.is_unique
+    for fips, series in df.groupby("FIPS"):
+        kept = result[result["FIPS"] == fips]
+        assert len(kept) <= 2 * num_buckets + 2
+        # First and last day of the series
+        assert kept["time_value"].min() == series["time_value"].min()
+        assert kept["time_value"].max() == series["time_value"].max()
+        expected = series.groupby(buckets(series, num_buckets))["value"].agg(["min", "max"])
+        found = kept.groupby(buckets(series, num_buckets).loc[kept.index])["value"].agg(["min", "max"])
+        pd.testing.assert_frame_equal(found, expected)
+
+
+def test_full_resolution_series_keep_every_row(df):
+    result = downsample_series(df, "FIPS", "time_value", "value", WIDTH, full_resolution=[1003])
+    pd.testing.assert_frame_equal(result[result["FIPS"] == 1003], df[df["FIPS"] == 1003])
+    assert len(result[result["FIPS"] == 1001]) < len(df[df["FIPS"] == 1001])
+
+
+def test_short_series_are_kept_whole(df):
+    result = downsample_series(df, "FIPS", "time_value", "value", WIDTH)
+    for fips in [1005, 1007]:
+        pd.testing.assert_frame_equal(result[result["FIPS"] == fips], df[df["FIPS"] == fips])
+
+
+def test_empty_frame(df):
+    assert downsample_series(df.iloc[:0], "FIPS", "time_value", "value", WIDTH).empty
@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+
+from indicators.file_cache import FileCache, cached, freeze
+
+
+class Loader:
+    # Counts its calls and returns a 1000 byte array numbered after them
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return np.full(125, self.calls, dtype=np.int64)
+
+
+def write(path, text, mtime=None):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def test_reloads_when_a_source_changes(tmp_path):
+    path = str(tmp_path / "table.csv")
+    write(path, "a", mtime=1000)
+    cache, loader = FileCache(), Loader()
+    assert cache.get("key", [path], loader)[0] == 1
+    assert cache.get("key", [path], loader)[0] == 1
+    assert loader.calls == 1
+
+    write(path, "b", mtime=2000)
+    assert cache.get("key", [path], loader)[0] == 2
+    os.remove(path)
+    assert cache.get("key", [path], loader)[0] == 3
+    assert cache.get("key", [path], loader)[0] == 3
+
+
+def test_evicts_the_least_recently_used_entries(tmp_path):
+    cache, loader = FileCache(max_bytes=3000), Loader()
+    for key in ["a", "b", "c"]:
+        cache.get(key, [], loader)
+    cache.get("a", [], loader)
+    cache.get("d", [], loader)
+    assert [key for key, _ in cache.report()] == ["c", "a", "d"]
+    assert cache.total_bytes == sum(size for _, size in cache.report()) == 3000
+    assert set(cache.key_locks) == {"c", "a", "d"}
+    # b was evicted and is loaded again
+    assert cache.get("b", [], loader)[0] == 5
+    assert [key for key, _ in cache.report()] == ["a", "d", "b"]
+
+
+def test_keeps_an_entry_bigger_than_the_budget_on_its_own():
+    cache = FileCache(max_bytes=500)
+    cache.get("a", [], Loader())
+    cache.get("b", [], Loader())
+    assert [key for key, _ in cache.report()] == ["b"]
+
+
+def test_failed_loads_are_not_cached():
+    cache, loader = FileCache(), Loader()
+
+    def fail():
+        raise OSError("unreadable")
+
+    with pytest.raises(OSError):
+        cache.get("key", [], fail)
+    assert cache.report() == [] and cache.key_locks == {}
+    assert cache.get("key", [], loader)[0] == 1
+
+
+def test_keeps_the_lock_of_a_key_being_loaded():
+    cache, loader = FileCache(), Loader()
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def slow_load():
+        started.set()
+        release.wait(5)
+        return loader()
+
+    first = threading.Thread(target=lambda: results.append(cache.get("key", [], slow_load)))
+    first.start()
+    assert started.wait(5)
+    # Clearing (or evicting) the key mid load keeps its lock, so the next session waits for the load in flight
+    cache.clear("key")
+    assert "key" in cache.key_locks
+    second = threading.Thread(target=lambda: results.append(cache.get("key", [], loader)))
+    second.start()
+    time.sleep(0.1)
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert loader.calls == 1
+    assert [result[0] for result in results] == [1, 1]
+    assert list(cache.key_locks) == ["key"] and cache.key_locks["key"][1] == 0
+
+    cache.clear()
+    assert cache.key_locks == {}
+
+
+def test_clear():
+    cache, loader = FileCache(), Loader()
+    cache.get("a", [], loader)
+    cache.get("b", [], loader)
+    cache.clear("a")
+    assert [key for key, _ in cache.report()] == ["b"]
+    cache.clear()
+    assert cache.report() == [] and cache.total_bytes == 0
+
+
+def test_cached_keys_on_frozen_arguments(tmp_path):
+    cache = FileCache()
+    calls = []
+
+    @cached(lambda words, **kwargs: [], cache=cache)
+    def count(words, limit=None):
+        calls.append(words)
+        return len(words)
+
+    assert count({"b", "a"}) == count({"a", "b"}) == 2
+    assert count(["a", "b"], limit=1) == count(["a", "b"], limit=1) == 2
+    assert len(calls) == 2
+    assert freeze({"b", "a"}) == ("a", "b")
+    assert freeze(["b", "a"]) == ("b", "a")
@@ -0,0 +1,237 @@
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+tweepy = pytest.importorskip("tweepy")
+if not hasattr(tweepy, "RateLimitError"):
+    pytest.skip("hydration is written against the tweepy 3 API", allow_module_level=True)
+
+from twitter import hydration
+
+# Errors the stub answers with, in the format of the v1.1 API
+RATE_LIMIT_ERROR = {"errors": [{"code": 88, "message": "Rate limit exceeded"}]}
+SERVER_ERROR = {"errors": [{"code": 131, "message": "Internal error"}]}
+
+
+class StubTwitter(BaseHTTPRequestHandler):
+    # statuses/lookup of the v1.1 API. Every request is recorded on the server as (time, ids) and answered by
+    # server.respond(ids, number of the request) -> (status, headers, body), which defaults to the statuses asked for
+
+    def lookup(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        length = int(self.headers.get("Content-Length") or 0)
+        params.update(parse_qs(self.rfile.read(length).decode("utf-8")))
+        ids = [int(tweet_id) for tweet_id in params["id"][0].split(",")]
+        with self.server.lock:
+            self.server.requests.append((time.time(), ids))
+            number = len(self.server.requests)
+        status, headers, body = self.server.respond(ids, number)
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = lookup
+    do_POST = lookup
+
+    def log_message(self, *args):
+        pass
+
+
+def statuses(ids):
+    return [{"id": tweet_id, "id_str": str(tweet_id), "full_text": f"tweet {tweet_id}", "lang": "en"}
+            for tweet_id in ids]
+
+
+def ok(ids, number):
+    return 200, {}, statuses(ids)
+
+
+@pytest.fixture(scope="module")
+def certificate(tmp_path_factory):
+    # tweepy always calls https, so the stub serves a self signed certificate that requests is told to trust
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl is needed to serve the stub over https")
+    directory = tmp_path_factory.mktemp("tls")
+    cert, key = str(directory / "cert.pem"), str(directory / "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+                    "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", key, "-out", cert],
+                   check=True, capture_output=True)
+    return cert, key
+
+
+@pytest.fixture
+def server(certificate, monkeypatch):
+    cert, key = certificate
+    monkeypatch.setenv("REQUESTS_CA_BUNDLE", cert)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubTwitter)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.respond = ok
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def api(server):
+    auth = tweepy.OAuthHandler("key", "secret")
+    auth.set_access_token("token", "token secret")
+    return tweepy.API(auth, host=f"127.0.0.1:{server.server_port}")
+
+
+@pytest.fixture
+def fast_backoff(monkeypatch):
+    # Records the attempt of every backoff and keeps the sleeps short
+    attempts = []
+
+    def backoff(attempt):
+        attempts.append(attempt)
+        return 0.01
+
+    monkeypatch.setattr(hydration, "backoff", backoff)
+    return attempts
+
+
+def limiter():
+    # Plenty of tokens, so only the rate limit headers make the workers wait
+    return hydration.RateLimiter(1000, window_seconds=1)
+
+
+def hydrate(api, batches, workers=2, checkpoint=None):
+    results = {}
+
+    def on_result(batch, tweets):
+        results[tuple(batch)] = sorted(tweet.id for tweet in tweets)
+
+    failed = hydration.hydrate(batches, hydration.lookup_statuses, on_result, api, limiter(), workers, checkpoint)
+    return results, failed
+
+
+def test_hydrates_every_batch(server, api):
+    batches = hydration.batched(list(range(1, 251)))
+    results, failed = hydrate(api, batches)
+    assert failed == []
+    assert results == {tuple(batch): batch for batch in batches}
+
+
+def test_waits_for_the_rate_limit_reset(server, api):
+    reset = int(time.time()) + 2
+
+    def respond(ids, number):
+        if number == 1:
+            return 429, {"x-rate-limit-remaining": 0, "x-rate-limit-reset": reset}, RATE_LIMIT_ERROR
+        return 200, {"x-rate-limit-remaining": 899, "x-rate-limit-reset": reset + 900}, statuses(ids)
+
+    server.respond = respond
+    results, failed = hydrate(api, [[1, 2]], workers=1)
+    assert failed == []
+    assert results == {(1, 2): [1, 2]}
+    (first, _), (second, _) = server.requests
+    # The retry waits until the reset the headers gave instead of the full 15 minute window
+    assert reset <= second < first + 10
+
+
+def test_no_requests_while_remaining_is_zero(server, api):
+    reset = int(time.time()) + 2
+
+    def respond(ids, number):
+        remaining = 0 if number == 1 else 899
+        return 200, {"x-rate-limit-remaining": remaining, "x-rate-limit-reset": reset}, statuses(ids)
+
+    server.respond = respond
+    results, failed = hydrate(api, [[1], [2]], workers=1)
+    assert failed == []
+    assert len(results) == 2
+    (first, _), (second, _) = server.requests
+    assert reset <= second < first + 10
+
+
+def test_retries_server_errors_with_backoff(server, api, fast_backoff):
+    def respond(ids, number):
+        if number <= 2:
+            return 503, {}, SERVER_ERROR
+        return ok(ids, number)
+
+    server.respond = respond
+    results, failed = hydrate(api, [[1, 2]], workers=1)
+    assert failed == []
+    assert results == {(1, 2): [1, 2]}
+    assert len(server.requests) == 3
+    assert fast_backoff == [0, 1]
+
+
+def test_returns_the_batches_that_keep_failing(server, api, fast_backoff):
+    def respond(ids, number):
+        if 3 in ids:
+            return 500, {}, SERVER_ERROR
+        return ok(ids, number)
+
+    server.respond = respond
+    batches = [[1, 2], [3, 4], [5, 6]]
+    results, failed = hydrate(api, batches)
+    assert failed == [1]
+    assert set(results) == {(1, 2), (5, 6)}
+    # Every retry of the failed batch went to the server
+    assert sum(1 for _, ids in server.requests if 3 in ids) == hydration.RETRIES + 1
+
+
+def test_resumes_from_the_checkpoint(server, api, tmp_path):
+    path = str(tmp_path / "checkpoints" / "job.json")
+    batches = [[1, 2], [3, 4], [5, 6]]
+    fetched = []
+
+    def interrupt_after_first(batch, tweets):
+        if fetched:
+            raise RuntimeError("interrupted")
+        fetched.append(tuple(batch))
+
+    with pytest.raises(RuntimeError, match="interrupted"):
+        hydration.hydrate(batches, hydration.lookup_statuses, interrupt_after_first, api, limiter(), 1,
+                          hydration.Checkpoint(path))
+    assert os.path.exists(path)
+
+    server.requests.clear()
+    checkpoint = hydration.Checkpoint(path)
+    assert checkpoint.done == {batches.index(list(fetched[0]))}
+    results, failed = hydrate(api, batches, checkpoint=checkpoint)
+    assert failed == []
+    # Only the batches that weren't done are fetched again
+    assert sorted(tuple(ids) for _, ids in server.requests) == sorted(set(map(tuple, batches)) - set(fetched))
+    assert set(results) | set(fetched) == set(map(tuple, batches))
+    assert checkpoint.done == {0, 1, 2}
+    checkpoint.finish()
+    assert not os.path.exists(path)
+
+
+def test_polls_while_waiting_for_responses(server, api, monkeypatch):
+    monkeypatch.setattr(hydration, "POLL_SECONDS", 0.05)
+    polls = []
+
+    def respond(ids, number):
+        time.sleep(0.5)
+        return ok(ids, number)
+
+    server.respond = respond
+    hydration.hydrate([[1]], hydration.lookup_statuses, lambda batch, tweets: None, api, limiter(), 1,
+                      poll=lambda: polls.append(time.time()))
+    # Called while the only request was in flight, not just once its result came in
+    assert len(polls) >= 3
@@ -0,0 +1,60 @@
+import json
+
+from twitter import partition_writer
+from twitter.partition_writer import PartitionWriter, load_manifest, read_partition
+
+
+def test_adopted_file_counts_its_lines(tmp_path):
+    path = tmp_path / "AK.txt"
+    path.write_text("1\n2\n3\n")
+    with PartitionWriter() as writer:
+        writer.write(str(path), ["4", "5"])
+    assert load_manifest(str(tmp_path)) == {"AK.txt": {"bytes": len("1\n2\n3\n4\n5\n"), "records": 5}}
+    assert read_partition(str(path)) == ["1", "2", "3", "4", "5"]
+
+
+def test_adopted_compressed_file_counts_its_lines(tmp_path):
+    path = tmp_path / "AK.txt.gz"
+    path.write_bytes(partition_writer.compress(b"1\n2\n3\n", "gzip"))
+    with PartitionWriter("gzip") as writer:
+        writer.write(str(tmp_path / "AK.txt"), ["4"])
+    assert load_manifest(str(tmp_path))["AK.txt.gz"]["records"] == 4
+    assert read_partition(str(path)) == ["1", "2", "3", "4"]
+
+
+def test_torn_tail_is_not_read_and_cut_off(tmp_path):
+    path = tmp_path / "AK.txt"
+    with PartitionWriter() as writer:
+        writer.write(str(path), ["1", "2"])
+    # A write that never made it into the manifest
+    with open(path, "a") as f:
+        f.write("3\n4")
+    assert read_partition(str(path)) == ["1", "2"]
+    assert partition_writer.committed_size(str(path)) == len("1\n2\n")
+    with PartitionWriter() as writer:
+        writer.write(str(path), ["5"])
+    assert path.read_text() == "1\n2\n5\n"
+    assert json.loads((tmp_path / "manifest.json").read_text())["AK.txt"] == {"bytes": 6, "records": 3}
+
+
+def test_poll_flushes_lines_that_are_due(tmp_path):
+    path = str(tmp_path / "AK.txt")
+    with PartitionWriter(flush_seconds=0) as writer:
+        writer.write(path, ["1"])
+        assert read_partition(path) == []
+        assert writer.poll()
+        assert read_partition(path) == ["1"]
+        assert not writer.poll()
+
+
+def test_compressed_partitions_are_found_and_streamed(tmp_path):
+    path = str(tmp_path / "AK.txt")
+    with PartitionWriter("gzip", flush_bytes=1) as writer:
+        writer.write(path, ["1", "2"])
+        writer.write(path, ["3"])
+    assert partition_writer.find_partition(path) == path + ".gz"
+    with open(path + ".gz", "ab") as f:
+        f.write(partition_writer.compress(b"4\n", "gzip"))
+    # Two committed gzip members, the uncommitted third is ignored
+    assert list(partition_writer.iter_partition(path + ".gz")) == ["1", "2", "3"]
+    assert partition_writer.find_partition(str(tmp_path / "AL.txt")) is None
@@ -0,0 +1,171 @@
+import json
+import threading
+from datetime import date
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("scipy")
+pytest.importorskip("pyarrow")
+
+from indicators import dataset_registry, file_cache, query, query_server
+
+DAILY = "Daily New Cases per 100K people"
+CUMULATIVE = "Cumulative Cases per 100K people"
+DAYS = pd.date_range("2020-06-01", periods=30)
+FIPS = [1001, 1003, 1005, 6001, 6003, 6005, 42001, 42003, 42005]
+
+
+def usda_data():
+    rng = np.random.default_rng(0)
+    poverty = pd.DataFrame({"FIPS": [0, 1000] + FIPS, "State Abrv": ["US", "AL"] + ["XX"] * len(FIPS),
+                            "Area Name": ["United States", "Alabama"] + [f"County {fips}" for fips in FIPS],
+                            "Poverty Rate": rng.normal(15, 5, len(FIPS) + 2)})
+    return {"Poverty": poverty}
+
+
+def covid_data():
+    rng = np.random.default_rng(1)
+    daily = pd.DataFrame([(fips, f"County {fips}", day, rng.gamma(2, 5)) for fips in FIPS for day in DAYS
+                          if rng.random() < 0.9], columns=["FIPS", "Area Name", "time_value", "value"])
+    cumulative = daily.groupby(["FIPS", "Area Name"], as_index=False).agg(time_value=("time_value", "max"),
+                                                                        value=("value", "sum"))
+    return {DAILY: daily, CUMULATIVE: cumulative}
+
+
+@pytest.fixture
+def datasets(monkeypatch):
+    # Small datasets in place of the ones loaded from the data dir, with nothing cached from before or after
+    loaders = {"state_fips": lambda: {"Alabama": 1, "California": 6, "Pennsylvania": 42},
+               "county_fips": lambda: pd.DataFrame({"State FIPS": [fips // 1000 for fips in FIPS], "FIPS": FIPS,
+                                                    "Area Name": [f"County {fips}" for fips in FIPS]}),
+               "usda": usda_data, "covid": covid_data, "county_adjacency": lambda: None}
+    for name, loader in loaders.items():
+        monkeypatch.setitem(dataset_registry.LOADERS, name, loader)
+        monkeypatch.setitem(dataset_registry.SOURCES, name, [])
+    file_cache.CACHE.clear()
+    query.QUERY_CACHE.clear()
+    yield
+    file_cache.CACHE.clear()
+    query.QUERY_CACHE.clear()
+
+
+def expected_agg(from_date, to_date, state_fips=None):
+    df = covid_data()[DAILY]
+    df = df[(df["time_value"] >= pd.Timestamp(from_date)) & (df["time_value"] <= pd.Timestamp(to_date))]
+    if state_fips is not None:
+        df = df[df["FIPS"] // 1000 == state_fips]
+    return df.groupby(["FIPS", "Area Name"])["value"].max().rename("Max").reset_index()
+
+
+def assert_agg_equal(result, expected):
+    assert result["FIPS"].tolist() == expected["FIPS"].tolist()
+    np.testing.assert_allclose(result["Max"].to_numpy(dtype=np.float64), expected["Max"].to_numpy(), rtol=1e-6)
+
+
+def test_national_daily_feature(datasets):
+    result = query.query(DAILY, "Poverty", "Poverty Rate", date_range=(date(2020, 6, 5), date(2020, 6, 12)))
+    assert_agg_equal(result["covid_df_agg"], expected_agg("2020-06-05", "2020-06-12"))
+    assert result["usda_df"]["FIPS"].tolist() == FIPS
+    assert len(result["covid_df"]) == len(covid_data()[DAILY])
+    assert result["full_df"] is None
+
+
+def test_state_daily_feature(datasets):
+    result = query.query(DAILY, "Poverty", "Poverty Rate", state_fips=6, date_range=(date(2020, 6, 5),
+                                                                                     date(2020, 6, 12)))
+    assert_agg_equal(result["covid_df_agg"], expected_agg("2020-06-05", "2020-06-12", 6))
+    assert result["usda_df"]["FIPS"].tolist() == [6001, 6003, 6005]
+    covid_df = result["covid_df"]
+    assert set(covid_df["FIPS"]) == {6001, 6003, 6005}
+    assert covid_df["time_value"].between(pd.Timestamp("2020-06-05"), pd.Timestamp("2020-06-12")).all()
+
+
+def test_default_date_range_is_the_last_week(datasets):
+    assert query.default_date_range(DAILY) == (DAYS[-1] - pd.Timedelta(days=query.DEFAULT_RANGE_DAYS), DAYS[-1])
+    result = query.query(DAILY, "Poverty", "Poverty Rate")
+    assert_agg_equal(result["covid_df_agg"], expected_agg(DAYS[-1] - pd.Timedelta(days=7), DAYS[-1]))
+
+
+def test_cumulative_feature(datasets):
+    result = query.query(CUMULATIVE, "Poverty", "Poverty Rate", state_fips=42)
+    expected = covid_data()[CUMULATIVE].merge(usda_data()["Poverty"], on="FIPS")
+    expected = expected[expected["FIPS"] // 1000 == 42]
+    assert result["covid_df_agg"] is None
+    assert result["full_df"]["FIPS"].tolist() == expected["FIPS"].tolist()
+    np.testing.assert_allclose(result["full_df"]["value"], expected["value"])
+    np.testing.assert_allclose(result["full_df"]["Poverty Rate"], expected["Poverty Rate"])
+
+
+def test_results_are_cached(datasets):
+    first = query.query(DAILY, "Poverty", "Poverty Rate", state_fips=1)
+    assert query.query(DAILY, "Poverty", "Poverty Rate", state_fips=1) is first
+
+
+@pytest.mark.parametrize("args", [("Weekly cases", "Poverty", "Poverty Rate", "Max"),
+                                  (DAILY, "Income", "Poverty Rate", "Max"),
+                                  (DAILY, "Poverty", "Median Income", "Max"),
+                                  (DAILY, "Poverty", "Poverty Rate", "Mode")])
+def test_unknown_arguments(datasets, args):
+    covid_feature, usda_category, usda_measure, statistic = args
+    with pytest.raises(ValueError):
+        query.query(covid_feature, usda_category, usda_measure, statistic=statistic)
+
+
+def test_spatial_clusters_need_the_geometry(datasets):
+    assert query.query_spatial_clusters(DAILY, "Poverty", "Poverty Rate") is None
+
+
+@pytest.fixture
+def server(datasets):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), query_server.QueryHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def get(url):
+    try:
+        with urlopen(url) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_serves_query_frames(server):
+    status, body = get(f"{server}/query?covid_feature={DAILY}&usda_category=Poverty&usda_measure=Poverty%20Rate"
+                       f"&state=California&from=2020-06-05&to=2020-06-12".replace(" ", "%20"))
+    assert status == 200
+    assert sorted(body) == ["covid_df", "covid_df_agg", "full_df", "usda_df"]
+    assert body["full_df"] is None
+    assert_agg_equal(pd.DataFrame(body["covid_df_agg"]), expected_agg("2020-06-05", "2020-06-12", 6))
+
+
+def test_serves_options_and_correlations(server):
+    status, body = get(f"{server}/options")
+    assert status == 200
+    assert body["states"] == {"Alabama": 1, "California": 6, "Pennsylvania": 42}
+    assert body["covid"][DAILY] == ["2020-06-01", "2020-06-30"]
+    status, body = get(f"{server}/correlations?method=Spearman&state=6")
+    assert status == 200
+    assert {row["Covid Feature"] for row in body} == {DAILY, CUMULATIVE}
+
+
+@pytest.mark.parametrize("path", ["/query?covid_feature=Weekly&usda_category=Poverty&usda_measure=x&from=2020-06-01",
+                                  "/query?covid_feature=Weekly",
+                                  "/query?covid_feature=Weekly&usda_category=Poverty&usda_measure=x&state=Atlantis",
+                                  "/correlations?method=Kendall"])
+def test_bad_requests(server, path):
+    status, body = get(f"{server}{path}")
+    assert status == 400
+    assert "error" in body
+
+
+def test_unknown_path(server):
+    assert get(f"{server}/frames")[0] == 404
@@ -0,0 +1,59 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+from indicators.range_index import RANGE_STATISTICS, CovidRangeIndex
+
+AGGREGATIONS = {"Max": "max", "Min": "min", "Average": "mean", "Median": "median"}
+DAYS = pd.date_range("2020-03-01", periods=61)
+
+
+@pytest.fixture(scope="module")
+def covid_df():
+    # Counties of three states with missing days, ties and a county without any data in most windows
+    rng = np.random.default_rng(0)
+    rows = []
+    for fips in [1001, 1003, 1005, 2013, 42001, 42003, 42005]:
+        days = DAYS[:3] if fips == 42005 else DAYS[rng.random(len(DAYS)) < 0.8]
+        values = rng.integers(0, 10, len(days)) if fips % 2 else rng.normal(size=len(days))
+        rows.append(pd.DataFrame({"FIPS": fips, "Area Name": f"County {fips}", "time_value": days, "value": values}))
+    df = pd.concat(rows, ignore_index=True)
+    df["value"] = df["value"].astype(np.float32)
+    return df
+
+
+@pytest.fixture(scope="module")
+def index(covid_df):
+    return CovidRangeIndex(covid_df)
+
+
+def expected(covid_df, from_date, to_date, statistic, state_fips=None):
+    df = covid_df[(covid_df["time_value"] >= from_date) & (covid_df["time_value"] <= to_date)]
+    if state_fips is not None:
+        df = df[df["FIPS"] // 1000 == state_fips]
+    return df.groupby(["FIPS", "Area Name"])["value"].agg(AGGREGATIONS[statistic]).rename(statistic).reset_index()
+
+
+@pytest.mark.parametrize("statistic", RANGE_STATISTICS)
+@pytest.mark.parametrize("state_fips", [None, 1, 42, 6])
+def test_matches_groupby(covid_df, index, statistic, state_fips):
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        lo, hi = np.sort(rng.integers(-5, len(DAYS) + 5, 2))
+        from_date, to_date = DAYS[0] + pd.Timedelta(days=int(lo)), DAYS[0] + pd.Timedelta(days=int(hi))
+        result = index.query(from_date, to_date, statistic, state_fips)
+        reference = expected(covid_df, from_date, to_date, statistic, state_fips)
+        assert result["FIPS"].tolist() == reference["FIPS"].tolist()
+        assert result["Area Name"].tolist() == reference["Area Name"].tolist()
+        np.testing.assert_allclose(result[statistic].to_numpy(), reference[statistic].to_numpy(), rtol=1e-5)
+
+
+def test_empty_and_reversed_ranges(index):
+    assert index.query(DAYS[-1] + pd.Timedelta(days=1), DAYS[-1] + pd.Timedelta(days=9), "Median").empty
+    assert index.query(DAYS[10], DAYS[5], "Max").empty
+
+
+def test_unknown_statistic(index):
+    with pytest.raises(ValueError):
+        index.query(DAYS[0], DAYS[5], "Mode")
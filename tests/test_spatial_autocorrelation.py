@@ -0,0 +1,103 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+sparse = pytest.importorskip("scipy.sparse")
+
+from indicators import county_topology
+from indicators.spatial_autocorrelation import NOT_SIGNIFICANT, CountyAdjacency, spatial_autocorrelation
+
+SIZE = 6
+
+
+def grid_adjacency():
+    # Rook contiguity of a SIZE x SIZE grid of counties numbered row by row
+    cells = np.arange(SIZE * SIZE).reshape(SIZE, SIZE)
+    pairs = np.concatenate([np.stack([cells[:, :-1].ravel(), cells[:, 1:].ravel()], axis=1),
+                            np.stack([cells[:-1].ravel(), cells[1:].ravel()], axis=1)])
+    rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    cols = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(SIZE * SIZE, SIZE * SIZE))
+    return CountyAdjacency(np.arange(1001, 1001 + SIZE * SIZE, dtype=np.int32), matrix)
+
+
+def grid_df(values):
+    return pd.DataFrame({"FIPS": np.arange(1001, 1001 + SIZE * SIZE), "value": np.asarray(values, dtype=np.float64)})
+
+
+def reference_morans_i(values, dense):
+    # Textbook Moran's I and local Moran's I with row standardised weights
+    w = dense / dense.sum(axis=1, keepdims=True)
+    z = values - values.mean()
+    n = len(z)
+    global_i = n / w.sum() * z @ w @ z / (z @ z)
+    local_i = z * (w @ z) / ((z @ z) / (n - 1))
+    return global_i, local_i
+
+
+@pytest.mark.parametrize("pattern", ["gradient", "checkerboard", "random"])
+def test_matches_the_textbook_statistics(pattern):
+    rows, cols = np.divmod(np.arange(SIZE * SIZE), SIZE)
+    values = {"gradient": rows + cols, "checkerboard": (rows + cols) % 2,
+              "random": np.random.default_rng(0).normal(size=SIZE * SIZE)}[pattern].astype(np.float64)
+    adjacency = grid_adjacency()
+    result = spatial_autocorrelation(grid_df(values), "value", adjacency)
+    global_i, local_i = reference_morans_i(values, adjacency.matrix.toarray())
+    assert result["Moran's I"] == pytest.approx(global_i)
+    np.testing.assert_allclose(result["local"]["Local Moran's I"], local_i)
+    assert result["local"]["FIPS"].tolist() == grid_df(values)["FIPS"].tolist()
+
+    if pattern == "gradient":
+        assert result["Moran's I"] > 0.5 and result["p-value"] <= 0.01
+        clusters = result["local"]["Cluster"]
+        assert clusters.iloc[0] == "Low-Low" and clusters.iloc[-1] == "High-High"
+    elif pattern == "checkerboard":
+        assert result["Moran's I"] < -0.9 and result["p-value"] <= 0.01
+    else:
+        assert result["p-value"] > 0.05
+
+
+def test_permutations_are_seeded():
+    values = np.random.default_rng(1).normal(size=SIZE * SIZE)
+    first = spatial_autocorrelation(grid_df(values), "value", grid_adjacency(), seed=3)
+    second = spatial_autocorrelation(grid_df(values), "value", grid_adjacency(), seed=3)
+    assert first["p-value"] == second["p-value"]
+    pd.testing.assert_frame_equal(first["local"], second["local"])
+
+
+def test_counties_without_data_or_neighbours():
+    df = grid_df(np.arange(SIZE * SIZE))
+    df.loc[3, "value"] = np.nan
+    df = pd.concat([df, pd.DataFrame({"FIPS": [56045], "value": [1.0]})], ignore_index=True)
+    local = spatial_autocorrelation(df, "value", grid_adjacency())["local"].set_index("FIPS")
+    assert 1004 not in local.index
+    # An island has no lag and no p-value, so it is never part of a cluster
+    assert local.loc[56045, "Local Moran's I"] == 0 and np.isnan(local.loc[56045, "p-value"])
+    assert local.loc[56045, "Cluster"] == NOT_SIGNIFICANT
+
+
+def test_weights_of_a_subset():
+    w, neighbours = grid_adjacency().weights([1001 + SIZE + 1, 1002, 1001 + SIZE, 99999])
+    # The inner cell borders the two others, which only border it
+    assert neighbours.tolist() == [2, 1, 1, 0]
+    np.testing.assert_allclose(w.toarray(), [[0, 0.5, 0.5, 0], [1, 0, 0, 0], [1, 0, 0, 0], [0, 0, 0, 0]])
+
+
+def test_from_topology_and_round_trip(tmp_path):
+    # Three counties in a row (1001 | 1003 | 1005) drawn with shared arcs, plus a detached one
+    topology = {"arcs": [[[0, 0], [0, 1]], [[1, 0], [1, 1]], [[0, 0], [1, 0]], [[0, 1], [1, 1]], [[2, 0], [2, 1]],
+                         [[9, 9], [9, 8]]],
+                "objects": {county_topology.COUNTIES_OBJECT: {"type": "GeometryCollection", "geometries": [
+                    {"type": "Polygon", "id": "01003", "arcs": [[0, 2, ~1, 3]]},
+                    {"type": "Polygon", "id": "01001", "arcs": [[~0]]},
+                    {"type": "MultiPolygon", "id": "01005", "arcs": [[[1, 4]]]},
+                    {"type": "Polygon", "id": "02013", "arcs": [[5]]}]}}}
+    adjacency = CountyAdjacency.from_topology(topology)
+    assert adjacency.fips.tolist() == [1001, 1003, 1005, 2013]
+    assert adjacency.matrix.toarray().tolist() == [[0, 1, 0, 0], [1, 0, 1, 0], [0, 1, 0, 0], [0, 0, 0, 0]]
+
+    path = str(tmp_path / "geo" / "county_adjacency.npz")
+    adjacency.save(path)
+    loaded = CountyAdjacency.load(path)
+    assert loaded.fips.tolist() == adjacency.fips.tolist()
+    assert (loaded.matrix != adjacency.matrix).nnz == 0
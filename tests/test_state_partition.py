@@ -0,0 +1,37 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+from indicators.state_partition import StatePartition
+
+
+@pytest.fixture(scope="module")
+def df():
+    # Counties of a few states in random order, with several rows per county
+    rng = np.random.default_rng(0)
+    fips = rng.choice([1001, 1003, 1005, 2013, 6001, 6003, 42001, 56045], size=200)
+    return pd.DataFrame({"FIPS": fips, "value": rng.normal(size=len(fips))})
+
+
+@pytest.mark.parametrize("state_fips", [1, 2, 6, 42, 56])
+def test_state_matches_a_boolean_filter(df, state_fips):
+    partition = StatePartition(df)
+    expected = df.sort_values("FIPS", kind="stable")
+    expected = expected[expected["FIPS"] // 1000 == state_fips].reset_index(drop=True)
+    pd.testing.assert_frame_equal(partition.state(state_fips).reset_index(drop=True), expected)
+
+
+def test_unknown_state_is_empty(df):
+    partition = StatePartition(df)
+    assert partition.state(13).empty
+    assert list(partition.state(13).columns) == list(df.columns)
+
+
+def test_states(df):
+    assert StatePartition(df).states() == [1, 2, 6, 42, 56]
+
+
+def test_sorted_frame_is_kept(df):
+    sorted_df = df.sort_values("FIPS", kind="stable")
+    assert StatePartition(sorted_df).df is sorted_df
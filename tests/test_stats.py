@@ -0,0 +1,61 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+scipy_stats = pytest.importorskip("scipy.stats")
+
+from indicators.stats import fitted_line, linear_regression
+
+
+@pytest.fixture(scope="module")
+def xy():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=300)
+    y = 2.5 * x - 1 + rng.normal(scale=2, size=300)
+    x[::17] = np.nan
+    y[::23] = np.nan
+    return x, y
+
+
+def test_matches_linregress(xy):
+    x, y = xy
+    valid = ~(np.isnan(x) | np.isnan(y))
+    reference = scipy_stats.linregress(x[valid], y[valid])
+    fit = linear_regression(x, y)
+    assert fit["n"] == valid.sum()
+    assert fit["slope"] == pytest.approx(reference.slope)
+    assert fit["intercept"] == pytest.approx(reference.intercept)
+    assert fit["r"] == pytest.approx(reference.rvalue)
+    assert fit["r_squared"] == pytest.approx(reference.rvalue ** 2)
+    assert fit["p_value"] == pytest.approx(reference.pvalue, rel=1e-6)
+
+
+def test_bootstrap_intervals(xy):
+    x, y = xy
+    fit = linear_regression(x, y, seed=1)
+    assert fit["slope_ci"][0] < fit["slope"] < fit["slope_ci"][1]
+    assert fit["r_ci"][0] < fit["r"] < fit["r_ci"][1]
+    # The same seed draws the same resamples
+    assert linear_regression(x, y, seed=1)["slope_ci"] == fit["slope_ci"]
+    assert np.isnan(linear_regression(x, y, num_bootstrap=0)["slope_ci"]).all()
+
+
+def test_weak_correlation_matches_linregress():
+    rng = np.random.default_rng(2)
+    x, y = rng.normal(size=40), rng.normal(size=40)
+    reference = scipy_stats.linregress(x, y)
+    fit = linear_regression(x, y, num_bootstrap=0)
+    assert fit["r"] == pytest.approx(reference.rvalue)
+    assert fit["p_value"] == pytest.approx(reference.pvalue, rel=1e-6)
+
+
+@pytest.mark.parametrize("x, y", [([1.0, 2.0], [1.0, 3.0]), ([1.0, 1.0, 1.0], [1.0, 2.0, 3.0]),
+                                  ([1.0, 2.0, np.nan, 4.0], [np.nan, 1.0, 2.0, 3.0])])
+def test_too_few_points_or_no_spread(x, y):
+    fit = linear_regression(x, y)
+    assert np.isnan(fit["slope"]) and np.isnan(fit["r"]) and np.isnan(fit["p_value"])
+
+
+def test_fitted_line(xy):
+    fit = linear_regression(*xy, num_bootstrap=0)
+    xs, ys = fitted_line(fit, -1, 3)
+    np.testing.assert_allclose(ys, fit["intercept"] + fit["slope"] * np.array([-1, 3]))
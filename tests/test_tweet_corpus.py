@@ -0,0 +1,76 @@
+import os
+import shutil
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from twitter import tweet_corpus
+from twitter.partition_writer import PartitionWriter
+from twitter.tweet_corpus import Tweet, TweetCorpus
+
+
+def tweets(n, text="tweet"):
+    return [Tweet(i + 1, "AK", f"{text} {i}") for i in range(n)]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "AK.corpus")
+    assert tweet_corpus.write_corpus(path, tweets(25), block_tweets=10) == 25
+    corpus = TweetCorpus(path)
+    assert len(corpus) == 25
+    assert corpus.num_blocks == 3
+    assert list(corpus) == tweets(25)
+    assert corpus.block(2) == tweets(25)[20:]
+    assert set(corpus.sample(5, np.random.default_rng(0))) <= set(tweets(25))
+
+
+def test_index_of_another_corpus_is_rejected(tmp_path):
+    # What a crash between replacing the index and the corpus leaves behind
+    text_path = str(tmp_path / "AK.txt")
+    path = tweet_corpus.corpus_path(text_path)
+    tweet_corpus.write_corpus(path, tweets(25), block_tweets=10)
+    shutil.copy(tweet_corpus.index_path(path), str(tmp_path / "old.idx.npy"))
+    tweet_corpus.write_corpus(path, tweets(25, "other"), block_tweets=10)
+    os.replace(str(tmp_path / "old.idx.npy"), tweet_corpus.index_path(path))
+    with pytest.raises(ValueError):
+        TweetCorpus(path)
+    assert not tweet_corpus.is_fresh(text_path)
+
+
+def test_compressed_text_partitions_are_read(tmp_path):
+    text_path = str(tmp_path / "AK.txt")
+    ids_path = str(tmp_path / "ids" / "AK.txt")
+    with PartitionWriter("gzip") as writer:
+        writer.write(text_path, ["first tweet", "second tweet"])
+        writer.write(ids_path, ["11", "12"])
+    assert list(tweet_corpus.read_text_tweets(text_path, "AK", ids_path)) == \
+        [Tweet(11, "AK", "first tweet"), Tweet(12, "AK", "second tweet")]
+    assert list(tweet_corpus.iter_tweet_texts(text_path)) == ["first tweet", "second tweet"]
+    tweet_corpus.build_corpus(text_path, "AK", ids_path)
+    assert tweet_corpus.is_fresh(text_path)
+    assert list(TweetCorpus(tweet_corpus.corpus_path(text_path))) == \
+        [Tweet(11, "AK", "first tweet"), Tweet(12, "AK", "second tweet")]
+
+
+def test_text_tweets_stop_at_the_committed_write(tmp_path):
+    text_path = str(tmp_path / "AK.txt")
+    ids_path = str(tmp_path / "ids" / "AK.txt")
+    with PartitionWriter() as writer:
+        writer.write(text_path, ["first tweet", "second tweet"])
+        writer.write(ids_path, ["11", "12"])
+    # A crash mid-flush left a torn line in the texts only
+    with open(text_path, "a", encoding="utf-8") as f:
+        f.write("third tw")
+    expected = [Tweet(11, "AK", "first tweet"), Tweet(12, "AK", "second tweet")]
+    assert list(tweet_corpus.read_text_tweets(text_path, "AK", ids_path)) == expected
+    assert list(tweet_corpus.iter_tweets(text_path)) == [Tweet(0, "", "first tweet"), Tweet(0, "", "second tweet")]
+
+
+def test_ids_are_dropped_when_the_counts_differ(tmp_path):
+    text_path = str(tmp_path / "AK.txt")
+    ids_path = str(tmp_path / "ids" / "AK.txt")
+    with PartitionWriter() as writer:
+        writer.write(text_path, ["first tweet", "second tweet"])
+        writer.write(ids_path, ["11"])
+    assert [tweet.id for tweet in tweet_corpus.read_text_tweets(text_path, "AK", ids_path)] == [0, 0]
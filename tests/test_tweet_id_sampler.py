@@ -0,0 +1,32 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from twitter import tweet_id_sampler
+from twitter.partition_writer import PartitionWriter
+
+
+def test_ids_are_stripped_and_non_numeric_lines_skipped(tmp_path):
+    path = tmp_path / "ids.txt"
+    path.write_bytes(b"id\r\n1256989283470131200\r\n  42 \n\n \t\nabc123\n7\t\n12345678901234567890123\n99")
+    assert list(map(int, tweet_id_sampler.all_ids(str(path)))) == [1256989283470131200, 42, 7, 99]
+
+
+def test_samples_only_hold_ids(tmp_path):
+    path = tmp_path / "ids.txt"
+    path.write_text("".join(f" {tweet_id}\r\n" if tweet_id % 3 else "not an id\n" for tweet_id in range(1, 1000)))
+    ids = set(range(1, 1000)) - set(range(3, 1000, 3))
+    assert set(tweet_id_sampler.sample_file(str(path), probability=1)) == ids
+    assert set(tweet_id_sampler.sample_file(str(path), k=50, seed=1)) <= ids
+    assert set(tweet_id_sampler.sample_file(str(path), probability=0.5, seed=1)) <= ids
+    assert set(tweet_id_sampler.sample_file(str(path), probability=0.5, deterministic=True)) <= ids
+
+
+def test_only_committed_ids_are_sampled(tmp_path):
+    path = tmp_path / "AK.txt"
+    with PartitionWriter() as writer:
+        writer.write(str(path), ["1", "2", "3"])
+    with open(path, "a") as f:
+        f.write("4\n5")
+    assert sorted(tweet_id_sampler.sample_file(str(path), probability=1)) == [1, 2, 3]
+    assert sorted(tweet_id_sampler.sample_file(str(path), k=10, seed=1)) == [1, 2, 3]
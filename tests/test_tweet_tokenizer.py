@@ -0,0 +1,49 @@
+import itertools
+import os
+
+import pytest
+
+nltk = pytest.importorskip("nltk")
+
+from twitter import tweet_tokenizer
+
+SAMPLE_TWEETS_PATH = "data/tweets/geo_covid_tweets/PA.txt"
+NUM_SAMPLE_TWEETS = 2000
+# Chunks that take the treebank fallback: contractions, quotes, brackets, abbreviations and sentence ends
+EDGE_CASE_TWEETS = [
+    "I can't believe we cannot go out. Gonna stay home!!",
+    "Dr. Fauci said \"wear a mask\" (again)... https://t.co/abc123",
+    "The U.S. has 10,000 new cases today. That's a lot.",
+    "'Stay home' they said... #StayHome @CDCgov",
+    "Masks work.\" Period. [source: who.int]",
+    "Wait -- is it 5 p.m. already? Schools re-open Sept. 8th.",
+    "«Quarantine» is day 100 ... I'm done :( https://www.example.com/news",
+]
+
+
+@pytest.fixture(scope="module")
+def stopwords():
+    try:
+        nltk.data.find("tokenizers/punkt_tab")
+        return set(nltk.corpus.stopwords.words("english"))
+    except LookupError:
+        pytest.skip("nltk data missing, run python -m twitter.nltk_resources")
+
+
+def sample_tweets():
+    tweets = list(EDGE_CASE_TWEETS)
+    if os.path.exists(SAMPLE_TWEETS_PATH):
+        with open(SAMPLE_TWEETS_PATH, encoding="utf-8") as f:
+            tweets.extend(line.rstrip("\n") for line in itertools.islice(f, NUM_SAMPLE_TWEETS))
+    return tweets
+
+
+def test_exact_mode_matches_word_tokenize(stopwords):
+    tweets = sample_tweets()
+    expected = [tweet_tokenizer.reference_clean_tweet(tweet, stopwords) for tweet in tweets]
+    for tweet, tokens, reference in zip(tweets, tweet_tokenizer.tokenize_tweets(tweets, stopwords, "exact"), expected):
+        assert tokens == reference, tweet
+
+
+def test_abbreviations_come_from_punkt(stopwords):
+    assert "dr" in tweet_tokenizer.get_abbreviations()
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+nltk = pytest.importorskip("nltk")
+pytest.importorskip("wordcloud")
+
+from twitter import word_counts
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # Tweets of two states and an index of them, with nltk reading its data from a directory of the test
+    nltk_dir = tmp_path / "nltk_data"
+    (nltk_dir / "tokenizers" / "punkt_tab" / "english").mkdir(parents=True)
+    (nltk_dir / "tokenizers" / "punkt_tab" / "english" / "abbrev_types.txt").write_text("dr\n")
+    (nltk_dir / "corpora" / "stopwords").mkdir(parents=True)
+    (nltk_dir / "corpora" / "stopwords" / "english").write_text("the\n")
+    monkeypatch.setattr(nltk.data, "path", [str(nltk_dir)])
+
+    data_dir = str(tmp_path / "data")
+    for state in ["AK", "PA"]:
+        path = word_counts.tweets_path(data_dir, state)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"tweet from {state}\n")
+
+    sources = [("AK", "AK"), ("PA", "PA")]
+    inputs = word_counts.input_fingerprints(data_dir, sources)
+    os.makedirs(f"{data_dir}/{word_counts.WORD_COUNT_DIR}")
+    for name, _ in sources:
+        word_counts.write_array(np.array([[0], [1]], dtype=np.int32), word_counts.counts_path(data_dir, name))
+    word_counts.write_json(["tweet"], word_counts.vocabulary_path(data_dir))
+    word_counts.write_json(dict(inputs, vocabulary=word_counts.file_fingerprint(word_counts.vocabulary_path(data_dir))),
+                           word_counts.index_manifest_path(data_dir))
+    return data_dir
+
+
+def bump(path):
+    # Later mtime than any write of the test, whatever the resolution of the file system's timestamps
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+def test_fresh_index(data_dir):
+    assert not word_counts.is_stale(data_dir, "AK", "AK")
+    assert word_counts.load_word_counts("AK", data_dir).tolist() == [[0], [1]]
+    assert {os.path.basename(path) for path in word_counts.nltk_resource_paths()} == {"abbrev_types.txt", "english"}
+
+
+def test_stale_after_the_tweets_change(data_dir):
+    bump(word_counts.tweets_path(data_dir, "PA"))
+    assert word_counts.is_stale(data_dir, "PA", "PA")
+    assert word_counts.load_word_counts("PA", data_dir) is None
+    # The other state's counts still index the vocabulary they were built with
+    assert not word_counts.is_stale(data_dir, "AK", "AK")
+
+
+@pytest.mark.parametrize("resource", ["tokenizers/punkt_tab/english/abbrev_types.txt", "corpora/stopwords/english"])
+def test_stale_after_the_nltk_data_changes(data_dir, resource):
+    bump(os.path.join(nltk.data.path[0], resource))
+    assert word_counts.is_stale(data_dir, "AK", "AK")
+
+
+def test_stale_after_an_nltk_download(data_dir):
+    os.remove(os.path.join(nltk.data.path[0], "corpora/stopwords/english"))
+    assert word_counts.is_stale(data_dir, "AK", "AK")
+
+
+def test_stale_with_another_vocabulary(data_dir):
+    word_counts.write_json(["other", "tweet"], word_counts.vocabulary_path(data_dir))
+    assert word_counts.is_stale(data_dir, "AK", "AK")
+
+
+def test_stale_without_a_manifest(data_dir):
+    # What an index built before the manifest, or a build that didn't finish, leaves behind
+    os.remove(word_counts.index_manifest_path(data_dir))
+    assert word_counts.is_stale(data_dir, "AK", "AK")
+
+
+def test_index_paths_cover_the_nltk_data(data_dir):
+    paths = word_counts.index_paths("AK", data_dir)
+    assert word_counts.index_manifest_path(data_dir) in paths
+    assert set(word_counts.nltk_resource_paths()) <= set(paths)
@@ -0,0 +1,195 @@
+import copy
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import tweepy
+
+# Requests in flight at once. Hydration is bound by the API's latency, not by our CPU, so a thread pool is enough
+HYDRATION_WORKERS = 8
+RETRIES = 5
+BACKOFF_SECONDS = 2
+MAX_BACKOFF_SECONDS = 5 * 60
+# https://developer.twitter.com/en/docs/twitter-api/v1/rate-limits
+RATE_LIMIT_WINDOW_SECONDS = 15 * 60
+STATUSES_LOOKUP_LIMIT = 900
+# The oEmbed endpoint doesn't publish a limit, so we stay well below the lookup endpoint's
+OEMBED_LIMIT = 300
+BATCH_SIZE = 100
+# How often hydrate calls its poll callback while it waits for responses
+POLL_SECONDS = 1
+CHECKPOINT_DIR = "../data/tweets/checkpoints"
+
+
+class RateLimiter:
+    # Token bucket shared by the workers of one endpoint. It refills at limit per window and follows the
+    # x-rate-limit-remaining / x-rate-limit-reset headers of every response, so the workers wait for the window to
+    # reset exactly as long as the API says instead of a fixed 15 minutes
+
+    def __init__(self, limit, window_seconds=RATE_LIMIT_WINDOW_SECONDS):
+        self.capacity = limit
+        self.tokens = float(limit)
+        self.rate = limit / window_seconds
+        self.updated = time.monotonic()
+        self.resume_at = 0.0  # monotonic time before which no request is sent
+        self.condition = threading.Condition()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = self.refill()
+                if now >= self.resume_at and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.resume_at - now, (1 - self.tokens) / self.rate)
+                self.condition.wait(timeout=wait)
+
+    def update(self, headers):
+        # Headers of the last response, missing headers (e.g. oEmbed) leave the bucket as it is
+        remaining = headers.get("x-rate-limit-remaining")
+        reset = headers.get("x-rate-limit-reset")
+        if remaining is None or reset is None:
+            return
+        with self.condition:
+            self.refill()
+            self.tokens = min(self.tokens, float(remaining))
+            if int(remaining) <= 0:
+                # reset is epoch seconds, convert it to our monotonic clock
+                self.resume_at = max(self.resume_at, time.monotonic() + max(float(reset) - time.time(), 0) + 1)
+            self.condition.notify_all()
+
+    def pause(self, seconds):
+        with self.condition:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+
+def response_headers(response):
+    return {} if response is None else {name.lower(): value for name, value in response.headers.items()}
+
+
+class Checkpoint:
+    # Indices of the batches of a job that are done, written after every batch so an interrupted job resumes with the
+    # batches it hadn't finished. Jobs that buffer their output turn autosave off and save whenever their writer has
+    # committed the output of the batches marked so far
+
+    def __init__(self, path, autosave=True):
+        self.path = path
+        self.autosave = autosave
+        self.done = set()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.done = set(json.load(f))
+
+    def mark(self, index):
+        self.done.add(index)
+        if self.autosave:
+            self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(sorted(self.done), f)
+        os.replace(tmp_path, self.path)
+
+    def finish(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def checkpoint_path(job_name, batches):
+    # Named after the job and the ids it fetches, so a different set of ids never resumes from this checkpoint
+    digest = hashlib.blake2b(json.dumps([list(map(str, batch)) for batch in batches]).encode("utf-8"),
+                             digest_size=8).hexdigest()
+    return f"{CHECKPOINT_DIR}/{job_name}_{digest}.json"
+
+
+def backoff(attempt):
+    # Exponential backoff with full jitter so retrying workers don't hit the API in lockstep
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** attempt))
+
+
+def call_with_retries(fetch, api, item, limiter, retries=RETRIES):
+    # fetch(api, item) -> result. Rate limit errors wait for the window the headers give, other errors are retried
+    # with backoff and raised once the retries run out
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            result = fetch(api, item)
+            limiter.update(response_headers(getattr(api, "last_response", None)))
+            return result
+        except tweepy.RateLimitError as e:
+            headers = response_headers(e.response)
+            limiter.update(headers)
+            if "x-rate-limit-reset" not in headers:
+                limiter.pause(RATE_LIMIT_WINDOW_SECONDS)
+            if attempt == retries:
+                raise
+        except tweepy.error.TweepError:
+            if attempt == retries:
+                raise
+            time.sleep(backoff(attempt))
+
+
+def hydrate(batches, fetch, on_result, api, limiter, workers=HYDRATION_WORKERS, checkpoint=None, poll=None):
+    # Fetches every batch with at most `workers` requests in flight and hands each result to on_result(batch, result)
+    # on the calling thread, so writing results needs no locking. poll() is called on the same thread after every result
+    # and at least every POLL_SECONDS while waiting, e.g. to flush buffered output that is due even when no new results
+    # come in. Batches that still fail after their retries are left out of the checkpoint, so running the job again
+    # fetches them. Returns the sorted indices of the failed batches, the caller finishes the checkpoint once it has
+    # nothing left to fetch
+    checkpoint = checkpoint if checkpoint is not None else Checkpoint(None)
+    # Each worker gets its own copy of the api, so the headers of its last response aren't overwritten by other workers
+    local = threading.local()
+
+    def fetch_batch(batch):
+        if not hasattr(local, "api"):
+            local.api = copy.copy(api)
+        return call_with_retries(fetch, local.api, batch, limiter)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_batch, batch): index for index, batch in enumerate(batches)
+                   if index not in checkpoint.done}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures[future]
+                try:
+                    result = future.result()
+                except tweepy.error.TweepError as e:
+                    failed.append(index)
+                    print(f"Giving up on batch {index} for now: {e}")
+                    continue
+                on_result(batches[index], result)
+                checkpoint.mark(index)
+            if poll is not None:
+                poll()
+    if failed:
+        print(f"{len(failed)} of {len(futures)} batches failed, run the job again to fetch batches {sorted(failed)}")
+    return sorted(failed)
+
+
+def lookup_statuses(api, tweet_ids):
+    return api.statuses_lookup(tweet_ids, include_entities=True, tweet_mode='extended')
+
+
+def fetch_oembed(api, tweet_id):
+    return api.get_oembed(tweet_id)["html"]
+
+
+def batched(items, size=BATCH_SIZE):
+    return [items[i:i + size] for i in range(0, len(items), size)]
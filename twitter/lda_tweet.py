@@ -1,9 +1,18 @@
 # Heavily influenced by
 # https://towardsdatascience.com/nlp-extracting-the-main-topics-from-your-dataset-using-lda-in-minutes-21486f5aa925
 
+import functools
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import gensim
 import nltk
 
+from twitter.partition_writer import find_partition
+from twitter.tweet_corpus import corpus_path, iter_tweet_texts
+
 '''
 This ended up not being very useful. We thought the output of an LDA model would be more human readable
 but instead each topic is a list of words with weights. For example when running this on the 24,000 tweet
@@ -47,40 +56,137 @@ I'm leaving the code here for historic/discussion purposes
 
 # File containing tweets
 TWEET_FILE = "../data/tweets/covid_tweets/tweets_24_000.txt"
+# Directory containing files that have COVID tweet text by state
+GEO_TWEET_DIR = "../data/tweets/geo_covid_tweets"
+# Dictionaries and serialized bag of words corpora, reused until their tweets change
+LDA_DIR = "../data/tweets/lda"
+NUM_TOPICS = 10
+PASSES = 10
+# Tweets sent to a preprocessing worker at a time, and batches in flight per worker so the input is streamed
+BATCH_TWEETS = 2000
+BATCHES_PER_WORKER = 2
+# Documents added to the dictionary at a time
+DICTIONARY_CHUNK = 10000
 stemmer = nltk.stem.SnowballStemmer("english")
+lemmatizer = nltk.WordNetLemmatizer()
+
+
+@functools.lru_cache(maxsize=None)
+def normalize_token(token):
+    # Tweets repeat the same words over and over, so every distinct token is only lemmatized and stemmed once per
+    # process
+    return stemmer.stem(lemmatizer.lemmatize(token, pos='v'))
 
 
 def clean_tweet(tweet):
-    # TODO probably not great to reinitialize each obj
     tokens = gensim.utils.simple_preprocess(tweet)
-    tokens = [token for token in tokens if token not in gensim.parsing.preprocessing.STOPWORDS and len(token) > 3]
-    tokens = [nltk.WordNetLemmatizer().lemmatize(token, pos='v') for token in tokens]
-    tokens = [stemmer.stem(token) for token in tokens]
-    return tokens
+    return [normalize_token(token) for token in tokens
+            if token not in gensim.parsing.preprocessing.STOPWORDS and len(token) > 3]
 
 
-def clean_tweets(tweets):
+def clean_tweet_batch(tweets):
+    # Runs in a worker process
     return [clean_tweet(tweet) for tweet in tweets]
 
 
-def get_tweets():
-    with open(TWEET_FILE) as f:
-        return f.readlines()
-
-
-def run_lda(tweets):
-    dictionary = gensim.corpora.Dictionary(tweets)
-    bows = [dictionary.doc2bow(tweet) for tweet in tweets]
-    lda_model = gensim.models.LdaMulticore(bows, num_topics=10, id2word=dictionary, passes=10, workers=2)
+def batches(tweets, size=BATCH_TWEETS):
+    batch = []
+    for tweet in tweets:
+        batch.append(tweet)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def clean_tweets(tweets, workers=None):
+    # Yields the tokens of every tweet in order. Batches are cleaned in a process pool with a bounded number of batches
+    # in flight, so the tweets are streamed instead of read up front (Executor.map would submit all of them at once)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for batch in batches(tweets):
+            in_flight.append(executor.submit(clean_tweet_batch, batch))
+            if len(in_flight) >= workers * BATCHES_PER_WORKER:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+
+
+def get_tweets(state=None):
+    return iter_tweet_texts(tweets_path(state))
+
+
+def tweets_path(state=None):
+    return f"{GEO_TWEET_DIR}/{state}.txt" if state else TWEET_FILE
+
+
+def source_mtime(state=None):
+    # The text file (plain or as written compressed), or the corpus where only that was shipped
+    path = tweets_path(state)
+    return os.path.getmtime(find_partition(path) or corpus_path(path))
+
+
+def lda_paths(state=None):
+    name = state if state else os.path.splitext(os.path.basename(TWEET_FILE))[0]
+    return f"{LDA_DIR}/{name}.dict", f"{LDA_DIR}/{name}.mm"
+
+
+def is_prepared(state=None):
+    return all(os.path.exists(path) and os.path.getmtime(path) >= source_mtime(state) for path in lda_paths(state))
+
+
+def prepare_corpus(state=None, workers=None, force=False):
+    # Builds the dictionary and the bag of words corpus of the tweets in two streaming passes. The first cleans every
+    # tweet once, adds it to the dictionary and spills its tokens to disk, the second turns the spilled tokens into
+    # bags of words straight into a Matrix Market file, so neither pass holds the corpus in memory
+    dictionary_path, bow_path = lda_paths(state)
+    if not force and is_prepared(state):
+        return gensim.corpora.Dictionary.load(dictionary_path), gensim.corpora.MmCorpus(bow_path)
+
+    os.makedirs(LDA_DIR, exist_ok=True)
+    tokens_path = f"{bow_path}.tokens.tmp"
+    dictionary = gensim.corpora.Dictionary()
+    with open(tokens_path, "w", encoding="utf-8") as f:
+        chunk = []
+        for tokens in clean_tweets(get_tweets(state), workers):
+            f.write(" ".join(tokens) + "\n")
+            chunk.append(tokens)
+            if len(chunk) == DICTIONARY_CHUNK:
+                dictionary.add_documents(chunk)
+                chunk = []
+        dictionary.add_documents(chunk)
+
+    def bows():
+        with open(tokens_path, encoding="utf-8") as f:
+            for line in f:
+                yield dictionary.doc2bow(line.split())
+
+    # Written under temporary names and moved in place with the corpus last, so a half built corpus is never reused
+    dictionary.save(f"{dictionary_path}.tmp")
+    os.replace(f"{dictionary_path}.tmp", dictionary_path)
+    gensim.corpora.MmCorpus.serialize(f"{bow_path}.tmp", bows(), id2word=dictionary)
+    for suffix in [".index", ""]:
+        os.replace(f"{bow_path}.tmp{suffix}", f"{bow_path}{suffix}")
+    os.remove(tokens_path)
+    return dictionary, gensim.corpora.MmCorpus(bow_path)
+
+
+def run_lda(dictionary, bows, workers=None):
+    # With workers=None gensim uses all cores but one
+    lda_model = gensim.models.LdaMulticore(bows, num_topics=NUM_TOPICS, id2word=dictionary, passes=PASSES,
+                                           workers=workers)
     for idx, topic in lda_model.print_topics(-1):
         print(f"Topic: {idx} \nWords: {topic}\n")
+    return lda_model
 
 
-def main():
-    tweets = get_tweets()
-    tweets = clean_tweets(tweets)
-    run_lda(tweets)
+def main(state=None, workers=None):
+    dictionary, bows = prepare_corpus(state, workers)
+    run_lda(dictionary, bows, workers)
 
 
 if __name__ == "__main__":
-    main()
+    # Optionally pass a state code to find the topics of that state's tweets, and the number of worker processes
+    main(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
@@ -0,0 +1,51 @@
+import sys
+
+import nltk
+
+# Local bundle of the nltk data the app needs, so it doesn't have to be downloaded on every start
+NLTK_DATA_DIR = "data/nltk_data"
+# (path nltk looks the resource up by, package to download if it is missing). word_tokenize reads punkt_tab in
+# current nltk releases (the pickled punkt models aren't loaded anymore)
+REQUIRED_RESOURCES = [
+    ("corpora/stopwords", "stopwords"),
+    ("tokenizers/punkt_tab", "punkt_tab"),
+]
+
+CHECKED = False
+
+
+def missing_resources(data_dir=NLTK_DATA_DIR):
+    if data_dir not in nltk.data.path:
+        nltk.data.path.insert(0, data_dir)
+    missing = []
+    for resource, package in REQUIRED_RESOURCES:
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            missing.append(package)
+    return missing
+
+
+def download_resources(data_dir=NLTK_DATA_DIR):
+    # Only downloads what isn't in the bundle (or any other nltk data dir) yet
+    for package in missing_resources(data_dir):
+        nltk.download(package, download_dir=data_dir, quiet=True)
+
+
+def ensure_resources(data_dir=NLTK_DATA_DIR):
+    # Checked once per process, every rerun of the app after that is free
+    global CHECKED
+    if not CHECKED:
+        download_resources(data_dir)
+        CHECKED = True
+
+
+def get_stopwords(data_dir=NLTK_DATA_DIR):
+    ensure_resources(data_dir)
+    return nltk.corpus.stopwords.words("english")
+
+
+if __name__ == "__main__":
+    # Fill the local bundle ahead of a deploy, optionally into a different directory
+    download_resources(*sys.argv[1:2])
+    print(f"nltk resources missing after download: {missing_resources(*sys.argv[1:2]) or 'none'}")
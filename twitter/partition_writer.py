@@ -0,0 +1,249 @@
+import gzip
+import io
+import json
+import os
+import time
+
+try:
+    import zstandard
+except ImportError:  # only needed for .zst output
+    zstandard = None
+
+# Buffered lines of all partitions are written once they reach this size or age, whichever comes first
+FLUSH_BYTES = 4 * 1024 ** 2
+FLUSH_SECONDS = 30
+MANIFEST_FILE = "manifest.json"
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def manifest_path(directory):
+    return f"{directory}/{MANIFEST_FILE}"
+
+
+def load_manifest(directory):
+    # {file name: {"bytes": committed bytes, "records": committed lines}}
+    path = manifest_path(directory)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(directory, manifest):
+    tmp_path = f"{manifest_path(directory)}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path(directory))
+
+
+def compression_of(path):
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+def compress(data, compression):
+    # Every flush is a complete gzip member / zstd frame, concatenated members are still one valid file
+    if compression == "gzip":
+        return gzip.compress(data)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd output needs the zstandard package (pip install zstandard)")
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def decompress(data, compression):
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd input needs the zstandard package (pip install zstandard)")
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data), read_across_frames=True) as reader:
+            return reader.read()
+    return data
+
+
+class PartitionWriter:
+    # Appends lines to many output files ("partitions", e.g. one per state) through one open handle each, instead of
+    # opening the file for every batch. Lines are buffered and written for all partitions at once on size or age.
+    # Every write is fsynced and then committed to a manifest in the partition's directory (written atomically), so a
+    # file is only ever read up to its last committed write and a write torn by a crash is cut off the next time the
+    # file is opened. Files written before they had a manifest entry are taken as committed up to their current size, with
+    # the lines they already hold counted into their records
+
+    def __init__(self, compression=None, flush_bytes=FLUSH_BYTES, flush_seconds=FLUSH_SECONDS):
+        if compression is not None and compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression {compression}, expected one of {list(COMPRESSION_SUFFIXES)}")
+        self.compression = compression
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self.handles = {}
+        self.buffers = {}  # path -> [lines]
+        self.buffered_bytes = 0
+        self.last_flush = time.monotonic()
+
+    def partition_path(self, path):
+        return path + COMPRESSION_SUFFIXES.get(self.compression, "")
+
+    def open(self, path):
+        directory, name = os.path.split(path)
+        directory = directory or "."
+        os.makedirs(directory, exist_ok=True)
+        handle = open(path, "ab")
+        manifest = load_manifest(directory)
+        committed = manifest.get(name, {}).get("bytes")
+        if committed is None and handle.tell() > 0:
+            # Adopted with the lines it already has, so its record count covers the whole file
+            manifest[name] = {"bytes": handle.tell(), "records": count_lines(path, handle.tell())}
+            save_manifest(directory, manifest)
+        elif committed is not None and handle.tell() > committed:
+            handle.truncate(committed)
+            handle.seek(committed)
+        self.handles[path] = handle
+        return handle
+
+    def is_due(self):
+        return self.buffered_bytes >= self.flush_bytes or \
+            (self.buffered_bytes > 0 and time.monotonic() - self.last_flush >= self.flush_seconds)
+
+    def poll(self):
+        # Flushes if the buffered lines are due, for callers to run between writes so lines don't wait for the next
+        # write to reach their age limit. Returns whether anything was committed
+        if not self.is_due():
+            return False
+        self.flush()
+        return True
+
+    def write(self, path, lines):
+        # Buffers one line per element (without line breaks) for the partition at path (plus the compression suffix).
+        # Returns whether the lines buffered before this call were committed, which happens before the new lines are
+        # buffered so a caller can checkpoint everything it had written until now
+        flushed = False
+        if self.is_due():
+            self.flush()
+            flushed = True
+        buffer = self.buffers.setdefault(self.partition_path(path), [])
+        for line in lines:
+            line = f"{line}\n"
+            buffer.append(line)
+            self.buffered_bytes += len(line)
+        return flushed
+
+    def flush(self):
+        written = {}  # directory -> {name: (bytes, records)}
+        for path, lines in self.buffers.items():
+            if not lines:
+                continue
+            handle = self.handles.get(path) or self.open(path)
+            data = compress("".join(lines).encode("utf-8"), compression_of(path))
+            handle.write(data)
+            handle.flush()
+            os.fsync(handle.fileno())
+            directory, name = os.path.split(path)
+            written.setdefault(directory or ".", {})[name] = (handle.tell(), len(lines))
+
+        for directory, files in written.items():
+            manifest = load_manifest(directory)
+            for name, (size, records) in files.items():
+                entry = manifest.setdefault(name, {"bytes": 0, "records": 0})
+                entry["bytes"] = size
+                entry["records"] += records
+            save_manifest(directory, manifest)
+
+        self.buffers = {}
+        self.buffered_bytes = 0
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def committed_size(path):
+    # Bytes of a partition up to its last committed write, the whole file if it has no manifest entry
+    directory, name = os.path.split(path)
+    size = os.path.getsize(path)
+    committed = load_manifest(directory or ".").get(name, {}).get("bytes")
+    return size if committed is None else min(committed, size)
+
+
+def committed_records(path):
+    # Lines of a partition up to its last committed write, from its manifest entry when it has one
+    directory, name = os.path.split(path)
+    records = load_manifest(directory or ".").get(name, {}).get("records")
+    return records if records is not None else sum(1 for _ in iter_partition(path))
+
+
+def count_lines(path, size, chunk_bytes=FLUSH_BYTES):
+    # Lines in the first size bytes of a file, read a chunk at a time unless the file is compressed
+    compression = compression_of(path)
+    with open(path, "rb") as f:
+        if compression is not None:
+            return decompress(f.read(size), compression).count(b"\n")
+        lines = 0
+        while size > 0:
+            chunk = f.read(min(chunk_bytes, size))
+            if not chunk:
+                break
+            lines += chunk.count(b"\n")
+            size -= len(chunk)
+        return lines
+
+
+def find_partition(path):
+    # The file the lines written for path ended up in, the plain file or its compressed variant. None if there is none
+    for candidate in [path] + [path + suffix for suffix in COMPRESSION_SUFFIXES.values()]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+class CommittedReader(io.RawIOBase):
+    # Reads a file up to a byte limit, so decompressors and line iterators stop at the last committed write
+
+    def __init__(self, f, size):
+        self.f = f
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.f.readinto(memoryview(buffer)[:min(len(buffer), self.remaining)])
+        self.remaining -= n
+        return n
+
+
+def iter_partition(path):
+    # Streams the lines (without line breaks) of a partition file up to its last committed write, decompressing it if
+    # it was written compressed
+    compression = compression_of(path)
+    with open(path, "rb") as f:
+        stream = io.BufferedReader(CommittedReader(f, committed_size(path)))
+        if compression == "gzip":
+            stream = gzip.GzipFile(fileobj=stream)
+        elif compression == "zstd":
+            if zstandard is None:
+                raise ImportError("zstd input needs the zstandard package (pip install zstandard)")
+            stream = zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+        for line in io.TextIOWrapper(stream, encoding="utf-8"):
+            yield line.rstrip("\n")
+
+
+def read_partition(path):
+    # Lines of a partition up to its last committed write, decompressed if it was written compressed
+    if not os.path.exists(path):
+        return []
+    with open(path, "rb") as f:
+        data = f.read(committed_size(path))
+    return decompress(data, compression_of(path)).decode("utf-8").splitlines()
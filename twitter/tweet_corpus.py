@@ -0,0 +1,200 @@
+import os
+import sys
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+from twitter.partition_writer import committed_records, find_partition, iter_partition
+
+# Compressed tweet corpus, written next to the plain text tweet file it is built from (AK.txt -> AK.corpus):
+#   {name}.corpus          -> a header of CORPUS_MAGIC and the corpus' token, then zlib compressed blocks of
+#                             BLOCK_TWEETS tweets, one "id\tstate\ttext" line per tweet
+#   {name}.corpus.idx.npy  -> (2 x blocks + 2) array, a first column of the index version and the token of the corpus it
+#                             was written with, then each block's byte offset and the number of tweets before it
+# Any block is one seek and one decompress away, so readers stream the corpus a block at a time or jump straight to
+# the blocks they need. Tweets without a known id have id 0, tweets without a state an empty state
+CORPUS_SUFFIX = ".corpus"
+INDEX_SUFFIX = ".idx.npy"
+INDEX_VERSION = 1
+CORPUS_MAGIC = b"TWCORPUS"
+HEADER_BYTES = len(CORPUS_MAGIC) + 8
+BLOCK_TWEETS = 2000
+COMPRESSION_LEVEL = 9
+# Ids of the geo tagged tweets, line for line with their texts, relative to the tweets dir
+GEO_TWEET_IDS_DIR = "geo_covid_tweet_ids/geo"
+
+Tweet = namedtuple("Tweet", ["id", "state", "text"])
+
+
+def corpus_path(text_path):
+    return f"{os.path.splitext(text_path)[0]}{CORPUS_SUFFIX}"
+
+
+def index_path(path):
+    return f"{path}{INDEX_SUFFIX}"
+
+
+def read_index(path):
+    # (offsets, counts) of a corpus' blocks. Raises ValueError unless the index was written with this corpus, e.g. when
+    # a crash between replacing the two left a new index next to the old corpus
+    index = np.load(index_path(path), mmap_mode="r")
+    if index.ndim != 2 or index.shape[0] != 2 or index.shape[1] < 2 or int(index[0, 0]) != INDEX_VERSION:
+        raise ValueError(f"{index_path(path)} isn't a version {INDEX_VERSION} corpus index, rebuild the corpus")
+    with open(path, "rb") as f:
+        header = f.read(HEADER_BYTES)
+    offsets, counts = index[0, 1:], index[1, 1:]
+    if header != CORPUS_MAGIC + int(index[1, 0]).to_bytes(8, "little") or os.path.getsize(path) != int(offsets[-1]):
+        raise ValueError(f"{path} doesn't match its index {index_path(path)}, rebuild the corpus")
+    return offsets, counts
+
+
+def is_fresh(text_path):
+    # The corpus can stand in for the text file (or its compressed partition) if it matches its index and is at least
+    # as new, or if only the corpus was shipped
+    path = corpus_path(text_path)
+    if not os.path.exists(path) or not os.path.exists(index_path(path)):
+        return False
+    try:
+        read_index(path)
+    except ValueError:
+        return False
+    text_file = find_partition(text_path)
+    return text_file is None or os.path.getmtime(path) >= os.path.getmtime(text_file)
+
+
+def encode_block(tweets):
+    return zlib.compress("".join(f"{tweet.id}\t{tweet.state}\t{tweet.text}\n" for tweet in tweets).encode("utf-8"),
+                         COMPRESSION_LEVEL)
+
+
+def decode_block(data):
+    tweets = []
+    for line in zlib.decompress(data).decode("utf-8").split("\n")[:-1]:
+        tweet_id, state, text = line.split("\t", 2)
+        tweets.append(Tweet(int(tweet_id), state, text))
+    return tweets
+
+
+def write_corpus(path, tweets, block_tweets=BLOCK_TWEETS):
+    # Streams tweets (an iterable of Tweet) into a corpus, holding one block in memory at a time
+    token = int.from_bytes(os.urandom(8), "little")
+    offsets, counts = [HEADER_BYTES], [0]
+    block = []
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(CORPUS_MAGIC + token.to_bytes(8, "little"))
+        for tweet in tweets:
+            block.append(tweet)
+            if len(block) == block_tweets:
+                offsets.append(offsets[-1] + f.write(encode_block(block)))
+                counts.append(counts[-1] + len(block))
+                block = []
+        if block:
+            offsets.append(offsets[-1] + f.write(encode_block(block)))
+            counts.append(counts[-1] + len(block))
+    np.save(f"{index_path(path)}.tmp.npy", np.array([[INDEX_VERSION] + offsets, [token] + counts], dtype=np.uint64))
+    # Both carry the token, so if a crash leaves the new index with the old corpus the pair is rejected and rebuilt
+    os.replace(f"{index_path(path)}.tmp.npy", index_path(path))
+    os.replace(tmp_path, path)
+    return counts[-1]
+
+
+class TweetCorpus:
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets, self.counts = read_index(path)
+
+    def __len__(self):
+        return int(self.counts[-1])
+
+    @property
+    def num_blocks(self):
+        return len(self.offsets) - 1
+
+    def read_block(self, f, i):
+        f.seek(int(self.offsets[i]))
+        return decode_block(f.read(int(self.offsets[i + 1] - self.offsets[i])))
+
+    def block(self, i):
+        with open(self.path, "rb") as f:
+            return self.read_block(f, i)
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            for i in range(self.num_blocks):
+                yield from self.read_block(f, i)
+
+    def texts(self):
+        for tweet in self:
+            yield tweet.text
+
+    def sample(self, k, rng=None):
+        # k tweets drawn uniformly without replacement, only the blocks holding them are decompressed
+        rng = rng if rng is not None else np.random.default_rng()
+        numbers = np.sort(rng.choice(len(self), size=min(k, len(self)), replace=False)).astype(np.uint64)
+        blocks = np.searchsorted(self.counts, numbers, side="right") - 1
+        sampled = []
+        with open(self.path, "rb") as f:
+            for i in np.unique(blocks):
+                tweets = self.read_block(f, i)
+                sampled.extend(tweets[int(number) - int(self.counts[i])] for number in numbers[blocks == i])
+        return sampled
+
+
+def read_text_tweets(text_path, state="", ids_path=None):
+    # Tweets of a text tweet file (plain or written compressed by a PartitionWriter), with the ids of its ids file if it
+    # has one id per tweet
+    text_file = find_partition(text_path)
+    if text_file is None:
+        raise FileNotFoundError(f"No tweet file at {text_path}")
+    ids_file = find_partition(ids_path) if ids_path is not None else None
+    # Both are only read up to their last committed write, so the manifests' record counts tell whether they pair up
+    if ids_file is not None and committed_records(text_file) != committed_records(ids_file):
+        ids_file = None
+    ids = iter_partition(ids_file) if ids_file else None
+    for line in iter_partition(text_file):
+        tweet_id = int(next(ids).strip() or 0) if ids else 0
+        yield Tweet(tweet_id, state, line)
+
+
+def iter_tweets(text_path):
+    # Every tweet of a tweet file, from its corpus when that is fresh, otherwise streamed from the text
+    if is_fresh(text_path):
+        yield from TweetCorpus(corpus_path(text_path))
+    else:
+        yield from read_text_tweets(text_path)
+
+
+def iter_tweet_texts(text_path):
+    for tweet in iter_tweets(text_path):
+        yield tweet.text
+
+
+def build_corpus(text_path, state="", ids_path=None, force=False):
+    path = corpus_path(text_path)
+    if not force and is_fresh(text_path):
+        return None
+    num_tweets = write_corpus(path, read_text_tweets(text_path, state, ids_path))
+    print(f"Wrote {num_tweets} tweets to {path} "
+          f"({os.path.getsize(path) / os.path.getsize(find_partition(text_path)):.0%} of the text)")
+    return path
+
+
+def build_corpora(data_dir="data", force=False):
+    # Every geo tagged state file and the global tweets under the data dir
+    from twitter.state_data_aggregator import STATE_TO_CODE_MAP
+    from twitter.word_cloud import GEO_TWEET_DIR, TWEET_DATA_DIR, TWEET_FILE
+
+    tweets_dir = f"{data_dir}/{TWEET_DATA_DIR}"
+    sources = [(f"{tweets_dir}/{GEO_TWEET_DIR}/{code}.txt", code, f"{tweets_dir}/{GEO_TWEET_IDS_DIR}/{code}.txt")
+               for code in STATE_TO_CODE_MAP.values()]
+    sources.append((f"{tweets_dir}/{TWEET_FILE}", "", None))
+    for text_path, state, ids_path in sources:
+        if find_partition(text_path) is not None:
+            build_corpus(text_path, state, ids_path, force)
+
+
+if __name__ == "__main__":
+    build_corpora(*sys.argv[1:2])
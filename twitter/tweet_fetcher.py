@@ -1,15 +1,24 @@
+import json
 import os
-import random
 import time
 
 # http://docs.tweepy.org/en/latest/index.html
 import tweepy
 
+from twitter.hydration import HYDRATION_WORKERS, OEMBED_LIMIT, STATUSES_LOOKUP_LIMIT, Checkpoint, RateLimiter, \
+    batched, call_with_retries, checkpoint_path, fetch_oembed, hydrate, lookup_statuses
+from twitter import tweet_corpus
+from twitter.partition_writer import PartitionWriter, manifest_path, read_partition
 from twitter.state_data_aggregator import STATE_TO_CODE_MAP
+from twitter.tweet_id_sampler import file_rng, sample_file, sample_files
 from twitter.twitter_secret_fetcher import get_api_key, get_api_secret_key, get_access_token, get_access_token_secret
 
 # Percentage of COVID tweets to sample, there are 239,861,658 in total and roughly 2,000,000 with geo tags
 SAMPLE_PERCENTAGE = .0001
+# Seed for the tweet id samples, None draws a different sample on every run
+SAMPLE_SEED = None
+# Tweets sampled from each state's geo tagged tweets for the embedded examples
+NUM_STATE_TWEETS = 1
 # Directory containing files that have COVID tweet IDs
 # I left this out of the git repo because it takes a LONG time to push and pull. So if you want to run this, just
 # download it your self and place them in this directory
@@ -22,6 +31,10 @@ COVID_TWEET_TEXT_DIR = "../data/tweets/covid_tweets"
 GEO_COVID_TWEET_TEXT_DIR = "../data/tweets/geo_covid_tweets"
 # Directory with embedded tweet html
 GEO_OEMBEDS = "tweets/geo_oembeds"
+OEMBEDS_FILE = "oembeds.jsonl"
+# Shared by every hydration job of the process, the API's limits are per account, not per job
+STATUSES_LOOKUP_LIMITER = RateLimiter(STATUSES_LOOKUP_LIMIT)
+OEMBED_LIMITER = RateLimiter(OEMBED_LIMIT)
 
 
 ###############################################
@@ -30,52 +43,67 @@ GEO_OEMBEDS = "tweets/geo_oembeds"
 
 # Tweet IDs come from here: https://dataverse.harvard.edu/dataset.xhtml?persistentId=doi:10.7910/DVN/LW0BTB
 # More Twitter Data: https://tweetsets.library.gwu.edu/dataset/369433fd
-def sample_tweet_ids(use_geo_tweets=False):
-    sampled_ids = []
+def sample_tweet_ids(use_geo_tweets=False, seed=SAMPLE_SEED, deterministic=False, workers=None):
+    # Every file of the directory is sampled in its own worker process. Passing a seed makes the sample reproducible,
+    # deterministic picks ids by a hash of the id, so the same ids are sampled however the files are split up
     directory = GEO_COVID_TWEET_IDS if use_geo_tweets else COVID_TWEET_ID_DIR
-    for file_name in os.listdir(directory):
-        if os.path.isfile(os.path.join(directory, file_name)):
-            sampled_ids.extend(sample_tweet_ids_from_file(directory, file_name))
+    paths = [os.path.join(directory, file_name) for file_name in sorted(os.listdir(directory))
+             if os.path.isfile(os.path.join(directory, file_name))]
+    sampled_ids = []
+    for path, file_ids in sample_files(paths, workers, probability=sample_probability(), seed=seed,
+                                       deterministic=deterministic).items():
+        sampled_ids.extend(file_ids)
+        print(f"Sampled {os.path.basename(path)}")
     return sampled_ids
 
 
-def sample_tweet_ids_from_file(directory, file_name):
-    # We have to read through every line which could be time consuming. If this becomes a bottleneck look into algo #3
-    # from here: http://metadatascience.com/2014/02/27/random-sampling-from-very-large-files/ or some other faster algo
-    sampled_ids = []
-    with open(f"{directory}/{file_name}") as f:
-        for tweet_id in f.readlines():
-            if should_sample():
-                sampled_ids.append(int(tweet_id.strip()))
+def sample_tweet_ids_from_file(directory, file_name, seed=SAMPLE_SEED, deterministic=False):
+    # Reads the file a block at a time and skips ahead to the next sampled line instead of drawing for every line
+    sampled_ids = sample_file(f"{directory}/{file_name}", probability=sample_probability(), seed=seed,
+                              deterministic=deterministic)
     print(f"Sampled {file_name}")
     return sampled_ids
 
 
-def should_sample():
-    if SAMPLE_PERCENTAGE == 1:
-        return True
+def sample_probability():
     # Since we're going to limit to english tweets, we'll make the naive assumption that half of the tweets are english
-    return random.random() < SAMPLE_PERCENTAGE * 2
+    return min(SAMPLE_PERCENTAGE * 2, 1)
 
 
-def sample_all_state_tweet_ids():
-    state_tweet_ids = {}
-    for _, code in STATE_TO_CODE_MAP.items():
-        state_tweet_ids[code] = sample_state_tweet_ids(code)
-        print(f"Done sampling tweet ids from {code}")
+def sample_all_state_tweet_ids(seed=SAMPLE_SEED, workers=None):
+    codes = list(STATE_TO_CODE_MAP.values())
+    state_tweet_ids = {code: sample_state_corpus_ids(code, seed) for code in codes}
+    # States without a corpus that knows its tweet ids are sampled from their id files in parallel
+    paths = {code: state_tweet_ids_path(code) for code in codes if state_tweet_ids[code] is None}
+    sampled = sample_files(list(paths.values()), workers, k=NUM_STATE_TWEETS, seed=seed)
+    state_tweet_ids.update({code: sampled[path] for code, path in paths.items()})
+    print(f"Done sampling tweet ids from {len(codes)} states")
     return state_tweet_ids
 
 
-def sample_state_tweet_ids(state):
-    number_to_sample = 1
-    file_name = f"{GEO_COVID_TWEET_IDS}/geo/{state}.txt"
-    if os.path.exists(file_name):
-        with open(file_name) as f:
-            tweet_ids = f.readlines()
-            random.shuffle(tweet_ids)
-            return tweet_ids[:number_to_sample]
-    else:
-        return []
+def sample_state_tweet_ids(state, seed=SAMPLE_SEED):
+    # A reservoir sample, so the state's file is never loaded as a whole
+    sampled = sample_state_corpus_ids(state, seed)
+    if sampled is not None:
+        return sampled
+    return sample_file(state_tweet_ids_path(state), k=NUM_STATE_TWEETS, seed=seed)
+
+
+def sample_state_corpus_ids(state, seed=SAMPLE_SEED):
+    # Ids sampled from the state's tweet corpus, which only decompresses the blocks holding the sampled tweets. None if
+    # the state has no corpus or its tweets were stored without ids
+    text_path = f"{GEO_COVID_TWEET_TEXT_DIR}/{state}.txt"
+    if not tweet_corpus.is_fresh(text_path):
+        return None
+    path = tweet_corpus.corpus_path(text_path)
+    tweets = tweet_corpus.TweetCorpus(path).sample(NUM_STATE_TWEETS, file_rng(path, seed))
+    if any(tweet.id == 0 for tweet in tweets):
+        return None
+    return [tweet.id for tweet in tweets]
+
+
+def state_tweet_ids_path(state):
+    return f"{GEO_COVID_TWEET_IDS}/geo/{state}.txt"
 
 
 ###############################################
@@ -90,48 +118,53 @@ def connect_to_twitter():
 
 def get_tweets_by_state(api):
     for state, state_code in STATE_TO_CODE_MAP.items():
-        if os.path.exists(f"{GEO_COVID_TWEET_IDS}/geo/{state_code}.txt"):
-            with open(f"{GEO_COVID_TWEET_IDS}/geo/{state_code}.txt") as f:
-                tweet_ids = [tweet_id.strip() for tweet_id in f.readlines()]
-                print(f"Fetching tweets for {state}")
-                get_tweets(tweet_ids, api, True, state_code)
-                print(f"Done fetching tweets for {state}")
+        if os.path.exists(state_tweet_ids_path(state_code)):
+            # Only the ids committed to the file, it is written by a PartitionWriter
+            tweet_ids = [tweet_id.strip() for tweet_id in read_partition(state_tweet_ids_path(state_code))
+                         if tweet_id.strip()]
+            print(f"Fetching tweets for {state}")
+            get_tweets(tweet_ids, api, True, state_code)
+            print(f"Done fetching tweets for {state}")
 
 
-def get_tweets(tweet_ids, api, use_geo_data=False, state=None):
+def get_tweets(tweet_ids, api, use_geo_data=False, state=None, workers=HYDRATION_WORKERS, compression=None):
     # We add the timestamp to the file name as a unique identifier so we don't overwrite older files
     ts = time.time()
     # Only needed for tweets witout geo data
     file_name = f"{COVID_TWEET_TEXT_DIR}/tweets_{ts}.txt"
-    i = 0
-    # Can only fetch tweets in batches of 100
-    while i < len(tweet_ids):
-        # Super hacky I know
-        try:
-            tweets = api.statuses_lookup(tweet_ids[i:i + 100], include_entities=True, tweet_mode='extended')
-        except tweepy.RateLimitError:
-            # In case we hit the rate limit wait 15 minutes and try again
-            # https://developer.twitter.com/en/docs/twitter-api/v1/rate-limits
-            time.sleep(15 * 60)
-            try:
-                tweets = api.statuses_lookup(tweet_ids[i:i + 100], include_entities=True, tweet_mode='extended')
-            except tweepy.error.TweepError:
-                pass
-        except tweepy.error.TweepError:
-            try:
-                tweets = api.statuses_lookup(tweet_ids[i:i + 100], include_entities=True, tweet_mode='extended')
-            except:
-                pass
-
-        if use_geo_data:
-            clean_and_flush_with_geo(tweets, state)
-        else:
-            clean_and_flush_without_geo(tweets, file_name)
-        i += 100
-        print(f"finished tweet batch {int(i / 100)}")
-
-
-def clean_and_flush_with_geo(tweets, state=None):
+    # Can only fetch tweets in batches of 100. Batches are fetched concurrently and an interrupted run resumes from
+    # the batches whose tweets hadn't been committed to disk yet
+    batches = batched(tweet_ids)
+    checkpoint = Checkpoint(checkpoint_path(f"tweets_{state or 'all'}", batches), autosave=False)
+    finished = len(checkpoint.done)
+
+    with PartitionWriter(compression) as writer:
+        def flush_batch(batch, tweets):
+            nonlocal finished
+            if use_geo_data:
+                committed = clean_and_flush_with_geo(tweets, state, writer)
+            else:
+                committed = clean_and_flush_without_geo(tweets, file_name, writer)
+            if committed:
+                checkpoint.save()
+            finished += 1
+            print(f"finished tweet batch {finished} of {len(batches)}")
+
+        def poll():
+            # Lines that reached their age limit are committed even while no batch comes back
+            if writer.poll():
+                checkpoint.save()
+
+        failed = hydrate(batches, lookup_statuses, flush_batch, api, STATUSES_LOOKUP_LIMITER, workers, checkpoint,
+                         poll)
+        writer.flush()
+    checkpoint.save()
+    if not failed:
+        checkpoint.finish()
+    return failed
+
+
+def clean_and_flush_with_geo(tweets, state=None, writer=None):
     tweets_by_state = {}
     filtered_tweets = [tweet for tweet in tweets if
                        tweet.lang == 'en' and tweet.place and tweet.place.country_code == 'US']
@@ -145,11 +178,13 @@ def clean_and_flush_with_geo(tweets, state=None):
             else:
                 tweets_by_state[state] = [tweet]
 
+    committed = False
     for state, tweets in tweets_by_state.items():
         tweet_ids = [tweet.id for tweet in tweets]
-        flush_list(tweet_ids, f"{GEO_COVID_TWEET_IDS}/geo/{state}.txt")
+        committed |= flush_list(tweet_ids, f"{GEO_COVID_TWEET_IDS}/geo/{state}.txt", writer)
         tweet_texts = [clean_tweet(tweet) for tweet in tweets]
-        flush_list(tweet_texts, f"{GEO_COVID_TWEET_TEXT_DIR}/{state}.txt")
+        committed |= flush_list(tweet_texts, f"{GEO_COVID_TWEET_TEXT_DIR}/{state}.txt", writer)
+    return committed
 
 
 def get_state_from_tweet(tweet):
@@ -163,10 +198,10 @@ def get_state_from_tweet(tweet):
         return state
 
 
-def clean_and_flush_without_geo(tweets, file_name):
+def clean_and_flush_without_geo(tweets, file_name, writer=None):
     # Limit to english tweets
     tweet_text = [clean_tweet(tweet) for tweet in tweets if tweet.lang == 'en']
-    flush_list(tweet_text, file_name)
+    return flush_list(tweet_text, file_name, writer)
 
 
 def clean_tweet(tweet):
@@ -184,52 +219,67 @@ def clean_tweet(tweet):
     return tweet_text.replace('\n', '').replace('\r', '')
 
 
-def flush_list(list_, file_name):
+def flush_list(list_, file_name, writer=None):
+    # With a writer the lines are buffered in it, returns whether the writer committed what it had buffered before
+    if writer is not None:
+        return writer.write(file_name, list_)
     with open(file_name, "a+") as f:
         f.writelines(f"{elem}\n" for elem in list_)
+    return True
 
 
 def get_tweet_oembed(tweet_id, api):
-    # Super hacky I know
-    try:
-        tweet = api.get_oembed(tweet_id)
-    except tweepy.RateLimitError:
-        # In case we hit the rate limit wait 15 minutes and try again
-        # https://developer.twitter.com/en/docs/twitter-api/v1/rate-limits
-        time.sleep(15 * 60)
-        try:
-            tweet = api.get_oembed(tweet_id)
-        except tweepy.error.TweepError:
-            pass
-    except tweepy.error.TweepError:
-        try:
-            tweet = api.get_oembed(tweet_id)
-        except:
-            pass
-
-    return tweet["html"]
-
-
-def download_tweet_oembeds(api):
+    return call_with_retries(fetch_oembed, api, tweet_id, OEMBED_LIMITER)
+
+
+def download_tweet_oembeds(api, workers=HYDRATION_WORKERS):
     state_tweet_ids = sample_all_state_tweet_ids()
-    for state, tweet_ids in state_tweet_ids.items():
-        for tweet_id in tweet_ids:
-            tweet_html = get_tweet_oembed(tweet_id, api)
-            ts = time.time()
-            file_name = f"../data/{GEO_OEMBEDS}/{state}/{state}_{ts}.html"
-            flush_list([tweet_html], file_name)
-        print(f"Done fetching tweets for {state}")
+    # One (state, tweet id) item per request, all states are fetched concurrently
+    items = [(state, tweet_id) for state, tweet_ids in state_tweet_ids.items() for tweet_id in tweet_ids]
+    checkpoint = Checkpoint(checkpoint_path("oembeds", items), autosave=False)
+
+    # Each state's oEmbeds are appended to one file, one json encoded html string per line, instead of a file each
+    with PartitionWriter() as writer:
+        def flush_oembed(item, tweet_html):
+            state, _ = item
+            if writer.write(oembeds_path("../data", state), [json.dumps(tweet_html)]):
+                checkpoint.save()
+            print(f"Done fetching tweets for {state}")
+
+        def poll():
+            if writer.poll():
+                checkpoint.save()
+
+        failed = hydrate(items, lambda api, item: fetch_oembed(api, item[1]), flush_oembed, api, OEMBED_LIMITER,
+                         workers, checkpoint, poll)
+        writer.flush()
+    checkpoint.save()
+    if not failed:
+        checkpoint.finish()
+    return [items[index] for index in failed]
+
+
+def oembeds_path(data_dir, state):
+    return f"{data_dir}/{GEO_OEMBEDS}/{state}/{OEMBEDS_FILE}"
+
+
+def oembed_sources(data_dir, state):
+    # Files get_saved_tweet_oembeds reads, the directory changes whenever an html file is added to it
+    directory = f"{data_dir}/{GEO_OEMBEDS}/{state}"
+    return [directory, oembeds_path(data_dir, state), manifest_path(directory)]
 
 
 def get_saved_tweet_oembeds(data_dir, state):
     tweet_oembeds = []
     directory = f"{data_dir}/{GEO_OEMBEDS}/{state}"
-    for file_name in os.listdir(directory):
-        if os.path.isfile(os.path.join(directory, file_name)):
+    # Older downloads saved one html file per tweet
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.endswith(".html") and os.path.isfile(os.path.join(directory, file_name)):
             with open(f"{directory}/{file_name}", encoding="utf-8") as f:
                 lines = f.readlines()
                 html = "\n".join(lines)
                 tweet_oembeds.append(html)
+    tweet_oembeds.extend(json.loads(line) for line in read_partition(oembeds_path(data_dir, state)))
     return tweet_oembeds
 
 
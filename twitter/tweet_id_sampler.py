@@ -0,0 +1,163 @@
+import math
+import mmap
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from twitter.partition_writer import committed_size
+
+# Files are read through a memory map one block at a time, so sampling takes the same memory for any file size
+BLOCK_BYTES = 16 * 1024 ** 2
+NEWLINE = ord("\n")
+WHITESPACE = np.frombuffer(b" \t\n\r\v\f", dtype=np.uint8)
+ZERO = ord("0")
+# Tweet ids are 64 bit integers below 2 ** 63, so no id has more digits
+MAX_DIGITS = 19
+
+
+def iter_blocks(path, block_bytes=BLOCK_BYTES):
+    # Blocks of whole lines, every block ends with a newline. Files written through a PartitionWriter are only read up
+    # to their last committed write, so a torn tail is never sampled
+    size = committed_size(path)
+    if size == 0:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < len(mm):
+            end = min(start + block_bytes, len(mm))
+            if end < len(mm):
+                last_newline = mm.rfind(b"\n", start, end)
+                # A line longer than a block is kept whole
+                end = last_newline + 1 if last_newline >= start else mm.find(b"\n", end) + 1 or len(mm)
+            block = mm[start:end]
+            yield block if block.endswith(b"\n") else block + b"\n"
+            start = end
+
+
+def line_bounds(block):
+    # [start, end) of every line of a block that holds an id, without the whitespace around it. Lines that aren't a
+    # number (blank lines, headers, ...) are skipped instead of being parsed into garbage ids
+    arr = np.frombuffer(block, dtype=np.uint8)
+    ends = np.flatnonzero(arr == NEWLINE)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    # Positions of every byte that isn't whitespace, with a sentinel so the first of every line can be looked up
+    text = np.append(np.flatnonzero(~np.isin(arr, WHITESPACE)), len(arr))
+    first = text[np.searchsorted(text, starts)]
+    last = np.searchsorted(text, ends) - 1
+    # Lines of only whitespace end up with end <= start
+    ends = np.where(last >= 0, text[np.maximum(last, 0)] + 1, 0)
+    starts = first
+    non_digits = np.concatenate([[0], np.cumsum((arr < ZERO) | (arr > ZERO + 9))])
+    is_id = (ends > starts) & (ends - starts <= MAX_DIGITS) & (non_digits[ends] == non_digits[starts])
+    return arr, starts[is_id], ends[is_id]
+
+
+def parse_ids(arr, starts, ends):
+    # Tweet ids of the given lines, parsed all at once as a (line x digit) matrix right aligned on the last digit
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    width = int((ends - starts).max())
+    positions = ends[:, None] - width + np.arange(width)
+    digits = np.where(positions >= starts[:, None], arr[np.maximum(positions, 0)].astype(np.int64) - ZERO, 0)
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.uint64)
+    return digits.astype(np.uint64) @ powers
+
+
+def splitmix64(x):
+    # Well mixed 64 bit hash of every element, so hash based sampling doesn't depend on how ids were assigned
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def bernoulli_sample(path, probability, rng):
+    # Every line is kept with the given probability. Instead of a draw per line, the gap to the next kept line is drawn
+    # from a geometric distribution, so only the kept lines are ever parsed
+    if probability >= 1:
+        return [int(tweet_id) for tweet_id in all_ids(path)]
+    sampled = []
+    seen = 0
+    next_line = rng.geometric(probability) - 1
+    for block in iter_blocks(path):
+        arr, starts, ends = line_bounds(block)
+        picks = []
+        while next_line < seen + len(starts):
+            picks.append(next_line - seen)
+            next_line += rng.geometric(probability)
+        sampled.extend(int(tweet_id) for tweet_id in parse_ids(arr, starts[picks], ends[picks]))
+        seen += len(starts)
+    return sampled
+
+
+def hash_sample(path, probability, seed):
+    # Keeps the ids whose seeded hash falls below the probability. The same ids are kept on every run and whichever
+    # file or worker they are read by, at the cost of parsing every id
+    threshold = np.uint64(min(int(probability * 2 ** 64), 2 ** 64 - 1))
+    seed = np.uint64(seed)
+    sampled = []
+    for block in iter_blocks(path):
+        ids = parse_ids(*line_bounds(block))
+        sampled.extend(int(tweet_id) for tweet_id in ids[splitmix64(ids ^ seed) < threshold])
+    return sampled
+
+
+def reservoir_skip(weight, rng):
+    # Lines to skip before the next one that enters the reservoir (Li's algorithm L)
+    if weight >= 1:
+        return 0
+    return int(math.floor(math.log(1 - rng.random()) / math.log1p(-weight)))
+
+
+def reservoir_sample(path, k, rng):
+    # k lines drawn uniformly without replacement in one pass, skipping ahead between the lines that enter the
+    # reservoir instead of drawing for every line
+    reservoir = []
+    if k <= 0:
+        return reservoir
+    seen = 0
+    weight = math.exp(math.log(1 - rng.random()) / k)
+    next_line = k + reservoir_skip(weight, rng)
+    for block in iter_blocks(path):
+        arr, starts, ends = line_bounds(block)
+        fill = min(k - len(reservoir), len(starts))
+        reservoir.extend(int(tweet_id) for tweet_id in parse_ids(arr, starts[:fill], ends[:fill]))
+        while next_line < seen + len(starts):
+            line = next_line - seen
+            reservoir[rng.integers(k)] = int(parse_ids(arr, starts[line:line + 1], ends[line:line + 1])[0])
+            weight *= math.exp(math.log(1 - rng.random()) / k)
+            next_line += reservoir_skip(weight, rng) + 1
+        seen += len(starts)
+    return reservoir
+
+
+def all_ids(path):
+    for block in iter_blocks(path):
+        yield from parse_ids(*line_bounds(block))
+
+
+def file_rng(path, seed=None):
+    # Seeded per file so parallel runs draw the same lines as serial ones
+    if seed is None:
+        return np.random.default_rng()
+    return np.random.default_rng([seed, zlib.crc32(os.path.basename(path).encode("utf-8"))])
+
+
+def sample_file(path, probability=None, k=None, seed=None, deterministic=False):
+    # Either every id with the given probability (by hash of the id when deterministic) or k ids uniformly
+    if not os.path.exists(path):
+        return []
+    if k is not None:
+        return reservoir_sample(path, k, file_rng(path, seed))
+    if deterministic:
+        return hash_sample(path, probability, 0 if seed is None else seed)
+    return bernoulli_sample(path, probability, file_rng(path, seed))
+
+
+def sample_files(paths, workers=None, **kwargs):
+    # {path: sampled ids} with the files sampled in parallel, one per worker process (defaults to one per core)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(paths, executor.map(partial(sample_file, **kwargs), paths)))
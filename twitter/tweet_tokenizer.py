@@ -0,0 +1,207 @@
+import os
+import re
+import sys
+import time
+from functools import lru_cache
+
+import nltk
+from nltk.tokenize import NLTKWordTokenizer
+from nltk.tokenize.punkt import PunktTokenizer
+
+# Same word tokenizer nltk.word_tokenize runs on each sentence (an improved treebank tokenizer)
+treebank_tokenizer = NLTKWordTokenizer()
+
+# (Attempt to) Remove URLs
+URL_PATTERN = re.compile(r'https?://.*?\.(com|org|net|edu|gov)')
+# Whitespace separated chunks made only of these characters come out of the treebank tokenizer unchanged
+PLAIN_CHUNK_PATTERN = re.compile(r"[\w+=~^|/\\]+(-[\w+=~^|/\\]+)*-?")
+# Treebank splits a couple of plain words into two tokens (e.g. cannot -> can not)
+CONTRACTIONS_PATTERN = re.compile("|".join(regexp.pattern.replace("(?i)", "") for regexp in
+                                           treebank_tokenizer.CONTRACTIONS2 + treebank_tokenizer.CONTRACTIONS3),
+                                  re.IGNORECASE)
+# Characters the treebank tokenizer always splits off into tokens of their own (none of which survive valid_token)
+SEPARATOR_CHARS = r";@#$%&?!*\[\](){}<>«“‘„»”’`\"\u2012-\u2015"
+PIECE_PATTERN = re.compile(f"[^{SEPARATOR_CHARS}]+")
+# What can follow the period that ends a sentence for the treebank tokenizer to split it off
+SENTENCE_CLOSERS_PATTERN = re.compile(r"[\]\)}>\"'»”’]*")
+# Space separated closing brackets/quotes after the last period of a sentence (a " after a space is an opening quote)
+TRAILING_CLOSERS_PATTERN = re.compile(r"(?: +[\]\)}>'»”’][\]\)}>\"'»”’]*)+\s*$")
+# A chunk that ends a sentence with a single period (possibly followed by closing brackets/quotes)
+SENTENCE_END_PATTERN = re.compile(r"([^.])\.[\]\)}>\"']*$")
+# Anything appended to a chunk so the treebank tokenizer doesn't treat the end of the chunk as the end of a sentence
+NOT_FINAL_SENTINEL = " x"
+# Number of distinct (chunk, end of sentence) pairs to remember
+CHUNK_CACHE_SIZE = 2 ** 20
+
+# "exact" splits sentences with punkt like nltk.word_tokenize does and always gives the same tokens as the original
+# implementation. "fast" skips punkt and treats any chunk ending with a period as the end of a sentence
+TOKENIZER_MODES = ["exact", "fast"]
+
+
+def valid_token(token, stopwords):
+    # Removes some invalid tokens. rt is for retweets, somehow http/https made it through the url remove, and words
+    # that end in "..." are the end of a tweet and often partial words. We also remove covid and corona because those
+    # are going to be the most dominant words, but they don't really tell us anything. We already know that these tweets
+    # are about corona/covid
+    return len(token) > 3 and token != "rt" and token != "http" and token != "https" \
+           and not token.startswith("//t.co") and not token.endswith("...") and "corona" not in token \
+           and "covid" not in token and token not in stopwords
+
+
+def split_chunk(chunk, sentence_end):
+    # Splits the common chunks (hashtags, mentions, words followed by punctuation) without the treebank tokenizer.
+    # Returns None when the chunk needs the full set of treebank rules. Separator tokens are left out since
+    # valid_token drops them anyway
+    tokens = []
+    for match in PIECE_PATTERN.finditer(chunk):
+        piece = match.group()
+        if PLAIN_CHUNK_PATTERN.fullmatch(piece):
+            token = piece
+        else:
+            token, last = piece[:-1], piece[-1]
+            if last not in ".,:" or not PLAIN_CHUNK_PATTERN.fullmatch(token):
+                return None
+            if last == "." and not (sentence_end and SENTENCE_CLOSERS_PATTERN.fullmatch(chunk, match.end())):
+                # A period is only split off at the end of a sentence
+                token = piece
+        # The contraction patterns expect the whitespace treebank pads every token with
+        if CONTRACTIONS_PATTERN.search(token + " "):
+            return None
+        tokens.append(token)
+    return tuple(tokens)
+
+
+@lru_cache(maxsize=CHUNK_CACHE_SIZE)
+def tokenize_chunk(chunk, sentence_end):
+    # Apart from the final period of a sentence every treebank rule only looks inside a whitespace separated chunk,
+    # so tokenizing chunk by chunk (and caching the result) gives the same tokens as tokenizing the whole sentence
+    tokens = split_chunk(chunk, sentence_end)
+    if tokens is not None:
+        return tokens
+    if sentence_end:
+        return tuple(treebank_tokenizer.tokenize(chunk))
+    return tuple(treebank_tokenizer.tokenize(chunk + NOT_FINAL_SENTINEL)[:-1])
+
+
+def last_chunk(text, chunks):
+    # Index of the chunk that can end the sentence, trailing chunks made only of closing brackets/quotes don't count
+    match = TRAILING_CLOSERS_PATTERN.search(text)
+    closers = len(match.group().split()) if match else 0
+    return max(len(chunks) - 1 - closers, 0)
+
+
+def tokenize_sentence(sentence):
+    chunks = sentence.split()
+    last = last_chunk(sentence, chunks)
+    return [token for i, chunk in enumerate(chunks) for token in tokenize_chunk(chunk, i >= last)]
+
+
+def fast_sentence_end(chunk, abbreviations):
+    match = SENTENCE_END_PATTERN.search(chunk)
+    return match is not None and chunk[:match.end(1)] not in abbreviations
+
+
+def tokenize_fast(tweet, abbreviations):
+    chunks = tweet.split()
+    last = last_chunk(tweet, chunks)
+    return [token for i, chunk in enumerate(chunks)
+            for token in tokenize_chunk(chunk, i >= last or fast_sentence_end(chunk, abbreviations))]
+
+
+def prepare_tweet(tweet):
+    tweet = URL_PATTERN.sub(lambda m: " ", tweet)
+    return tweet.lower()
+
+
+@lru_cache(maxsize=1)
+def get_sentence_tokenizer():
+    # Same punkt model nltk.word_tokenize uses, read from the punkt_tab tables
+    return PunktTokenizer("english")
+
+
+@lru_cache(maxsize=1)
+def get_abbreviations():
+    # Abbreviations the punkt model knows, straight from its table (one per line)
+    try:
+        punkt_dir = nltk.data.find("tokenizers/punkt_tab/english/")
+    except LookupError:  # punkt hasn't been downloaded
+        return frozenset()
+    with open(os.path.join(str(punkt_dir), "abbrev_types.txt"), encoding="utf-8") as f:
+        return frozenset(line.strip() for line in f if line.strip())
+
+
+def tokenize_tweets(tweets, stopwords, mode="exact"):
+    # Batch version of word_cloud.clean_tweet, yields the cleaned tokens of each tweet
+    stopwords = frozenset(stopwords or ())
+    if mode == "exact":
+        sentence_tokenizer = get_sentence_tokenizer()
+        for tweet in tweets:
+            tokens = [token for sentence in sentence_tokenizer.tokenize(prepare_tweet(tweet))
+                      for token in tokenize_sentence(sentence)]
+            yield [token.strip() for token in tokens if valid_token(token.strip(), stopwords)]
+    elif mode == "fast":
+        abbreviations = get_abbreviations()
+        for tweet in tweets:
+            tokens = tokenize_fast(prepare_tweet(tweet), abbreviations)
+            yield [token.strip() for token in tokens if valid_token(token.strip(), stopwords)]
+    else:
+        raise ValueError(f"Unknown tokenizer mode {mode}, expected one of {TOKENIZER_MODES}")
+
+
+def reference_clean_tweet(tweet, stopwords):
+    # The original word_cloud.clean_tweet, kept to check the batch tokenizer against and to benchmark it
+    url_pattern = re.compile(r'https?://.*?\.(com|org|net|edu|gov)')
+    tweet = url_pattern.sub(lambda m: " ", tweet)
+    tweet = tweet.lower()
+    tokens = nltk.word_tokenize(tweet)
+    return [token.strip() for token in tokens if valid_token(token.strip(), stopwords)]
+
+
+def read_corpus(data_dir):
+    from twitter.state_data_aggregator import STATE_TO_CODE_MAP
+    from twitter.word_cloud import get_tweets
+
+    tweets = []
+    for code in STATE_TO_CODE_MAP.values():
+        try:
+            tweets.extend(get_tweets(data_dir, code))
+        except FileNotFoundError:
+            pass
+    return tweets
+
+
+def compare_modes(tweets, stopwords, modes=TOKENIZER_MODES):
+    # Number of tweets where each mode's tokens differ from the original implementation
+    expected = [reference_clean_tweet(tweet, stopwords) for tweet in tweets]
+    return {mode: sum(tokens != reference for tokens, reference in
+                      zip(tokenize_tweets(tweets, stopwords, mode), expected))
+            for mode in modes}
+
+
+def benchmark(tweets, stopwords):
+    timings = {}
+    start = time.perf_counter()
+    for tweet in tweets:
+        reference_clean_tweet(tweet, stopwords)
+    timings["reference"] = len(tweets) / (time.perf_counter() - start)
+    for mode in TOKENIZER_MODES:
+        tokenize_chunk.cache_clear()
+        start = time.perf_counter()
+        for _ in tokenize_tweets(tweets, stopwords, mode):
+            pass
+        timings[mode] = len(tweets) / (time.perf_counter() - start)
+    return timings
+
+
+def main(data_dir="data"):
+    stopwords = set(nltk.corpus.stopwords.words("english"))
+    tweets = read_corpus(data_dir)
+    print(f"Checking {len(tweets)} tweets against the original tokenizer")
+    for mode, mismatches in compare_modes(tweets, stopwords).items():
+        print(f"{mode}: {mismatches} tweets tokenized differently")
+    for mode, tweets_per_sec in benchmark(tweets, stopwords).items():
+        print(f"{mode}: {tweets_per_sec:,.0f} tweets/sec")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
@@ -1,5 +1,4 @@
 import os
-import re
 
 import nltk
 import numpy as np
@@ -8,20 +7,29 @@ import wordcloud
 from PIL import Image
 from nltk.stem.wordnet import WordNetLemmatizer
 
+from twitter.tweet_corpus import iter_tweet_texts
+from twitter.tweet_tokenizer import tokenize_tweets
+
 # File containing tweets
 TWEET_DATA_DIR = "tweets"
 TWEET_FILE = "covid_tweets/english_tweets_24_000.txt"
 # Geo tweet dir
 GEO_TWEET_DIR = "geo_covid_tweets"
+# Pre-rendered word clouds (and their cached masks), relative to the data dir
+WORD_CLOUD_DIR = "word_clouds"
+MASK_CACHE_DIR = "masks"
+GLOBAL_WORD_CLOUD = "World"
+# White border added around each state mask to help with state border detection
+MASK_PADDING = 5
 
 
 def get_tweets(data_dir, state=None):
+    # Streams the tweet texts, from the compressed corpus when it has been built (see twitter.tweet_corpus)
     if state:
         file = f"{TWEET_DATA_DIR}/{GEO_TWEET_DIR}/{state}.txt"
     else:
         file = f"{TWEET_DATA_DIR}/{TWEET_FILE}"
-    with open(f"{data_dir}/{file}", encoding="utf-8") as f:
-        return f.readlines()
+    return iter_tweet_texts(f"{data_dir}/{file}")
 
 
 def word_to_pos(word):
@@ -39,103 +47,98 @@ def word_to_pos(word):
     return 'n'
 
 
-def valid_token(token, stopwords):
-    # Removes some invalid tokens. rt is for retweets, somehow http/https made it through the url remove, and words
-    # that end in "..." are the end of a tweet and often partial words. We also remove covid and corona because those
-    # are going to be the most dominant words, but they don't really tell us anything. We already know that these tweets
-    # are about corona/covid
-    return len(token) > 3 and token != "rt" and token != "http" and token != "https" \
-           and not token.startswith("//t.co") and not token.endswith("...") and "corona" not in token \
-           and "covid" not in token and token not in stopwords
-
-
 def clean_tweet(tweet, lemmatizer, stopwords):
-    # (Attempt to) Remove URLs
-    url_pattern = re.compile(r'https?://.*?\.(com|org|net|edu|gov)')
-    tweet = url_pattern.sub(lambda m: " ", tweet)
-    tweet.replace("'", "")
-    tweet = tweet.lower()
-
-    tokens = nltk.word_tokenize(tweet)
-
     # The lemmatizer doesn't really give us any better results and it cause a pretty big performance hit. For now I'm
     # leaving it out, but we can add it back in later
     # tokens = [lemmatizer.lemmatize(token, pos=word_to_pos(token)) for token in tokens if valid_token(token, stopwords)]
-
-    tokens = [token.strip() for token in tokens if valid_token(token.strip(), stopwords)]
-
-    return tokens
+    return next(tokenize_tweets([tweet], stopwords))
 
 
-def clean_tweets(tweets, lemmatizer, stopwords):
-    return [clean_tweet(tweet, lemmatizer, stopwords) for tweet in tweets]
+def clean_tweets(tweets, lemmatizer, stopwords, mode="exact"):
+    # See tweet_tokenizer.TOKENIZER_MODES, "exact" gives the same tokens as tokenizing each tweet with nltk
+    return list(tokenize_tweets(tweets, stopwords, mode))
 
 
 def flatten_list(list_of_lists):
     return [element for lst in list_of_lists for element in lst]
 
 
-def append_white_row(arr, top=True):
-    white_row = np.full((1, arr.shape[1], 3), 255)
-    if top:
-        return np.concatenate((arr, white_row))
-    else:
-        return np.concatenate((white_row, arr))
+def mask_source_path(data_dir, state):
+    return f"{data_dir}/state_pics/{state}.jpg"
 
 
-def append_white_col(arr, left=True):
-    white_col = np.full((arr.shape[0], 1, 3), 255)
-    if left:
-        return np.concatenate((arr, white_col), axis=1)
-    else:
-        return np.concatenate((white_col, arr), axis=1)
+def mask_cache_path(data_dir, state):
+    return f"{data_dir}/{WORD_CLOUD_DIR}/{MASK_CACHE_DIR}/{state}.npy"
 
 
-def get_state_mask(data_dir, state):
-    if not state:
-        return None
-    file_name = f"{data_dir}/state_pics/{state}.jpg"
-    if not os.path.exists(file_name):
-        return None
-
-    img = Image.open(file_name)
-    mask = np.array(img, dtype='int')
+def create_state_mask(data_dir, state):
+    img = Image.open(mask_source_path(data_dir, state))
+    mask = np.array(img, dtype=np.uint8)
     mask[mask > 10] = 255
     mask[mask != 255] = 0
 
     # Add white rows and columns to edge of image to help with state border detection
-    for i in range(5):
-        mask = append_white_row(mask, True)
-        mask = append_white_row(mask, False)
-        mask = append_white_col(mask, True)
-        mask = append_white_col(mask, False)
+    return np.pad(mask, [(MASK_PADDING, MASK_PADDING), (MASK_PADDING, MASK_PADDING)] + [(0, 0)] * (mask.ndim - 2),
+                  constant_values=255)
+
+
+def is_mask_cached(data_dir, state):
+    cache_path = mask_cache_path(data_dir, state)
+    return os.path.exists(cache_path) and \
+        os.path.getmtime(cache_path) >= os.path.getmtime(mask_source_path(data_dir, state))
 
+
+def cache_state_mask(data_dir, state):
+    mask = create_state_mask(data_dir, state)
+    os.makedirs(os.path.dirname(mask_cache_path(data_dir, state)), exist_ok=True)
+    tmp_path = f"{mask_cache_path(data_dir, state)}.tmp.npy"
+    np.save(tmp_path, mask)
+    os.replace(tmp_path, mask_cache_path(data_dir, state))
     return mask
 
 
+def get_state_mask(data_dir, state):
+    if not state:
+        return None
+    if not os.path.exists(mask_source_path(data_dir, state)):
+        return None
+    if is_mask_cached(data_dir, state):
+        return np.load(mask_cache_path(data_dir, state))
+    return create_state_mask(data_dir, state)
+
+
+def word_cloud_path(data_dir, state=None):
+    return f"{data_dir}/{WORD_CLOUD_DIR}/{state if state else GLOBAL_WORD_CLOUD}.jpg"
+
+
 def create_wordcloud(flat_tweets, data_dir, state=None):
     tweet_str = " ".join(flat_tweets)
     state_mask = get_state_mask(data_dir, state)
     if state_mask is not None:
         word_cloud = wordcloud.WordCloud(background_color="white", mask=state_mask, contour_width=2,
                                          contour_color="steelblue", height=400, width=800).generate(tweet_str)
-        word_cloud.to_file(f"{data_dir}/word_clouds/{state}.jpg")
-        return word_cloud
+    elif state:
+        # No mask source for this state, same size and background as the masked clouds
+        word_cloud = wordcloud.WordCloud(background_color="white", height=400, width=800).generate(tweet_str)
     else:
         word_cloud = wordcloud.WordCloud().generate(tweet_str)
-        word_cloud.to_file(f"{data_dir}/word_clouds/World.jpg")
-        return word_cloud
+    # Write to a temporary file first so readers never see a half written image
+    path = word_cloud_path(data_dir, state)
+    tmp_path = f"{path[:-len('.jpg')]}.tmp.jpg"
+    word_cloud.to_file(tmp_path)
+    os.replace(tmp_path, path)
+    return word_cloud
 
 
 def get_wordcloud(words, data_dir, state=None):
     return create_wordcloud(words, data_dir, state)
 
 
-def get_cleaned_tweet_words(data_dir, state=None, stopwords=None):
+def get_cleaned_tweet_words(data_dir, state=None, stopwords=None, mode="exact"):
     lemmatizer = WordNetLemmatizer()
     # stopwords = set(nltk.corpus.stopwords.words("english"))
     # In case we want to re-include spanish tweets
     # stopwords.union(nltk.corpus.stopwords.words("spanish"))
     tweets = get_tweets(data_dir, state)
-    tweets = clean_tweets(tweets, lemmatizer, stopwords)
+    tweets = clean_tweets(tweets, lemmatizer, stopwords, mode)
     return flatten_list(tweets)
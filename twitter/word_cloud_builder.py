@@ -0,0 +1,62 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from twitter.nltk_resources import get_stopwords
+from twitter.state_data_aggregator import STATE_TO_CODE_MAP
+from twitter.word_cloud import cache_state_mask, create_wordcloud, get_cleaned_tweet_words, is_mask_cached, \
+    mask_source_path, word_cloud_path
+from twitter.word_counts import tweets_path
+
+DATA_DIR = "data"
+
+
+def word_cloud_inputs(data_dir, state=None):
+    # The mask source is optional, a state without one is rendered without a mask
+    inputs = [tweets_path(data_dir, state)]
+    if state and os.path.exists(mask_source_path(data_dir, state)):
+        inputs.append(mask_source_path(data_dir, state))
+    return inputs
+
+
+def is_stale(data_dir, state=None):
+    path = word_cloud_path(data_dir, state)
+    if not os.path.exists(path):
+        return True
+    return any(os.path.getmtime(path) < os.path.getmtime(source) for source in word_cloud_inputs(data_dir, state))
+
+
+def build_word_cloud(data_dir, state, stopwords):
+    # Runs in a worker process, returns the state so the caller can report progress
+    if state and os.path.exists(mask_source_path(data_dir, state)) and not is_mask_cached(data_dir, state):
+        cache_state_mask(data_dir, state)
+    create_wordcloud(get_cleaned_tweet_words(data_dir, state, stopwords), data_dir, state)
+    return state
+
+
+def build_word_clouds(data_dir=DATA_DIR, workers=None, force=False):
+    # Renders the word cloud of every state (and the global one) whose tweets or mask changed since it was last
+    # rendered, so the app only ever serves the pre-rendered images
+    states = []
+    for state in list(STATE_TO_CODE_MAP.values()) + [None]:
+        if not os.path.exists(tweets_path(data_dir, state)):
+            print(f"Skipping {state or 'World'}, missing {tweets_path(data_dir, state)}")
+        elif force or is_stale(data_dir, state):
+            if state and not os.path.exists(mask_source_path(data_dir, state)):
+                print(f"No mask at {mask_source_path(data_dir, state)}, rendering {state} without one")
+            states.append(state)
+    if not states:
+        print("All word clouds are up to date")
+        return
+
+    stopwords = get_stopwords()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(build_word_cloud, data_dir, state, stopwords) for state in states]
+        for future in as_completed(futures):
+            state = future.result()
+            print(f"Wrote {word_cloud_path(data_dir, state)}")
+
+
+if __name__ == "__main__":
+    # Optionally pass the data dir and the number of worker processes (defaults to one per core)
+    build_word_clouds(*sys.argv[1:2], *[int(arg) for arg in sys.argv[2:3]])
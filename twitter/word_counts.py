@@ -0,0 +1,190 @@
+import json
+import os
+import sys
+from collections import Counter
+
+import nltk
+import numpy as np
+import pandas as pd
+
+from twitter.partition_writer import find_partition
+from twitter.state_data_aggregator import STATE_TO_CODE_MAP
+from twitter.tweet_corpus import corpus_path
+from twitter.tweet_tokenizer import tokenize_tweets
+from twitter.word_cloud import GEO_TWEET_DIR, TWEET_DATA_DIR, TWEET_FILE, get_tweets
+
+# Directory (relative to the data dir) that holds the word count index
+WORD_COUNT_DIR = "word_counts"
+VOCABULARY_FILE = "vocabulary.json"
+# Fingerprints of everything the index was built from, written last so a build that didn't finish stays stale
+INDEX_MANIFEST_FILE = "index.json"
+# nltk data the index is made and read with: the punkt model tweets are split into sentences with and the stopword
+# list top_words filters the counts with. Resources that haven't been downloaded are left out
+NLTK_RESOURCES = ["tokenizers/punkt_tab/english", "corpora/stopwords/english"]
+# Name of the counts for the non geo tagged tweets, same name the pre-rendered word cloud uses
+GLOBAL_NAME = "World"
+
+
+def vocabulary_path(data_dir):
+    return f"{data_dir}/{WORD_COUNT_DIR}/{VOCABULARY_FILE}"
+
+
+def counts_path(data_dir, name):
+    return f"{data_dir}/{WORD_COUNT_DIR}/{name}.npy"
+
+
+def index_manifest_path(data_dir):
+    return f"{data_dir}/{WORD_COUNT_DIR}/{INDEX_MANIFEST_FILE}"
+
+
+def tweets_path(data_dir, state=None):
+    # The text tweets (plain or as written compressed), or their compressed corpus where only that was shipped
+    if state:
+        path = f"{data_dir}/{TWEET_DATA_DIR}/{GEO_TWEET_DIR}/{state}.txt"
+    else:
+        path = f"{data_dir}/{TWEET_DATA_DIR}/{TWEET_FILE}"
+    text_file = find_partition(path)
+    if text_file is None and os.path.exists(corpus_path(path)):
+        return corpus_path(path)
+    return text_file or path
+
+
+def all_sources(data_dir):
+    # (name, state) for every tweet file that exists, state is None for the global tweets
+    sources = [(code, code) for code in STATE_TO_CODE_MAP.values()] + [(GLOBAL_NAME, None)]
+    return [(name, state) for name, state in sources if os.path.exists(tweets_path(data_dir, state))]
+
+
+def count_words(data_dir, state=None):
+    # Stopwords aren't removed here so the same index works for any stopword list, see top_words
+    counts = Counter()
+    for tokens in tokenize_tweets(get_tweets(data_dir, state), None):
+        counts.update(tokens)
+    return counts
+
+
+def to_arrays(counts, word_ids):
+    # Row 0 holds vocabulary ids and row 1 their counts, most frequent first (ties in alphabetical order)
+    words = sorted(counts, key=lambda word: (-counts[word], word))
+    return np.array([[word_ids[word] for word in words], [counts[word] for word in words]], dtype=np.int32)
+
+
+def write_array(arr, path):
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, arr)
+    os.replace(tmp_path, path)
+
+
+def nltk_resource_paths():
+    paths = []
+    for resource in NLTK_RESOURCES:
+        try:
+            path = str(nltk.data.find(resource))
+        except LookupError:
+            continue
+        if os.path.isdir(path):
+            paths.extend(sorted(os.path.join(path, name) for name in os.listdir(path)))
+        elif os.path.isfile(path):
+            paths.append(path)
+    return paths
+
+
+def file_fingerprint(path):
+    # [size, mtime] of a file, None if it doesn't exist
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def input_fingerprints(data_dir, sources):
+    return {"sources": {name: file_fingerprint(tweets_path(data_dir, state)) for name, state in sources},
+            "nltk": {path: file_fingerprint(path) for path in nltk_resource_paths()}}
+
+
+def read_index_manifest(data_dir):
+    path = index_manifest_path(data_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json(value, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def is_stale(data_dir, name, state=None, manifest=None):
+    # The counts are only valid with the vocabulary they were built with, and only while the tweets and the nltk data
+    # are the ones they were made from
+    manifest = read_index_manifest(data_dir) if manifest is None else manifest
+    if manifest is None or not os.path.exists(counts_path(data_dir, name)):
+        return True
+    return manifest["vocabulary"] != file_fingerprint(vocabulary_path(data_dir)) or \
+        manifest["sources"].get(name) != file_fingerprint(tweets_path(data_dir, state)) or \
+        manifest["nltk"] != {path: file_fingerprint(path) for path in nltk_resource_paths()}
+
+
+def build_index(data_dir="data", force=False):
+    # The vocabulary is shared by every state, so the whole index is rebuilt when any tweet file changes
+    sources = all_sources(data_dir)
+    manifest = read_index_manifest(data_dir)
+    if not force and manifest is not None and not any(is_stale(data_dir, name, state, manifest)
+                                                      for name, state in sources):
+        print("Word count index is up to date")
+        return
+
+    # Taken before counting, so a tweet file written to meanwhile is counted again by the next build
+    inputs = input_fingerprints(data_dir, sources)
+    all_counts = {}
+    for name, state in sources:
+        all_counts[name] = count_words(data_dir, state)
+        print(f"Counted {len(all_counts[name])} distinct words for {name}")
+
+    vocabulary = sorted(set().union(*all_counts.values()))
+    word_ids = {word: i for i, word in enumerate(vocabulary)}
+    os.makedirs(f"{data_dir}/{WORD_COUNT_DIR}", exist_ok=True)
+    for name, counts in all_counts.items():
+        write_array(to_arrays(counts, word_ids), counts_path(data_dir, name))
+
+    write_json(vocabulary, vocabulary_path(data_dir))
+    write_json(dict(inputs, vocabulary=file_fingerprint(vocabulary_path(data_dir))), index_manifest_path(data_dir))
+    print(f"Wrote word counts for {len(all_counts)} tweet files ({len(vocabulary)} words) to {data_dir}/{WORD_COUNT_DIR}")
+
+
+def load_vocabulary(data_dir="data"):
+    path = vocabulary_path(data_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return np.array(json.load(f), dtype=object)
+
+
+def index_paths(state=None, data_dir="data"):
+    # Every file the top words of a state are read from (the tweets when the index hasn't been built)
+    return [vocabulary_path(data_dir), counts_path(data_dir, state if state else GLOBAL_NAME),
+            index_manifest_path(data_dir), tweets_path(data_dir, state)] + nltk_resource_paths()
+
+
+def load_word_counts(state=None, data_dir="data"):
+    # Returns None if the index hasn't been built (or is older than the tweets), callers can then tokenize the tweets
+    name = state if state else GLOBAL_NAME
+    if not os.path.exists(tweets_path(data_dir, state)) or is_stale(data_dir, name, state):
+        return None
+    return np.load(counts_path(data_dir, name), mmap_mode="r")
+
+
+def top_words(vocabulary, word_counts, n, stopwords=None):
+    # The counts are sorted, so the top n words without stopwords are within the first n + len(stopwords) entries
+    stopwords = set(stopwords or ())
+    head = word_counts[:, :n + len(stopwords)]
+    df = pd.DataFrame({"word": vocabulary[head[0]], "count": np.asarray(head[1])})
+    return df[~df["word"].isin(stopwords)].head(n).reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    build_index(*sys.argv[1:2])